@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+
+# Portable archives of a Vim installation, as zip, tar.xz, or tar.zst files:
+#
+#   archive.py OUTPUT SOURCE [SOURCE ...] [--prefix DIR] [--level EXT=N]
+#
+# Compression runs on a thread pool. Zip members are compressed on their own
+# while tar archives are cut in blocks compressed independently, which gives
+# concatenated xz streams or zstd frames that standard tools read as one.
+# Only a bounded number of members or blocks is kept in memory at a time and
+# large members are compressed while being written.
+#
+# Levels go from 0 to 9 and can be set per file extension. Level 0 stores zip
+# members without compression and uses the fastest setting for xz and zstd.
+# The zstd module is only needed for tar.zst archives.
+
+import argparse
+import collections
+import lzma
+import os
+import struct
+import tarfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ['zip', 'tar.xz', 'tar.zst']
+BLOCK_SIZE = 8 * 1024 * 1024
+DEFAULT_LEVEL = 6
+# Files already compressed are not worth compressing again while executables
+# are the largest files of the archive.
+DEFAULT_LEVELS = {
+    '.bmp': 9,
+    '.dll': 9,
+    '.exe': 9,
+    '.gif': 0,
+    '.gz': 0,
+    '.ico': 0,
+    '.jpg': 0,
+    '.png': 0,
+    '.zip': 0,
+}
+EXECUTABLE_EXTENSIONS = ['.exe', '.dll', '.bat', '.cmd']
+
+ZIP_VERSION = 20
+ZIP_UTF8_FLAG = 0x800
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_MAX_SIZE = 0xffffffff
+
+
+def get_format(output_path):
+    for archive_format in FORMATS:
+        if output_path.endswith('.' + archive_format):
+            return archive_format
+    raise RuntimeError('unknown archive format for {0}. Supported formats '
+                       'are {1}.'.format(output_path, ', '.join(FORMATS)))
+
+
+def get_level(name, levels):
+    extension = os.path.splitext(name)[1].lower()
+    return levels.get(extension, levels.get('', DEFAULT_LEVEL))
+
+
+def get_mode(name):
+    if os.path.splitext(name)[1].lower() in EXECUTABLE_EXTENSIONS:
+        return 0o755
+    return 0o644
+
+
+def get_entries(source, name):
+    # Yield (path, archive name) pairs for a file or all files of a folder.
+    if not os.path.isdir(source):
+        yield source, name
+        return
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            yield path, '/'.join(
+                part for part in [name] + os.path.relpath(
+                    path, source).split(os.sep) if part)
+
+
+def map_ordered(executor, function, items, window):
+    # Like executor.map, without submitting more than window items ahead of
+    # the results consumed.
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(function, *item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# Zip archives.
+
+def get_dos_time(timestamp):
+    # Zip times cannot be before 1980.
+    year, month, day, hour, minute, second = time.localtime(
+        max(timestamp, 315532800))[:6]
+    return (((year - 1980) << 9) | (month << 5) | day,
+            (hour << 11) | (minute << 5) | (second // 2))
+
+
+def compress_zip_member(path, level):
+    # Return the CRC, size, method, and compressed data of a member, or None
+    # for data when the member is too large to be held in memory.
+    if os.path.getsize(path) > BLOCK_SIZE:
+        return None
+    with open(path, 'rb') as member_file:
+        data = member_file.read()
+    crc = zlib.crc32(data)
+    if level == 0:
+        return crc, len(data), ZIP_STORED, data
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return (crc, len(data), ZIP_DEFLATED,
+            compressor.compress(data) + compressor.flush())
+
+
+def write_zip_header(archive_file, name, method, crc, compressed_size, size,
+                     timestamp):
+    date, dos_time = get_dos_time(timestamp)
+    encoded_name = name.encode('utf8')
+    archive_file.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, ZIP_VERSION,
+                                   ZIP_UTF8_FLAG, method, dos_time, date, crc,
+                                   compressed_size, size, len(encoded_name),
+                                   0))
+    archive_file.write(encoded_name)
+
+
+def write_large_zip_member(archive_file, path, name, level, timestamp):
+    # Compress the member while writing it, then fill in its header.
+    header_offset = archive_file.tell()
+    method = ZIP_STORED if level == 0 else ZIP_DEFLATED
+    write_zip_header(archive_file, name, method, 0, 0, 0, timestamp)
+    data_offset = archive_file.tell()
+
+    crc = 0
+    size = 0
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    with open(path, 'rb') as member_file:
+        for chunk in iter(lambda: member_file.read(BLOCK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            archive_file.write(chunk if method == ZIP_STORED
+                               else compressor.compress(chunk))
+    if method == ZIP_DEFLATED:
+        archive_file.write(compressor.flush())
+    end_offset = archive_file.tell()
+
+    archive_file.seek(header_offset)
+    write_zip_header(archive_file, name, method, crc,
+                     end_offset - data_offset, size, timestamp)
+    archive_file.seek(end_offset)
+    return crc, size, method, end_offset - data_offset
+
+
+def write_zip(output_path, entries, levels, jobs):
+    central_directory = []
+    with open(output_path, 'wb') as archive_file:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            members = map_ordered(
+                executor,
+                lambda path, name: (path, name,
+                                    compress_zip_member(
+                                        path, get_level(name, levels))),
+                entries, 2 * executor._max_workers)
+            for path, name, member in members:
+                offset = archive_file.tell()
+                timestamp = os.path.getmtime(path)
+                if member is None:
+                    crc, size, method, compressed_size = (
+                        write_large_zip_member(archive_file, path, name,
+                                               get_level(name, levels),
+                                               timestamp))
+                else:
+                    crc, size, method, data = member
+                    compressed_size = len(data)
+                    write_zip_header(archive_file, name, method, crc,
+                                     compressed_size, size, timestamp)
+                    archive_file.write(data)
+                if archive_file.tell() > ZIP_MAX_SIZE:
+                    raise RuntimeError('zip archives larger than 4GB are '
+                                       'not supported.')
+                central_directory.append((name, method, crc, compressed_size,
+                                          size, timestamp, offset))
+
+        directory_offset = archive_file.tell()
+        for (name, method, crc, compressed_size, size, timestamp,
+             offset) in central_directory:
+            date, dos_time = get_dos_time(timestamp)
+            encoded_name = name.encode('utf8')
+            archive_file.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | ZIP_VERSION,
+                ZIP_VERSION, ZIP_UTF8_FLAG, method, dos_time, date, crc,
+                compressed_size, size, len(encoded_name), 0, 0, 0, 0,
+                (0o100000 | get_mode(name)) << 16, offset))
+            archive_file.write(encoded_name)
+        directory_size = archive_file.tell() - directory_offset
+        archive_file.write(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, len(central_directory),
+            len(central_directory), directory_size, directory_offset, 0))
+
+
+# Tar archives.
+
+def get_tar_chunks(entries, levels):
+    # Yield (level, data) chunks of the tar stream, at most BLOCK_SIZE long.
+    for path, name in entries:
+        level = get_level(name, levels)
+        info = tarfile.TarInfo(name)
+        info.size = os.path.getsize(path)
+        info.mtime = int(os.path.getmtime(path))
+        info.mode = get_mode(name)
+        yield level, info.tobuf(tarfile.PAX_FORMAT)
+        with open(path, 'rb') as member_file:
+            for chunk in iter(lambda: member_file.read(BLOCK_SIZE), b''):
+                yield level, chunk
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            yield level, b'\0' * padding
+    yield levels.get('', DEFAULT_LEVEL), b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+def get_tar_blocks(entries, levels):
+    # Group chunks of the same level in blocks of about BLOCK_SIZE.
+    block = bytearray()
+    block_level = None
+    for level, chunk in get_tar_chunks(entries, levels):
+        if block and (level != block_level or
+                      len(block) + len(chunk) > BLOCK_SIZE):
+            yield bytes(block), block_level
+            block = bytearray()
+        block_level = level
+        block.extend(chunk)
+    if block:
+        yield bytes(block), block_level
+
+
+def compress_xz_block(data, level):
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+
+def compress_zstd_block(data, level):
+    # zstd levels go from 1 to 19.
+    compressor = zstandard.ZstdCompressor(level=1 + 2 * level)
+    return compressor.compress(data)
+
+
+def write_tar(output_path, entries, levels, jobs, compress_block):
+    with open(output_path, 'wb') as archive_file:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for data in map_ordered(executor, compress_block,
+                                    get_tar_blocks(entries, levels),
+                                    2 * executor._max_workers):
+                archive_file.write(data)
+
+
+def create_archive(output_path, entries, levels=None, jobs=None):
+    # Entries are (path, archive name) pairs.
+    levels = dict(DEFAULT_LEVELS, **(levels or {}))
+    archive_format = get_format(output_path)
+    if archive_format == 'zip':
+        write_zip(output_path, entries, levels, jobs)
+    elif archive_format == 'tar.xz':
+        write_tar(output_path, entries, levels, jobs, compress_xz_block)
+    else:
+        if zstandard is None:
+            raise RuntimeError('zstandard module is required for tar.zst '
+                               'archives.')
+        write_tar(output_path, entries, levels, jobs, compress_zstd_block)
+
+
+def parse_level(value):
+    extension, separator, level = value.rpartition('=')
+    if not separator or not level.isdigit() or int(level) > 9:
+        raise argparse.ArgumentTypeError(
+            'level must be EXT=N with N from 0 to 9.')
+    if extension and not extension.startswith('.'):
+        extension = '.' + extension
+    return extension.lower(), int(level)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output', help='archive path ({0}).'.format(
+        ', '.join('*.' + archive_format for archive_format in FORMATS)))
+    parser.add_argument('sources', nargs='+',
+                        help='files and folders to archive.')
+    parser.add_argument('--prefix', type=str, default='',
+                        help='folder of the sources in the archive.')
+    parser.add_argument('--level', type=parse_level, action='append',
+                        default=[], metavar='EXT=N',
+                        help='compression level for files with extension '
+                        'EXT, or for all other files if EXT is empty '
+                        '(default: {0}).'.format(DEFAULT_LEVEL))
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of compression threads (default: '
+                        'number of processors).')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    entries = []
+    for source in args.sources:
+        name = '/'.join(part for part in [args.prefix.strip('/'),
+                                          os.path.basename(
+                                              os.path.normpath(source))]
+                        if part)
+        entries.extend(get_entries(source, name))
+    create_archive(args.output, entries, dict(args.level), args.jobs)
+
+
+if __name__ == '__main__':
+    main()
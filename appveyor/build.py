@@ -1,22 +1,86 @@
 #!/usr/bin/env python
 
 import argparse
+import filecmp
+import fnmatch
+import glob
+import hashlib
+import json
 import os
-import subprocess
 import platform
 import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
 from distutils.spawn import find_executable
 
+import buildlog
+import buildprof
+import compiler_cache
+import msgfmt
+import pch
+import pmake
+import toolchain
+import unity
+
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.join(SCRIPT_DIR, '..', 'vim')
 SOURCES_DIR = os.path.join(ROOT_DIR, 'src')
 RUNTIME_DIR = os.path.join(ROOT_DIR, 'runtime')
 TRANSLATIONS_DIR = os.path.join(SOURCES_DIR, 'po')
 
-MAKE_PATH = os.path.join(SOURCES_DIR, 'Make_mvc.mak')
-APPVEYOR_MAKE_PATH = os.path.join(SOURCES_DIR, 'Make_mvc_appveyor.mak')
-
-MSVC_BIN_DIR = os.path.join('..', '..', 'VC')
+MAKE_NAME = 'Make_mvc.mak'
+# Console and GUI variants are built in their own copy of the sources when
+# building them concurrently.
+VARIANTS_DIR = os.path.join(SCRIPT_DIR, '..', 'build')
+VARIANT_IGNORED_PATTERNS = ['Obj*', '*.exe', '*.pdb', '*.pgc', '*.pgd',
+                            '.fingerprint-*', unity.UNITY_PATTERN,
+                            pch.CREATOR_NAME]
+# Files produced by each variant that are copied back to the sources folder
+# once a concurrent build is done.
+VARIANT_OUTPUTS = {
+    False: ['vim.exe',
+            'vim.pdb'],
+    True: ['gvim.exe',
+           'gvim.pdb',
+           'vimrun.exe',
+           'install.exe',
+           'uninstal.exe',
+           os.path.join('xxd', 'xxd.exe'),
+           os.path.join('tee', 'tee.exe')]
+}
+
+# Fingerprint of the last successful build of a variant, used to skip the
+# clean step in incremental mode.
+FINGERPRINT_NAME = '.fingerprint-{0}.json'
+FINGERPRINT_EXTENSIONS = ['.c', '.cpp', '.h', '.pro', '.rc', '.def', '.mak']
+# Generated sources are not part of the fingerprint.
+FINGERPRINT_IGNORED_DIRS = ['auto']
+
+# Hashes of the PO files of each language when last compiled, used to skip
+# unchanged languages.
+TRANSLATIONS_INDEX_PATH = os.path.join(SCRIPT_DIR, '..', 'cache',
+                                       'translations', 'index.json')
+
+# Training workload run by instrumented executables in PGO mode, and number of
+# times it is run to compare the speed of normal and optimized executables.
+PGO_TRAINING_SCRIPT = os.path.join(SCRIPT_DIR, 'pgo_training.vim')
+PGO_TIMING_RUNS = 3
+
+# Compiler flags only affecting preprocessing. Objects of sources with the
+# same preprocessed output and the same other flags are identical.
+PREPROCESSOR_FLAGS = ['/D', '/U', '/I', '/FI']
+
+# Duration of the last full build of each variant in normal and unity modes.
+UNITY_TIMES_DIR = os.path.join(SCRIPT_DIR, '..', 'cache', 'unity')
+
+# Build matrix: configurations are built in their own folder under this one by
+# default.
+MATRIX_DIR = os.path.join(VARIANTS_DIR, 'matrix')
+MATRIX_MEMORY_PER_JOB = 1.0
 
 VERSION_REGEX = re.compile('([0-9]+).([0-9]+)(.([0-9]+)){0,2}')
 
@@ -178,43 +242,28 @@ def get_tcl_build_args(args):
             'TCL_DLL={0}'.format(tcl_dll)]
 
 
-def get_msvc_dir(args):
-    if args.msvc == 11:
-        return os.path.join(os.environ['VS110COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 12:
-        return os.path.join(os.environ['VS120COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 14:
-        return os.path.join(os.environ['VS140COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 15:
-        return get_msvc15_dir()
-    raise RuntimeError('msvc parameter should be 11, 12, 14, or 15.')
-
-
-def get_msvc15_dir():
-    vswhere = os.path.join(os.environ['ProgramFiles(x86)'],
-                           'Microsoft Visual Studio',
-                           'Installer',
-                           'vswhere.exe')
-    if not os.path.exists(vswhere):
-        raise RuntimeError('cannot find vswhere. '
-                           'VS 2017 version 15.2 or later is required.')
+def get_nmake_cmd(args, timings_path=None):
+    if args.jobs > 1:
+        nmake_cmd = [sys.executable, pmake.PMAKE_PATH, '-j', str(args.jobs)]
+        if timings_path:
+            nmake_cmd.append('--timings={0}'.format(timings_path))
+        return nmake_cmd
+    return toolchain.get_nmake_cmd(args.msvc, args.arch)
 
-    installation_path = subprocess.check_output(
-        [vswhere, '-latest', '-property', 'installationPath']
-    ).strip().decode('utf8')
-    return os.path.join(installation_path, 'VC', 'Auxiliary', 'Build')
 
-
-def get_vc_mod(arch):
-    if arch == 64:
-        return 'x86_amd64'
-    return 'x86'
+def get_build_env(args, link_options=None):
+    env = toolchain.get_environment(args.msvc, args.arch)
+    if link_options:
+        env['LINK'] = ' '.join(
+            [value for value in [env.get('LINK'), link_options] if value])
+    return env
 
 
-def get_nmake_cmd(args):
-    msvc_dir = get_msvc_dir(args)
-    vc_vars_script_path = os.path.join(msvc_dir, 'vcvarsall.bat')
-    return [vc_vars_script_path, get_vc_mod(args.arch), '&', 'nmake.exe']
+def add_tool_options(variable, options):
+    # cl and link read additional options from the CL and LINK environment
+    # variables.
+    os.environ[variable] = ' '.join(
+        [value for value in [os.environ.get(variable), options] if value])
 
 
 def get_xpm(arch):
@@ -256,19 +305,503 @@ def get_build_args(args, gui=True):
     build_args.extend(get_ruby_build_args(args))
     build_args.extend(get_tcl_build_args(args))
 
-    return build_args
+    if args.compiler_cache:
+        build_args.extend(
+            compiler_cache.get_make_args(compiler_cache.get_cache_dir()))
 
+    return build_args
 
-def build_vim(args, gui=True):
-    os.chdir(SOURCES_DIR)
 
+def get_variant_name(gui):
+    if gui:
+        return 'gui'
+    return 'console'
+
+
+def get_variant_dir(args, gui):
+    return os.path.join(args.output_dir or VARIANTS_DIR,
+                        get_variant_name(gui))
+
+
+def run_build_command(args, cmd, cwd, log_name, log_prefix=None,
+                      handlers=None, env=None):
+    log_path = None
+    if args.log_dir:
+        log_path = os.path.join(args.log_dir, log_name + '.log.gz')
+    buildlog.run(cmd,
+                 cwd=cwd,
+                 env=env or get_build_env(args),
+                 prefix=log_prefix,
+                 log_path=log_path,
+                 handlers=handlers)
+
+
+def get_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_source_files(build_dir):
+    for root, dirs, files in os.walk(build_dir):
+        dirs[:] = [directory for directory in dirs
+                   if directory not in FINGERPRINT_IGNORED_DIRS and
+                   not directory.startswith('Obj')]
+        for filename in files:
+            _, extension = os.path.splitext(filename)
+            if extension.lower() in FINGERPRINT_EXTENSIONS:
+                path = os.path.join(root, filename)
+                yield os.path.relpath(path, build_dir)
+
+
+def get_fingerprint_path(build_dir, gui):
+    return os.path.join(build_dir,
+                        FINGERPRINT_NAME.format(get_variant_name(gui)))
+
+
+def save_fingerprint(build_dir, gui, build_args):
+    files = {}
+    for source_file in get_source_files(build_dir):
+        path = os.path.join(build_dir, source_file)
+        files[source_file] = [get_file_hash(path), os.path.getmtime(path)]
+
+    with open(get_fingerprint_path(build_dir, gui), 'w') as fingerprint_file:
+        json.dump({'build_args': build_args,
+                   'files': files}, fingerprint_file)
+
+
+def restore_fingerprint(build_dir, gui, build_args):
+    # Return True if the previous build of the variant in this folder used the
+    # same arguments, in which case objects can be reused. Timestamps of files
+    # whose content did not change since then are restored so that nmake only
+    # recompiles what actually changed (a checkout or a cache restore touches
+    # all files).
+    fingerprint_path = get_fingerprint_path(build_dir, gui)
+    if not os.path.isfile(fingerprint_path):
+        return False
+
+    with open(fingerprint_path, 'r') as fingerprint_file:
+        fingerprint = json.load(fingerprint_file)
+
+    if fingerprint['build_args'] != build_args:
+        print('Build arguments changed since last build. '
+              'Doing a full rebuild.')
+        return False
+
+    for source_file in get_source_files(build_dir):
+        if source_file not in fingerprint['files']:
+            continue
+        path = os.path.join(build_dir, source_file)
+        file_hash, mtime = fingerprint['files'][source_file]
+        if (os.path.getmtime(path) != mtime and
+                get_file_hash(path) == file_hash):
+            os.utime(path, (mtime, mtime))
+
+    return True
+
+
+def build_vim(args, gui=True, build_dir=SOURCES_DIR, log_prefix=None,
+              console_dir=None):
     nmake_cmd = get_nmake_cmd(args)
     build_args = get_build_args(args, gui)
-
-    subprocess.check_call(nmake_cmd +
-                          ['/f', APPVEYOR_MAKE_PATH, 'clean'] + build_args)
-
-    subprocess.check_call(nmake_cmd + ['/f', APPVEYOR_MAKE_PATH] + build_args)
+    make_path = os.path.join(build_dir, MAKE_NAME)
+    log_name = get_variant_name(gui)
+
+    full_build = not args.incremental or not restore_fingerprint(
+        build_dir, gui, build_args)
+    if full_build:
+        run_build_command(args,
+                          nmake_cmd + ['/f', make_path, 'clean'] + build_args,
+                          build_dir, log_name, log_prefix)
+
+    if args.share_objects and console_dir:
+        share_console_objects(args, build_dir, console_dir)
+
+    make_args = list(build_args)
+    if args.unity:
+        make_args.extend(get_unity_args(args, gui, build_dir, build_args))
+    if args.pch:
+        make_args.extend(setup_pch(args, build_dir, build_args))
+
+    # The normal executable is always linked again in PGO mode to compare it
+    # with the optimized one.
+    if args.pgo:
+        remove_file(get_vim_path(build_dir, gui))
+
+    profiler = None
+    handlers = None
+    timings_path = None
+    if args.profile:
+        profiler = buildprof.Profiler()
+        handlers = [profiler.feed]
+        timings_path = os.path.join(args.profile, log_name + '.timings')
+        if os.path.isfile(timings_path):
+            os.remove(timings_path)
+        nmake_cmd = get_nmake_cmd(args, timings_path)
+
+    start = time.time()
+    run_build_command(args, nmake_cmd + ['/f', make_path] + make_args,
+                      build_dir, log_name, log_prefix, handlers,
+                      env=get_build_env(args))
+    if full_build:
+        report_build_time(args, log_name, time.time() - start)
+
+    if profiler:
+        profiler.load_timings(timings_path)
+        save_build_profile(args, profiler.get_profile(), log_name)
+
+    if args.pgo:
+        optimize_vim(args, gui, build_dir, log_prefix, make_args)
+
+    if args.incremental:
+        save_fingerprint(build_dir, gui, build_args)
+
+
+def read_makefile(args, build_dir, build_args):
+    return pmake.Makefile(
+        os.path.join(build_dir, MAKE_NAME),
+        dict(build_arg.split('=', 1) for build_arg in build_args),
+        cwd=build_dir,
+        environment=get_build_env(args))
+
+
+def get_inferred_sources(makefile, build_dir):
+    # Return the sources of the OBJ list compiled with the default inference
+    # rule, with their object. Other objects (sources in subfolders,
+    # generated, or with their own compile command) are left out.
+    sources = {}
+    for obj in makefile.expand('$(OBJ)').split():
+        name = os.path.basename(obj.replace('\\', '/'))
+        source = os.path.join(build_dir, os.path.splitext(name)[0] + '.c')
+        rule = makefile.rules.get(pmake.normalize_path(obj))
+        if os.path.isfile(source) and not (rule and rule.commands):
+            sources[source] = obj
+    return sources
+
+
+def setup_pch(args, build_dir, build_args):
+    # Return the make arguments compiling with the precompiled header and
+    # adding its object to the link of Vim. The object is added to LINKARGS1,
+    # only used to link Vim, and not to the LINK environment variable read by
+    # every link, including the tools built with other flags.
+    env = get_build_env(args)
+    makefile = read_makefile(args, build_dir, build_args)
+    flags = [flag for flag in pmake.split_words(makefile.expand('$(CFLAGS)'))
+             if not compiler_cache.has_flag(flag,
+                                            compiler_cache.OUTPUT_FLAGS)]
+    pch_args, pch_object = pch.setup(toolchain.find_program('cl.exe', env),
+                                     flags, build_dir, env)
+    # Macros given to nmake replace those of the makefile.
+    return pch_args + ['LINKARGS1={0} "{1}"'.format(
+        makefile.expand('$(LINKARGS1)'), pch_object)]
+
+
+def split_compile_flags(flags):
+    # Split flags between preprocessor flags and other flags, without output
+    # flags.
+    preprocessor_flags = []
+    other_flags = []
+    words = iter(pmake.split_words(flags))
+    for word in words:
+        flag = compiler_cache.normalize_flag(word)
+        if compiler_cache.has_flag(flag, compiler_cache.OUTPUT_FLAGS):
+            continue
+        if compiler_cache.has_flag(flag, PREPROCESSOR_FLAGS):
+            preprocessor_flags.append(word)
+            # Flag value given as the next argument.
+            if flag in PREPROCESSOR_FLAGS:
+                preprocessor_flags.append(next(words, ''))
+            continue
+        other_flags.append(word)
+    return preprocessor_flags, other_flags
+
+
+def get_preprocessed_hash(env, build_dir, flags, source):
+    output = subprocess.check_output(
+        [toolchain.find_program('cl.exe', env)] + flags +
+        ['/nologo', '/EP', os.path.basename(source)],
+        cwd=build_dir, env=env, stderr=subprocess.DEVNULL)
+    return hashlib.sha1(output).hexdigest()
+
+
+def share_console_objects(args, build_dir, console_dir):
+    # Copy to the GUI build the objects of the console build whose sources
+    # give the same preprocessed output with the flags of both builds, so
+    # that they are not compiled again. The copies keep the time of the
+    # console objects and are up to date for nmake.
+    env = get_build_env(args)
+    console_makefile = read_makefile(args, console_dir,
+                                     get_build_args(args, gui=False))
+    gui_makefile = read_makefile(args, build_dir,
+                                 get_build_args(args, gui=True))
+    console_flags, console_other_flags = split_compile_flags(
+        console_makefile.expand('$(CFLAGS)'))
+    gui_flags, gui_other_flags = split_compile_flags(
+        gui_makefile.expand('$(CFLAGS)'))
+    if console_other_flags != gui_other_flags:
+        print('Compiler flags differ between console and GUI builds. '
+              'No object shared.')
+        return
+
+    console_out_dir = os.path.join(console_dir,
+                                   console_makefile.expand('$(OUTDIR)'))
+    gui_out_dir = os.path.join(build_dir, gui_makefile.expand('$(OUTDIR)'))
+    console_sources = dict(
+        (os.path.basename(source), source)
+        for source in get_inferred_sources(console_makefile, console_dir))
+    candidates = []
+    for source in get_inferred_sources(gui_makefile, build_dir):
+        name = os.path.basename(source)
+        console_source = console_sources.get(name)
+        object_name = os.path.splitext(name)[0] + '.obj'
+        console_object = os.path.join(console_out_dir, object_name)
+        if (console_source and os.path.isfile(console_object) and
+                os.path.getmtime(console_object) >=
+                os.path.getmtime(console_source) and
+                filecmp.cmp(source, console_source, shallow=False)):
+            candidates.append((source, console_source, console_object,
+                               os.path.join(gui_out_dir, object_name)))
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        hashes = [(executor.submit(get_preprocessed_hash, env, build_dir,
+                                   gui_flags, source),
+                   executor.submit(get_preprocessed_hash, env, console_dir,
+                                   console_flags, console_source))
+                  for source, console_source, _, _ in candidates]
+
+    if not os.path.isdir(gui_out_dir):
+        os.makedirs(gui_out_dir)
+    shared = 0
+    for (gui_hash, console_hash), (_, _, console_object, gui_object) in zip(
+            hashes, candidates):
+        try:
+            if gui_hash.result() != console_hash.result():
+                continue
+        except subprocess.CalledProcessError:
+            continue
+        shutil.copy2(console_object, gui_object)
+        shared += 1
+    print('{0} of {1} objects shared with the console build.'.format(
+        shared, len(get_inferred_sources(gui_makefile, build_dir))))
+
+
+def get_unity_args(args, gui, build_dir, build_args):
+    # Replace the objects of the batched sources by the objects of the
+    # batches.
+    makefile = read_makefile(args, build_dir, build_args)
+    out_dir = makefile.expand('$(OUTDIR)')
+    objects = makefile.expand('$(OBJ)').split()
+    sources = get_inferred_sources(makefile, build_dir)
+
+    batches, separate_sources = unity.make_batches(
+        [source for source in sources], args.unity_batch_size)
+    headers = (glob.glob(os.path.join(build_dir, '*.h')) +
+               glob.glob(os.path.join(build_dir, 'proto', '*.pro')))
+    batch_paths = unity.write_batches(build_dir, get_variant_name(gui),
+                                      batches, headers)
+
+    batched_objects = set(sources[source]
+                          for batch in batches for source in batch)
+    objects = [obj for obj in objects if obj not in batched_objects]
+    objects.extend('{0}/{1}.obj'.format(
+        out_dir, os.path.splitext(os.path.basename(path))[0])
+        for path in batch_paths)
+    print('Unity build of {0}: {1} sources in {2} batches, {3} compiled '
+          'separately.'.format(get_variant_name(gui), len(batched_objects),
+                               len(batches), len(separate_sources)))
+    return ['OBJ={0}'.format(' '.join(objects))]
+
+
+def report_build_time(args, name, duration):
+    # Compare full builds in unity mode with the last full build in normal
+    # mode.
+    times_path = os.path.join(UNITY_TIMES_DIR, name + '.json')
+    times = {}
+    if os.path.isfile(times_path):
+        with open(times_path, 'r') as times_file:
+            times = json.load(times_file)
+    mode = 'unity' if args.unity else 'normal'
+    times[mode] = duration
+    if not os.path.isdir(UNITY_TIMES_DIR):
+        os.makedirs(UNITY_TIMES_DIR)
+    with open(times_path, 'w') as times_file:
+        json.dump(times, times_file)
+
+    if not args.unity:
+        return
+    if 'normal' not in times:
+        print('Unity build of {0} took {1:.1f}s. No full build in normal '
+              'mode to compare with.'.format(name, duration))
+        return
+    print('Unity build of {0} took {1:.1f}s against {2:.1f}s for the last '
+          'full build in normal mode ({3}).'.format(
+              name, duration, times['normal'],
+              format_change(times['normal'], duration)))
+
+
+def get_vim_path(build_dir, gui):
+    if gui:
+        return os.path.join(build_dir, 'gvim.exe')
+    return os.path.join(build_dir, 'vim.exe')
+
+
+def remove_file(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def link_vim(args, gui, build_dir, log_prefix, make_args, link_options):
+    # Objects are compiled with /GL (link time code generation) so switching
+    # between instrumented and optimized executables only requires linking
+    # them again.
+    remove_file(get_vim_path(build_dir, gui))
+    run_build_command(args,
+                      get_nmake_cmd(args) +
+                      ['/f', os.path.join(build_dir, MAKE_NAME)] + make_args,
+                      build_dir, get_variant_name(gui), log_prefix,
+                      env=get_build_env(args, link_options))
+
+
+def get_training_cmd(args, gui, build_dir):
+    cmd = [get_vim_path(build_dir, gui),
+           '-u', 'NONE', '-U', 'NONE', '-i', 'NONE', '-N']
+    if not gui:
+        cmd.append('-es')
+    return cmd + ['--cmd', "let g:pgo_sources = '{0}'".format(
+                      os.path.abspath(build_dir).replace("'", "''")),
+                  '-S', args.pgo_training]
+
+
+def run_training(args, gui, build_dir, log_prefix):
+    env = get_build_env(args)
+    env['VIMRUNTIME'] = os.path.abspath(RUNTIME_DIR)
+    start = time.time()
+    buildlog.run(get_training_cmd(args, gui, build_dir),
+                 cwd=build_dir,
+                 env=env,
+                 prefix=log_prefix)
+    return time.time() - start
+
+
+def time_training(args, gui, build_dir, log_prefix):
+    return min(run_training(args, gui, build_dir, log_prefix)
+               for _ in range(PGO_TIMING_RUNS))
+
+
+def format_change(old_value, new_value):
+    return '{0:+.1f}%'.format(
+        100.0 * (new_value - old_value) / max(old_value, 1e-6))
+
+
+def optimize_vim(args, gui, build_dir, log_prefix, make_args):
+    vim_path = get_vim_path(build_dir, gui)
+    vim_name = os.path.basename(vim_path)
+    normal_size = os.path.getsize(vim_path)
+    normal_time = time_training(args, gui, build_dir, log_prefix)
+
+    # Counts from a previous training would be merged into the profile.
+    for count_path in glob.glob(
+            os.path.splitext(vim_path)[0] + '!*.pgc'):
+        os.remove(count_path)
+
+    print('Training instrumented {0}.'.format(vim_name))
+    link_vim(args, gui, build_dir, log_prefix, make_args, '/GENPROFILE')
+    run_training(args, gui, build_dir, log_prefix)
+    link_vim(args, gui, build_dir, log_prefix, make_args, '/USEPROFILE')
+
+    optimized_size = os.path.getsize(vim_path)
+    optimized_time = time_training(args, gui, build_dir, log_prefix)
+    print('PGO build of {0}:'.format(vim_name))
+    print('  size: {0} -> {1} bytes ({2})'.format(
+        normal_size, optimized_size,
+        format_change(normal_size, optimized_size)))
+    print('  training time: {0:.2f}s -> {1:.2f}s ({2})'.format(
+        normal_time, optimized_time,
+        format_change(normal_time, optimized_time)))
+
+
+def save_build_profile(args, profile, name):
+    buildprof.save_profile(profile, os.path.join(args.profile, name + '.json'))
+    buildprof.print_report(profile, args.profile_top)
+
+    if not args.profile_baseline:
+        return
+    baseline_path = os.path.join(args.profile_baseline, name + '.json')
+    if not os.path.isfile(baseline_path):
+        print('WARNING: no baseline profile for {0}.'.format(name))
+        return
+    regressions = buildprof.compare_profiles(
+        buildprof.load_profile(baseline_path), profile,
+        args.profile_threshold)
+    buildprof.print_regressions(regressions, args.profile_threshold)
+
+
+def is_variant_ignored(filename):
+    return any(fnmatch.fnmatch(filename, pattern)
+               for pattern in VARIANT_IGNORED_PATTERNS)
+
+
+def update_variant_sources(variant_dir):
+    # Only copy files that changed so that nmake does not consider unchanged
+    # files out of date.
+    for root, dirs, files in os.walk(SOURCES_DIR):
+        dirs[:] = [directory for directory in dirs
+                   if not is_variant_ignored(directory)]
+        destination_root = os.path.join(variant_dir,
+                                        os.path.relpath(root, SOURCES_DIR))
+        if not os.path.isdir(destination_root):
+            os.makedirs(destination_root)
+        for filename in files:
+            if is_variant_ignored(filename):
+                continue
+            source = os.path.join(root, filename)
+            destination = os.path.join(destination_root, filename)
+            if (not os.path.isfile(destination) or
+                    not filecmp.cmp(source, destination)):
+                shutil.copy2(source, destination)
+
+
+def copy_variant_sources(args, gui):
+    variant_dir = get_variant_dir(args, gui)
+    if args.incremental:
+        update_variant_sources(variant_dir)
+        return variant_dir
+    if os.path.exists(variant_dir):
+        shutil.rmtree(variant_dir)
+    shutil.copytree(SOURCES_DIR, variant_dir,
+                    ignore=shutil.ignore_patterns(*VARIANT_IGNORED_PATTERNS))
+    return variant_dir
+
+
+def copy_variant_outputs(args, gui):
+    variant_dir = get_variant_dir(args, gui)
+    output_dir = args.output_dir or SOURCES_DIR
+    for output in VARIANT_OUTPUTS[gui]:
+        output_path = os.path.join(variant_dir, output)
+        if not os.path.isfile(output_path):
+            continue
+        destination = os.path.join(output_dir, output)
+        if not os.path.isdir(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        shutil.copy2(output_path, destination)
+
+
+def build_variant(args, gui, console_dir=None):
+    variant_dir = copy_variant_sources(args, gui)
+    build_vim(args, gui, variant_dir, get_variant_name(gui), console_dir)
+    copy_variant_outputs(args, gui)
+
+
+def build_vims_concurrently(args):
+    # Each variant is built in its own copy of the sources as both builds
+    # generate files (e.g. auto\pathdef.c) in the same places.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        builds = [executor.submit(build_variant, args, gui)
+                  for gui in [False, True]]
+    for build in builds:
+        build.result()
 
 
 def get_arch_from_python_interpreter():
@@ -277,39 +810,250 @@ def get_arch_from_python_interpreter():
     return 32
 
 
-def remove_progress_bars():
-    # Progress bars from the build are messing up the logs on AppVeyor.
-    # Create a new make file that remove them.
-    with open(MAKE_PATH, "r") as make_file:
-        lines = make_file.readlines()
-    with open(APPVEYOR_MAKE_PATH, "w") as appveyor_make_file:
-        for line in lines:
-            appveyor_make_file.write(re.sub(r'\$\(LINKARGS2\)',
-                                            r'$(LINKARGS2) | '
-                                            r"sed -e 's#.*\\r.*##'",
-                                            line))
+def get_languages():
+    makefile = pmake.Makefile(os.path.join(TRANSLATIONS_DIR, MAKE_NAME),
+                              {'VIMRUNTIME': RUNTIME_DIR},
+                              cwd=TRANSLATIONS_DIR)
+    return makefile.expand('$(LANGUAGES)').split()
 
 
-def build_translations(args):
+def generate_po_files(args, languages):
+    # Some PO files are converted from others (e.g. ja.sjis.po from ja.po) by
+    # the makefile, which requires the gettext tools.
     gettext_path = find_executable('xgettext')
     if not gettext_path:
         raise RuntimeError('gettext tool not found')
 
-    nmake_cmd = get_nmake_cmd(args)
-    subprocess.check_call(
-        nmake_cmd +
-        ['/f', 'Make_mvc.mak',
-         'GETTEXT_PATH={0}'.format(os.path.dirname(gettext_path)),
-         'VIMRUNTIME={0}'.format(RUNTIME_DIR),
-         'install-all'], cwd=TRANSLATIONS_DIR)
+    run_build_command(args,
+                      get_nmake_cmd(args) +
+                      ['/f', MAKE_NAME,
+                       'GETTEXT_PATH={0}'.format(
+                           os.path.dirname(gettext_path))] +
+                      [language + '.po' for language in languages],
+                      TRANSLATIONS_DIR, 'translations')
+
+
+def get_translation_path(language):
+    return os.path.join(RUNTIME_DIR, 'lang', language, 'LC_MESSAGES',
+                        'vim.mo')
 
 
-def clean_up():
-    if os.path.isfile(APPVEYOR_MAKE_PATH):
-        os.remove(APPVEYOR_MAKE_PATH)
+def load_translations_index():
+    if not os.path.isfile(TRANSLATIONS_INDEX_PATH):
+        return {}
+    with open(TRANSLATIONS_INDEX_PATH, 'r') as index_file:
+        return json.load(index_file)
 
 
-def parse_arguments():
+def save_translations_index(index):
+    index_dir = os.path.dirname(TRANSLATIONS_INDEX_PATH)
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    with open(TRANSLATIONS_INDEX_PATH, 'w') as index_file:
+        json.dump(index, index_file, indent=2, sort_keys=True)
+
+
+def build_translations(args):
+    languages = get_languages()
+    missing_languages = [
+        language for language in languages
+        if not os.path.isfile(os.path.join(TRANSLATIONS_DIR,
+                                           language + '.po'))]
+    if missing_languages:
+        generate_po_files(args, missing_languages)
+
+    # A change to the compiler invalidates all languages.
+    compiler_hash = get_file_hash(msgfmt.__file__)
+    index = load_translations_index()
+    new_index = {}
+    builds = {}
+    with ProcessPoolExecutor() as executor:
+        for language in languages:
+            po_path = os.path.join(TRANSLATIONS_DIR, language + '.po')
+            mo_path = get_translation_path(language)
+            hashes = [compiler_hash, get_file_hash(po_path)]
+            new_index[language] = hashes
+            if index.get(language) == hashes and os.path.isfile(mo_path):
+                continue
+            mo_dir = os.path.dirname(mo_path)
+            if not os.path.isdir(mo_dir):
+                os.makedirs(mo_dir)
+            builds[language] = executor.submit(msgfmt.compile_file, po_path,
+                                               mo_path)
+
+    failed_languages = []
+    for language in sorted(builds):
+        error = builds[language].exception()
+        if error:
+            print('{0}: {1}'.format(language, error))
+            failed_languages.append(language)
+            del new_index[language]
+    save_translations_index(new_index)
+    if failed_languages:
+        raise RuntimeError('cannot compile translations: {0}'.format(
+            ', '.join(failed_languages)))
+    print('{0} of {1} translations compiled.'.format(len(builds),
+                                                     len(languages)))
+
+
+def load_matrix_manifest(manifest_path):
+    # The manifest is a JSON object with a list of configurations and optional
+    # defaults shared by all of them. Configuration fields are the build
+    # options, e.g. {"name": "x64", "arch": 64, "python3_version": "3.7.0"}.
+    with open(manifest_path, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    configurations = []
+    names = set()
+    for configuration in manifest['configurations']:
+        configuration = dict(manifest.get('defaults', {}), **configuration)
+        name = configuration.get('name')
+        if not name:
+            raise RuntimeError('configuration without name in manifest.')
+        if name in names:
+            raise RuntimeError('duplicate configuration {0} in '
+                               'manifest.'.format(name))
+        names.add(name)
+        configurations.append(configuration)
+    return configurations
+
+
+def get_configuration_arguments(configuration):
+    arguments = []
+    for name, value in sorted(configuration.items()):
+        if name == 'name' or value is None or value is False:
+            continue
+        option = '--' + name.replace('_', '-')
+        if value is True:
+            arguments.append(option)
+        else:
+            arguments.extend([option, str(value)])
+    return arguments
+
+
+def get_configuration_cost(configuration, args):
+    # Processors and memory (in GB) used by a configuration, from its number
+    # of compilations running at the same time.
+    jobs = configuration.get('jobs', 1)
+    if configuration.get('concurrent'):
+        jobs *= 2
+    return jobs, jobs * args.memory_per_job
+
+
+def build_configuration(configuration, output_dir):
+    cmd = ([sys.executable, os.path.abspath(__file__)] +
+           get_configuration_arguments(configuration) +
+           ['--output-dir', output_dir,
+            '--log-dir', os.path.join(output_dir, 'logs'),
+            '--skip-translations'])
+    start = time.time()
+    try:
+        buildlog.run(cmd, prefix=configuration['name'])
+    except buildlog.BuildError:
+        return False, time.time() - start
+    return True, time.time() - start
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return '{0}m{1:02d}s'.format(minutes, seconds)
+
+
+def print_matrix_results(results):
+    name_width = max([len('Configuration')] +
+                     [len(name) for name, _, _, _ in results])
+    row = '{0:<{width}}  {1:<7}  {2:>9}  {3}'
+    print(row.format('Configuration', 'Status', 'Time', 'Output',
+                     width=name_width))
+    for name, succeeded, duration, output_dir in results:
+        print(row.format(name, 'ok' if succeeded else 'FAILED',
+                         format_duration(duration), output_dir,
+                         width=name_width))
+
+
+def build_matrix(args):
+    configurations = load_matrix_manifest(args.manifest)
+    # Check all configurations before building any of them.
+    for configuration in configurations:
+        parse_arguments(get_configuration_arguments(configuration))
+
+    # Translations are the same for all configurations.
+    if not args.skip_translations and configurations:
+        build_translations(parse_arguments(
+            get_configuration_arguments(configurations[0])))
+
+    results = {}
+    pending = list(configurations)
+    running = {}
+    used_cpus = 0
+    used_memory = 0.0
+    with ThreadPoolExecutor(max_workers=len(configurations) or 1) as executor:
+        while pending or running:
+            # Start configurations in manifest order as long as they fit in
+            # the budget. A configuration larger than the budget still runs
+            # once nothing else does.
+            for configuration in list(pending):
+                cpus, memory = get_configuration_cost(configuration, args)
+                if running and (used_cpus + cpus > args.cpus or
+                                (args.memory and
+                                 used_memory + memory > args.memory)):
+                    continue
+                pending.remove(configuration)
+                output_dir = os.path.join(os.path.abspath(args.output_dir),
+                                          configuration['name'])
+                build = executor.submit(build_configuration, configuration,
+                                        output_dir)
+                running[build] = (configuration, output_dir, cpus, memory)
+                used_cpus += cpus
+                used_memory += memory
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for build in done:
+                configuration, output_dir, cpus, memory = running.pop(build)
+                used_cpus -= cpus
+                used_memory -= memory
+                succeeded, duration = build.result()
+                results[configuration['name']] = (succeeded, duration,
+                                                  output_dir)
+
+    results = [(configuration['name'],) + results[configuration['name']]
+               for configuration in configurations]
+    print_matrix_results(results)
+    return all(succeeded for _, succeeded, _, _ in results)
+
+
+def parse_matrix_arguments(argv):
+    parser = argparse.ArgumentParser(prog='build.py matrix')
+    parser.add_argument('manifest', help='JSON file listing the '
+                        'configurations to build.')
+    parser.add_argument('--output-dir', type=str, default=MATRIX_DIR,
+                        help='build each configuration in a subfolder of '
+                        'this folder (default: %(default)s).')
+    parser.add_argument('--cpus', type=int, default=os.cpu_count(),
+                        help='number of compilations running at the same '
+                        'time over all configurations (default: '
+                        '%(default)s).')
+    parser.add_argument('--memory', type=float,
+                        help='memory available to builds in GB '
+                        '(default: no limit).')
+    parser.add_argument('--memory-per-job', type=float,
+                        default=MATRIX_MEMORY_PER_JOB,
+                        help='memory used by a compilation in GB '
+                        '(default: %(default)s).')
+    parser.add_argument('--skip-translations', action='store_true',
+                        help='do not compile translations.')
+    return parser.parse_args(argv)
+
+
+def setup_compiler_cache(args):
+    if args.compiler_cache_url:
+        os.environ['COMPILER_CACHE_URL'] = args.compiler_cache_url
+    cache_dir = compiler_cache.get_cache_dir()
+    compiler_cache.create_shim(cache_dir)
+    compiler_cache.zero_stats(cache_dir)
+
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--msvc', type=int, choices=[11, 12, 14, 15],
                         default=15, help='choose the Microsoft Visual '
@@ -353,21 +1097,116 @@ def parse_arguments():
     parser.add_argument('--credit', type=str,
                         help='replace username@userdomain by a custom '
                              'string in compilation credit.')
-
-    args = parser.parse_args()
+    parser.add_argument('--concurrent', action='store_true',
+                        help='build console and GUI versions at the same '
+                        'time in separate folders.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='reuse objects from the previous build if the '
+                        'build arguments did not change.')
+    parser.add_argument('--pch', action='store_true',
+                        help='compile sources with a precompiled vim.h.')
+    parser.add_argument('--share-objects', action='store_true',
+                        help='reuse in the GUI build the objects of the '
+                        'console build with the same preprocessed source.')
+    parser.add_argument('--unity', action='store_true',
+                        help='compile sources in batches including several '
+                        'of them.')
+    parser.add_argument('--unity-batch-size', type=int,
+                        default=unity.DEFAULT_BATCH_SIZE,
+                        help='maximum number of sources in a batch '
+                        '(default: %(default)s).')
+    parser.add_argument('--pgo', action='store_true',
+                        help='optimize executables with a profile collected '
+                        'by running a training workload.')
+    parser.add_argument('--pgo-training', type=str,
+                        default=PGO_TRAINING_SCRIPT,
+                        help='Vim script of the training workload '
+                        '(default: %(default)s).')
+    parser.add_argument('--output-dir', type=str,
+                        help='build console and GUI versions in subfolders '
+                        'of this folder and copy the executables there '
+                        '(default: build in the sources folder).')
+    parser.add_argument('--skip-translations', action='store_true',
+                        help='do not compile translations.')
+    parser.add_argument('--log-dir', type=str,
+                        help='write the full build logs compressed to this '
+                        'folder.')
+    parser.add_argument('--profile', type=str, metavar='DIR',
+                        help='save compile and link timings to this folder.')
+    parser.add_argument('--profile-top', type=int,
+                        default=buildprof.DEFAULT_TOP,
+                        help='number of slowest units to show '
+                        '(default: %(default)s).')
+    parser.add_argument('--profile-baseline', type=str, metavar='DIR',
+                        help='compare timings to the profiles in this '
+                        'folder.')
+    parser.add_argument('--profile-threshold', type=float,
+                        default=buildprof.DEFAULT_THRESHOLD,
+                        help='report units slower than in the baseline by '
+                        'more than this percentage (default: %(default)s).')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='run up to JOBS compilations at the same time '
+                        'with the parallel make driver (default: '
+                        '%(default)s, use nmake).')
+    parser.add_argument('--compiler-cache', action='store_true',
+                        help='reuse object files from the compiler cache '
+                        '(folder set by COMPILER_CACHE_DIR).')
+    parser.add_argument('--compiler-cache-url', type=str,
+                        help='set URL of a shared compiler cache.')
+
+    args = parser.parse_args(argv)
     if not args.arch:
         args.arch = get_arch_from_python_interpreter()
+    if args.jobs > 1 and args.msvc < 12:
+        parser.error('parallel builds require MSVC 12 or later (/FS).')
+    if args.pch and args.compiler_cache:
+        parser.error('sources compiled with a precompiled header cannot be '
+                     'cached.')
+    if args.pch and args.share_objects:
+        parser.error('objects compiled with the precompiled header of the '
+                     'console build cannot be linked in the GUI build.')
+    if args.share_objects and args.concurrent:
+        parser.error('objects cannot be shared between console and GUI '
+                     'builds running at the same time.')
+    if args.pgo and args.msvc < 14:
+        parser.error('PGO builds require MSVC 14 or later (/GENPROFILE).')
 
     return args
 
 
 def main():
+    if sys.argv[1:2] == ['matrix']:
+        if not build_matrix(parse_matrix_arguments(sys.argv[2:])):
+            sys.exit(1)
+        return
+
     args = parse_arguments()
-    remove_progress_bars()
-    build_vim(args, gui=False)
-    build_vim(args)
-    build_translations(args)
-    clean_up()
+    if args.log_dir and not os.path.isdir(args.log_dir):
+        os.makedirs(args.log_dir)
+    if args.profile:
+        if not os.path.isdir(args.profile):
+            os.makedirs(args.profile)
+        add_tool_options('CL', '/Bt+')
+        add_tool_options('LINK', '/time')
+    if args.compiler_cache:
+        setup_compiler_cache(args)
+    if args.jobs > 1:
+        # Allow compilations running at the same time to write to the same
+        # PDB file.
+        add_tool_options('CL', '/FS')
+    if args.concurrent:
+        build_vims_concurrently(args)
+    elif args.output_dir:
+        build_variant(args, gui=False)
+        build_variant(args, gui=True,
+                      console_dir=get_variant_dir(args, gui=False))
+    else:
+        build_vim(args, gui=False)
+        build_vim(args, console_dir=SOURCES_DIR)
+    if not args.skip_translations:
+        build_translations(args)
+    if args.compiler_cache:
+        compiler_cache.print_stats(compiler_cache.get_cache_dir())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+# Filter for the output of build commands.
+#
+# Output is streamed line by line: progress updates separated by carriage
+# returns are collapsed to their last state, warnings already reported are
+# dropped, and the last lines are kept to report errors. The full output can
+# also be written compressed to disk.
+
+import collections
+import gzip
+import locale
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+
+TAIL_SIZE = 50
+WARNING_REGEX = re.compile(r'\bwarning [A-Z]+\d+\s*:', re.IGNORECASE)
+
+# Serialize the output of commands running concurrently so that their lines
+# are not mixed up.
+OUTPUT_LOCK = threading.Lock()
+
+
+class BuildError(subprocess.CalledProcessError):
+
+    def __init__(self, returncode, cmd, tail):
+        super(BuildError, self).__init__(returncode, cmd)
+        self.tail = tail
+
+    def __str__(self):
+        message = super(BuildError, self).__str__()
+        if not self.tail:
+            return message
+        return '{0}\nLast {1} lines of output:\n{2}'.format(
+            message, len(self.tail), '\n'.join(self.tail))
+
+
+class BuildTimeout(BuildError):
+
+    def __init__(self, returncode, cmd, tail, timeout):
+        super(BuildTimeout, self).__init__(returncode, cmd, tail)
+        self.timeout = timeout
+
+    def __str__(self):
+        message = 'Command {0!r} timed out after {1} seconds.'.format(
+            self.cmd, self.timeout)
+        if not self.tail:
+            return message
+        return '{0}\nLast {1} lines of output:\n{2}'.format(
+            message, len(self.tail), '\n'.join(self.tail))
+
+
+def kill_process_tree(process):
+    if os.name == 'nt':
+        subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def write_line(line, prefix=None):
+    if prefix is not None:
+        line = '[{0}] {1}'.format(prefix, line)
+    with OUTPUT_LOCK:
+        print(line)
+        sys.stdout.flush()
+
+
+def collapse_progress(line):
+    segments = [segment for segment in line.split('\r') if segment.strip()]
+    if not segments:
+        return ''
+    return segments[-1]
+
+
+def run(cmd, cwd=None, env=None, prefix=None, log_path=None, handlers=None,
+        tail_size=TAIL_SIZE, timeout=None):
+    # With a timeout, the command and all the processes it started are killed
+    # when it runs for longer than timeout seconds.
+    encoding = locale.getpreferredencoding(False)
+    tail = collections.deque(maxlen=tail_size)
+    warnings = set()
+    duplicates = 0
+    log_file = gzip.open(log_path, 'ab') if log_path else None
+    watchdog = None
+    timed_out = threading.Event()
+    try:
+        process = subprocess.Popen(cmd,
+                                   cwd=cwd,
+                                   env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   # Put the command in its own process
+                                   # group so that it can be killed with its
+                                   # children.
+                                   start_new_session=(timeout is not None and
+                                                      os.name != 'nt'))
+        if timeout is not None:
+            def kill():
+                timed_out.set()
+                kill_process_tree(process)
+
+            watchdog = threading.Timer(timeout, kill)
+            watchdog.daemon = True
+            watchdog.start()
+        for raw_line in iter(process.stdout.readline, b''):
+            if log_file:
+                log_file.write(raw_line)
+            line = raw_line.decode(encoding, 'replace').rstrip('\r\n')
+            if '\r' in line:
+                line = collapse_progress(line)
+                if not line:
+                    continue
+            if WARNING_REGEX.search(line):
+                if line in warnings:
+                    duplicates += 1
+                    continue
+                warnings.add(line)
+            tail.append(line)
+            for handler in handlers or []:
+                handler(line)
+            write_line(line, prefix)
+        returncode = process.wait()
+    finally:
+        if watchdog:
+            watchdog.cancel()
+        if log_file:
+            log_file.close()
+
+    if duplicates:
+        write_line('{0} duplicate warnings removed.'.format(duplicates),
+                   prefix)
+    if timed_out.is_set():
+        raise BuildTimeout(returncode, cmd, list(tail), timeout)
+    if returncode:
+        raise BuildError(returncode, cmd, list(tail))
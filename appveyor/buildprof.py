@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+# Build time profiling.
+#
+# Compile and link times are collected from the timing output of the MSVC
+# tools (cl /Bt+ and link /time) and from the timings of the parallel make
+# driver (pmake.py --timings). Profiles are saved as JSON and as Chrome trace
+# files (to load in chrome://tracing). Commands:
+#
+#   buildprof.py parse LOG [LOG ...] -o PROFILE [--timings FILE]
+#   buildprof.py report PROFILE [--top N]
+#   buildprof.py compare OLD_PROFILE NEW_PROFILE [--threshold PERCENT]
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import time
+
+# Output of cl /Bt+ for each pass of the compiler, e.g.
+#   time(C:\...\c1.dll)=0.42318s < 1234 - 5678 > BB [C:\vim\src\buffer.c]
+# The path of the tool may contain parentheses, as in "Program Files (x86)".
+COMPILE_TIME_REGEX = re.compile(
+    r'time\((?P<tool>.*?)\)=(?P<seconds>[0-9.]+)s.*\[(?P<path>[^\]]+)\]')
+# Output of link /time, with the path of the output in recent versions, e.g.
+#   Linker: Final Total time = 2.34s < 1234 - 5678 > PB: 1216512 [gvim.exe]
+#   Final: Total time = 2.34s
+LINK_TIME_REGEX = re.compile(
+    r'(?:Linker|Final):?\s+Total time = (?P<seconds>[0-9.]+)s'
+    r'(?:.*\[(?P<path>[^\]]+)\])?')
+# Link command echoed by nmake, giving the output of older versions of link.
+LINK_COMMAND_REGEX = re.compile(
+    r'^\s*link(?:\.exe)?\s.*[-/]out:"?(?P<path>[^"\s]+)', re.IGNORECASE)
+
+DEFAULT_TOP = 10
+DEFAULT_THRESHOLD = 10
+# Units faster than this are not reported as regressions.
+MINIMUM_DURATION = 0.1
+
+
+def get_name(path):
+    # Paths in the logs are Windows paths.
+    return os.path.basename(path.replace('\\', '/'))
+
+
+class Profiler(object):
+
+    def __init__(self):
+        # Keyed on kind and name: the link of an executable and its target
+        # have the same name.
+        self.units = {}
+        self.link_output = None
+
+    def add(self, name, kind, duration, end=None, dependencies=None):
+        if end is None:
+            end = time.time()
+        unit = self.units.get((kind, name))
+        if unit is None:
+            unit = {'name': name,
+                    'kind': kind,
+                    'duration': 0.0,
+                    'start': end - duration,
+                    'end': end,
+                    'dependencies': []}
+            self.units[(kind, name)] = unit
+        unit['duration'] += duration
+        unit['start'] = min(unit['start'], end - duration)
+        unit['end'] = max(unit['end'], end)
+        unit['dependencies'].extend(dependencies or [])
+
+    def feed(self, line):
+        # Compiler passes (front end and back end) are added up per source.
+        match = COMPILE_TIME_REGEX.search(line)
+        if match:
+            self.add(get_name(match.group('path')), 'compile',
+                     float(match.group('seconds')))
+            return
+        match = LINK_COMMAND_REGEX.match(line)
+        if match:
+            self.link_output = match.group('path')
+            return
+        match = LINK_TIME_REGEX.search(line)
+        if match:
+            name = get_name(match.group('path') or self.link_output or
+                            'link')
+            self.add(name, 'link', float(match.group('seconds')))
+
+    def load_timings(self, timings_path):
+        if not os.path.isfile(timings_path):
+            return
+        with open(timings_path, 'r') as timings_file:
+            for line in timings_file:
+                timing = json.loads(line)
+                self.add(timing['name'], 'target',
+                         timing['end'] - timing['start'],
+                         timing['end'], timing['dependencies'])
+
+    def get_profile(self):
+        return {'units': sorted(self.units.values(),
+                                key=lambda unit: unit['start'])}
+
+
+def read_log(log_path):
+    if log_path.endswith('.gz'):
+        return gzip.open(log_path, 'rt', errors='replace')
+    return open(log_path, 'r', errors='replace')
+
+
+def parse_logs(log_paths, timings_path=None):
+    profiler = Profiler()
+    for log_path in log_paths:
+        with read_log(log_path) as log_file:
+            for line in log_file:
+                profiler.feed(line.rstrip('\r\n'))
+    if timings_path:
+        profiler.load_timings(timings_path)
+    return profiler.get_profile()
+
+
+def get_trace(profile):
+    # Units are spread over lanes so that units running at the same time do
+    # not overlap in the trace viewer.
+    events = []
+    lanes = []
+    units = profile['units']
+    origin = min([unit['start'] for unit in units] or [0])
+    for unit in sorted(units, key=lambda unit: unit['start']):
+        for lane, lane_end in enumerate(lanes):
+            if lane_end <= unit['start']:
+                break
+        else:
+            lane = len(lanes)
+            lanes.append(0)
+        lanes[lane] = unit['end']
+        events.append({'name': unit['name'],
+                       'cat': unit['kind'],
+                       'ph': 'X',
+                       'ts': int((unit['start'] - origin) * 1e6),
+                       'dur': int(unit['duration'] * 1e6),
+                       'pid': 1,
+                       'tid': lane})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def save_profile(profile, profile_path):
+    with open(profile_path, 'w') as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    trace_path = os.path.splitext(profile_path)[0] + '.trace.json'
+    with open(trace_path, 'w') as trace_file:
+        json.dump(get_trace(profile), trace_file)
+
+
+def load_profile(profile_path):
+    with open(profile_path, 'r') as profile_file:
+        return json.load(profile_file)
+
+
+def get_critical_path(profile):
+    # Longest chain of dependent targets, weighted by their duration. Only
+    # available with the timings of the parallel make driver.
+    units = dict((unit['name'], unit) for unit in profile['units']
+                 if unit['kind'] == 'target')
+    finish = {}
+    previous = {}
+
+    def get_finish(name, visiting):
+        if name in finish:
+            return finish[name]
+        visiting.add(name)
+        best_name = None
+        best_finish = 0.0
+        for dependency in units[name]['dependencies']:
+            if dependency not in units or dependency in visiting:
+                continue
+            dependency_finish = get_finish(dependency, visiting)
+            if dependency_finish > best_finish:
+                best_name = dependency
+                best_finish = dependency_finish
+        visiting.discard(name)
+        finish[name] = best_finish + units[name]['duration']
+        previous[name] = best_name
+        return finish[name]
+
+    if not units:
+        return []
+    last = max(units, key=lambda name: get_finish(name, set()))
+    path = []
+    while last is not None:
+        path.append(units[last])
+        last = previous[last]
+    return list(reversed(path))
+
+
+def print_report(profile, top=DEFAULT_TOP):
+    units = [unit for unit in profile['units']
+             if unit['kind'] in ['compile', 'link']]
+    if not units:
+        units = profile['units']
+    units = sorted(units, key=lambda unit: unit['duration'], reverse=True)
+    total = sum(unit['duration'] for unit in units)
+    print('{0} slowest units (total: {1:.2f}s):'.format(min(top, len(units)),
+                                                        total))
+    for unit in units[:top]:
+        print('  {0:8.2f}s  {1:<8}  {2}'.format(unit['duration'],
+                                                unit['kind'],
+                                                unit['name']))
+
+    critical_path = get_critical_path(profile)
+    if critical_path:
+        print('Critical path ({0:.2f}s):'.format(
+            sum(unit['duration'] for unit in critical_path)))
+        for unit in critical_path:
+            print('  {0:8.2f}s  {1}'.format(unit['duration'], unit['name']))
+
+
+def compare_profiles(old_profile, new_profile, threshold=DEFAULT_THRESHOLD):
+    # Return units slower than in the old profile by more than threshold
+    # percent, as (name, old duration, new duration) tuples.
+    old_units = dict(((unit['kind'], unit['name']), unit)
+                     for unit in old_profile['units'])
+    regressions = []
+    for unit in new_profile['units']:
+        old_unit = old_units.get((unit['kind'], unit['name']))
+        if old_unit is None or unit['duration'] < MINIMUM_DURATION:
+            continue
+        if unit['duration'] > old_unit['duration'] * (1 + threshold / 100.0):
+            regressions.append((unit['name'],
+                                old_unit['duration'],
+                                unit['duration']))
+    return sorted(regressions,
+                  key=lambda regression: regression[2] - regression[1],
+                  reverse=True)
+
+
+def print_regressions(regressions, threshold=DEFAULT_THRESHOLD):
+    if not regressions:
+        print('No unit slower by more than {0}%.'.format(threshold))
+        return
+    print('{0} units slower by more than {1}%:'.format(len(regressions),
+                                                      threshold))
+    for name, old_duration, new_duration in regressions:
+        print('  {0:8.2f}s -> {1:8.2f}s (+{2:.0f}%)  {3}'.format(
+            old_duration, new_duration,
+            100.0 * (new_duration - old_duration) / max(old_duration, 1e-6),
+            name))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+
+    parse_parser = subparsers.add_parser('parse',
+                                         help='create a profile from logs.')
+    parse_parser.add_argument('logs', nargs='+', help='build logs.')
+    parse_parser.add_argument('-o', '--output', type=str, required=True,
+                              help='profile path.')
+    parse_parser.add_argument('--timings', type=str,
+                              help='timings from the parallel make driver.')
+
+    report_parser = subparsers.add_parser('report',
+                                          help='print a profile summary.')
+    report_parser.add_argument('profile', help='profile path.')
+    report_parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                               help='number of units to show '
+                               '(default: %(default)s).')
+
+    compare_parser = subparsers.add_parser('compare',
+                                           help='compare two profiles.')
+    compare_parser.add_argument('old_profile', help='reference profile.')
+    compare_parser.add_argument('new_profile', help='profile to check.')
+    compare_parser.add_argument('--threshold', type=float,
+                                default=DEFAULT_THRESHOLD,
+                                help='report units slower by more than '
+                                'this percentage (default: %(default)s).')
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error('a command is required.')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'parse':
+        profile = parse_logs(args.logs, args.timings)
+        save_profile(profile, args.output)
+        print_report(profile)
+    elif args.command == 'report':
+        print_report(load_profile(args.profile), args.top)
+    else:
+        regressions = compare_profiles(load_profile(args.old_profile),
+                                       load_profile(args.new_profile),
+                                       args.threshold)
+        print_regressions(regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Release manifests: path, size, and SHA-256 of the files of a release.
+#
+# Files are hashed on a thread pool from memory-mapped reads, hashlib
+# releasing the GIL while hashing large buffers.
+
+import hashlib
+import json
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def get_file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        # Empty files cannot be mapped.
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                sha256.update(data)
+    return sha256.hexdigest()
+
+
+def get_entry(path, root_dir):
+    return {
+        'path': os.path.relpath(path, root_dir).replace(os.sep, '/'),
+        'size': os.path.getsize(path),
+        'sha256': get_file_hash(path)
+    }
+
+
+def get_manifest_path(artifact_path):
+    return os.path.splitext(artifact_path)[0] + MANIFEST_SUFFIX
+
+
+def write_manifest(manifest_path, artifact_paths, file_paths, root_dir,
+                   jobs=None):
+    # Artifacts are listed by path relative to the manifest folder, files by
+    # path relative to root_dir.
+    artifacts_dir = os.path.dirname(manifest_path)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        artifacts = executor.map(
+            lambda path: get_entry(path, artifacts_dir), artifact_paths)
+        files = executor.map(lambda path: get_entry(path, root_dir),
+                             sorted(set(file_paths)))
+        manifest = {'artifacts': list(artifacts), 'files': list(files)}
+
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+# Compiler cache for MSVC builds. Used as a wrapper around the compiler:
+#
+#   compiler_cache.py cl [cl arguments]
+#
+# Object files are stored in a local cache directory keyed on the preprocessed
+# source, the compiler identity, and the compilation flags. The local cache is
+# evicted in least recently used order when it grows over its maximum size.
+# An HTTP server can be used as a shared cache between several build workers:
+# objects are fetched with GET requests and uploaded with PUT requests on
+# <url>/<key>. The "serve" command starts such a server for testing:
+#
+#   compiler_cache.py serve --port 8080 --directory shared-cache
+#
+# Configuration is done through environment variables so that the wrapper can
+# be called directly by nmake:
+#
+#   COMPILER_CACHE_DIR: local cache directory;
+#   COMPILER_CACHE_MAX_SIZE: maximum size of the local cache in bytes;
+#   COMPILER_CACHE_URL: URL of the shared HTTP cache (optional).
+
+import argparse
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from distutils.spawn import find_executable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(SCRIPT_DIR, '..', 'cache', 'compiler')
+DEFAULT_MAX_SIZE = 5 * 1024 * 1024 * 1024
+# Size of the cache after an eviction, as a fraction of its maximum size.
+EVICTION_RATIO = 0.9
+HTTP_TIMEOUT = 10
+
+SOURCE_EXTENSIONS = ['.c', '.cc', '.cpp', '.cxx']
+STATS_NAME = 'stats'
+STATS_EVENTS = ['hit', 'remote_hit', 'miss', 'uncacheable']
+# Flags for which the output is not a single object file per source. Flags
+# taking a value are matched by prefix, the other ones exactly: /E must not
+# match /EHsc.
+UNCACHEABLE_FLAGS = ['/E', '/EP', '/P', '/Zs']
+UNCACHEABLE_PREFIXES = ['/Yc', '/Yu', '/Tc', '/Tp', '/Fa', '/FA', '/Fe',
+                        '/Fm', '/FR', '/Fr']
+# Flags that are not relevant to the content of the object file.
+OUTPUT_FLAGS = ['/Fo', '/Fd']
+# Environment variables read by the compiler.
+COMPILER_ENVIRONMENT = ['CL', '_CL_']
+
+
+def get_cache_dir():
+    return os.environ.get('COMPILER_CACHE_DIR', CACHE_DIR)
+
+
+def get_max_size():
+    return int(os.environ.get('COMPILER_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE))
+
+
+def get_shim_path(cache_dir):
+    return os.path.join(cache_dir, 'cl.cmd')
+
+
+def create_shim(cache_dir):
+    # nmake macros cannot easily hold quoted paths so the compiler is replaced
+    # by a batch script calling this wrapper.
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    shim_path = get_shim_path(cache_dir)
+    with open(shim_path, 'w') as shim_file:
+        shim_file.write('@"{0}" "{1}" cl %*\n'.format(
+            sys.executable, os.path.abspath(__file__)))
+    return shim_path
+
+
+def get_make_args(cache_dir):
+    shim_path = get_shim_path(cache_dir)
+    # Vim makefiles use CC while GvimExt uses cc.
+    return ['CC={0}'.format(shim_path),
+            'cc={0}'.format(shim_path)]
+
+
+def normalize_flag(flag):
+    if flag.startswith('-'):
+        return '/' + flag[1:]
+    return flag
+
+
+def has_flag(flag, prefixes):
+    flag = normalize_flag(flag)
+    return any(flag.startswith(prefix) for prefix in prefixes)
+
+
+def is_source(argument):
+    if argument.startswith('/') or argument.startswith('-'):
+        return False
+    _, extension = os.path.splitext(argument)
+    return extension.lower() in SOURCE_EXTENSIONS
+
+
+def expand_response_files(arguments):
+    expanded = []
+    for argument in arguments:
+        if argument.startswith('@'):
+            with open(argument[1:], 'r') as response_file:
+                expanded.extend(argument.strip('"') for argument in
+                                shlex.split(response_file.read(),
+                                            posix=False))
+        else:
+            expanded.append(argument)
+    return expanded
+
+
+def parse_arguments(arguments):
+    # Return the sources, the flags, and the output path of a compilation
+    # command, or None if it cannot be cached.
+    sources = []
+    flags = []
+    output = None
+    for argument in arguments:
+        if is_source(argument):
+            sources.append(argument)
+            continue
+        normalized = normalize_flag(argument)
+        if (normalized in UNCACHEABLE_FLAGS or
+                has_flag(normalized, UNCACHEABLE_PREFIXES)):
+            return None
+        if normalized.startswith('/Fo'):
+            output = normalized[3:]
+            continue
+        flags.append(argument)
+    if '/c' not in [normalize_flag(flag) for flag in flags] or not sources:
+        return None
+    return sources, flags, output
+
+
+def get_object_path(source, output):
+    object_name = os.path.splitext(os.path.basename(source))[0] + '.obj'
+    if not output:
+        return object_name
+    if output.endswith('/') or output.endswith('\\') or os.path.isdir(output):
+        return os.path.join(output, object_name)
+    return output
+
+
+def get_compiler_identity(compiler):
+    compiler_path = find_executable(compiler) or compiler
+    stat = os.stat(compiler_path)
+    return '{0}:{1}:{2}'.format(os.path.basename(compiler_path).lower(),
+                                stat.st_size,
+                                int(stat.st_mtime))
+
+
+def get_compile_flags(flags):
+    # Debug information is stored in the object file instead of a shared
+    # PDB file so that the object can be reused alone.
+    return ['/Z7' if normalize_flag(flag) == '/Zi' else flag
+            for flag in flags]
+
+
+def preprocess(compiler, flags, source):
+    preprocess_flags = [flag for flag in flags
+                        if normalize_flag(flag) != '/c' and
+                        not has_flag(flag, OUTPUT_FLAGS)]
+    with open(os.devnull, 'w') as devnull:
+        output = subprocess.check_output(
+            [compiler] + preprocess_flags + ['/E', source], stderr=devnull)
+    # Make the preprocessed output independent of the build folder so that
+    # objects can be shared between workers.
+    return output.replace(os.getcwd().encode('utf8'), b'.').replace(
+        os.getcwd().replace('\\', '\\\\').encode('utf8'), b'.')
+
+
+def get_key(compiler, flags, source):
+    sha256 = hashlib.sha256()
+    sha256.update(get_compiler_identity(compiler).encode('utf8'))
+    for flag in get_compile_flags(flags):
+        if not has_flag(flag, OUTPUT_FLAGS):
+            sha256.update(b'\0' + flag.encode('utf8'))
+    for variable in COMPILER_ENVIRONMENT:
+        sha256.update(b'\0' + os.environ.get(variable, '').encode('utf8'))
+    sha256.update(b'\0' + preprocess(compiler, flags, source))
+    return sha256.hexdigest()
+
+
+def get_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + '.obj')
+
+
+def record_event(cache_dir, event):
+    # Appending a short line is atomic enough to be done by several
+    # compilations running at the same time.
+    with open(os.path.join(cache_dir, STATS_NAME), 'a') as stats_file:
+        stats_file.write(event + '\n')
+
+
+def get_stats(cache_dir):
+    stats = dict((event, 0) for event in STATS_EVENTS)
+    stats_path = os.path.join(cache_dir, STATS_NAME)
+    if os.path.isfile(stats_path):
+        with open(stats_path, 'r') as stats_file:
+            for line in stats_file:
+                event = line.strip()
+                if event in stats:
+                    stats[event] += 1
+    return stats
+
+
+def zero_stats(cache_dir):
+    stats_path = os.path.join(cache_dir, STATS_NAME)
+    if os.path.isfile(stats_path):
+        os.remove(stats_path)
+
+
+def print_stats(cache_dir):
+    stats = get_stats(cache_dir)
+    cacheable = stats['hit'] + stats['remote_hit'] + stats['miss']
+    hit_rate = 0
+    if cacheable:
+        hit_rate = 100.0 * (stats['hit'] + stats['remote_hit']) / cacheable
+    print('Compiler cache: {0} hits, {1} remote hits, {2} misses, '
+          '{3} uncacheable ({4:.1f}% hit rate).'.format(stats['hit'],
+                                                        stats['remote_hit'],
+                                                        stats['miss'],
+                                                        stats['uncacheable'],
+                                                        hit_rate))
+
+
+def store_object(cache_path, object_path):
+    cache_subdir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_subdir):
+        os.makedirs(cache_subdir)
+    fd, temporary_path = tempfile.mkstemp(dir=cache_subdir)
+    os.close(fd)
+    shutil.copyfile(object_path, temporary_path)
+    os.replace(temporary_path, cache_path)
+
+
+def evict(cache_dir, max_size):
+    entries = []
+    total_size = 0
+    for root, _, files in os.walk(cache_dir):
+        for filename in files:
+            if not filename.endswith('.obj'):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+    if total_size <= max_size:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        if total_size <= max_size * EVICTION_RATIO:
+            return
+
+
+def fetch_remote(url, key, object_path):
+    try:
+        response = urlopen(url.rstrip('/') + '/' + key, timeout=HTTP_TIMEOUT)
+        with open(object_path, 'wb') as object_file:
+            shutil.copyfileobj(response, object_file)
+        return True
+    except HTTPError as error:
+        if error.code != 404:
+            print('WARNING: cannot fetch object from shared cache: '
+                  '{0}'.format(error))
+    except (URLError, OSError) as error:
+        print('WARNING: cannot fetch object from shared cache: '
+              '{0}'.format(error))
+    return False
+
+
+def upload_remote(url, key, object_path):
+    with open(object_path, 'rb') as object_file:
+        request = Request(url.rstrip('/') + '/' + key,
+                          data=object_file.read(),
+                          method='PUT')
+    try:
+        urlopen(request, timeout=HTTP_TIMEOUT)
+    except (URLError, OSError) as error:
+        print('WARNING: cannot upload object to shared cache: '
+              '{0}'.format(error))
+
+
+def compile_source(compiler, flags, source, object_path):
+    return subprocess.call([compiler] + get_compile_flags(flags) +
+                           ['/Fo' + object_path, source])
+
+
+def compile_cached(compiler, arguments):
+    parsed_arguments = parse_arguments(arguments)
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    if parsed_arguments is None:
+        record_event(cache_dir, 'uncacheable')
+        return subprocess.call([compiler] + arguments)
+
+    sources, flags, output = parsed_arguments
+    url = os.environ.get('COMPILER_CACHE_URL')
+    stored = False
+    for source in sources:
+        object_path = get_object_path(source, output)
+        try:
+            key = get_key(compiler, flags, source)
+        except subprocess.CalledProcessError:
+            # Let the compiler report the error.
+            record_event(cache_dir, 'uncacheable')
+            returncode = compile_source(compiler, flags, source, object_path)
+            if returncode:
+                return returncode
+            continue
+
+        cache_path = get_cache_path(cache_dir, key)
+        try:
+            shutil.copyfile(cache_path, object_path)
+            # Mark the entry as recently used.
+            os.utime(cache_path, None)
+            record_event(cache_dir, 'hit')
+            print(source)
+            continue
+        except (IOError, OSError):
+            pass
+
+        if url and fetch_remote(url, key, object_path):
+            store_object(cache_path, object_path)
+            stored = True
+            record_event(cache_dir, 'remote_hit')
+            print(source)
+            continue
+
+        record_event(cache_dir, 'miss')
+        returncode = compile_source(compiler, flags, source, object_path)
+        if returncode:
+            return returncode
+        store_object(cache_path, object_path)
+        stored = True
+        if url:
+            upload_remote(url, key, object_path)
+
+    if stored:
+        evict(cache_dir, get_max_size())
+    return 0
+
+
+class SharedCacheHandler(BaseHTTPRequestHandler):
+    directory = None
+
+    def get_path(self):
+        key = os.path.basename(self.path)
+        return os.path.join(self.directory, key[:2], key + '.obj')
+
+    def do_GET(self):
+        path = self.get_path()
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as object_file:
+            shutil.copyfileobj(object_file, self.wfile)
+
+    def do_PUT(self):
+        length = int(self.headers['Content-Length'])
+        data = self.rfile.read(length)
+        path = self.get_path()
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as object_file:
+            object_file.write(data)
+        self.send_response(201)
+        self.end_headers()
+
+
+def serve(args):
+    SharedCacheHandler.directory = os.path.abspath(args.directory)
+    server = ThreadingHTTPServer(('', args.port), SharedCacheHandler)
+    print('Serving shared compiler cache from {0} on port {1}.'.format(
+        SharedCacheHandler.directory, args.port))
+    server.serve_forever()
+
+
+def parse_arguments_for_command(arguments):
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve',
+                                         help='start a shared cache server.')
+    serve_parser.add_argument('--port', type=int, default=8080,
+                              help='server port (default: %(default)s).')
+    serve_parser.add_argument('--directory', type=str, default='.',
+                              help='folder where objects are stored '
+                              '(default: current folder).')
+    subparsers.add_parser('stats', help='print cache statistics.')
+    subparsers.add_parser('zero', help='reset cache statistics.')
+    return parser.parse_args(arguments)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ['serve', 'stats', 'zero']:
+        args = parse_arguments_for_command(sys.argv[1:])
+        if args.command == 'serve':
+            serve(args)
+        elif args.command == 'stats':
+            print_stats(get_cache_dir())
+        else:
+            zero_stats(get_cache_dir())
+        return
+
+    if len(sys.argv) < 2:
+        sys.exit('Usage: compiler_cache.py COMPILER [ARGUMENTS]')
+    compiler = sys.argv[1]
+    sys.exit(compile_cached(compiler,
+                            expand_response_files(sys.argv[2:])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+#!/usr/bin/env python
+
+# Binary delta patches between two releases:
+#
+#   delta.py create OLD NEW PATCH
+#   delta.py apply PATCH DIRECTORY
+#
+# OLD and NEW are release folders or archives (zip, tar.gz, tar.xz,
+# tar.zst). Files are compared by path. Unchanged files are skipped,
+# executables are patched with a bsdiff-style delta, and other changed files
+# are stored whole. The patch is a zip file containing a patch.json index,
+# with the SHA-256 of each file before and after the patch, and the data of
+# each change.
+#
+# Deltas use the BSDIFF40 format so they can also be applied by bspatch. Like
+# bsdiff, the new file is described as approximate matches in the old file,
+# stored as bytewise differences that compress well when code moves, and extra
+# bytes. Exact matches are found from an index of the old file instead of a
+# suffix array, which would be too slow to build in Python.
+#
+# Applying a patch checks the SHA-256 of the files it modifies, writes their
+# new version next to them, checks the SHA-256 of the result, then replaces
+# the files, so that a failed patch leaves the folder as it was.
+#
+# The tool is not run by deploy.py, which only updates the Vim submodule and
+# pushes a tag: the release is built from that tag on AppVeyor and deploy.py
+# never has the release trees. Releases also only publish the installer, not
+# an archive of the previous release to compute a delta from.
+
+import argparse
+import bz2
+import hashlib
+import json
+import os
+import struct
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_NAME = 'patch.json'
+DATA_DIR = 'data'
+DELTA_SUFFIX = '.bsdiff'
+DELTA_EXTENSIONS = ['.exe', '.dll']
+PATCH_VERSION = 1
+
+BSDIFF_MAGIC = b'BSDIFF40'
+# Length of the old file sequences in the index and distance between them.
+# Matches longer than their sum are always found.
+INDEX_WINDOW = 8
+INDEX_STRIDE = 8
+# Bytes compared at once when counting equal bytes.
+CHUNK_SIZE = 64
+
+
+# Release trees.
+
+def read_tree(path):
+    # Return a dictionary of file contents by path, relative to the folder or
+    # to the archive root.
+    files = {}
+    if os.path.isdir(path):
+        for root, _, filenames in os.walk(path):
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                with open(file_path, 'rb') as f:
+                    files[os.path.relpath(file_path, path).replace(
+                        os.sep, '/')] = f.read()
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    files[info.filename] = archive.read(info)
+    elif path.endswith('.tar.zst'):
+        if zstandard is None:
+            raise RuntimeError('zstandard module is required for tar.zst '
+                               'archives.')
+        with open(path, 'rb') as f:
+            # Archives from archive.py are made of several zstd frames.
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                f, read_across_frames=True)
+            with tarfile.open(fileobj=reader, mode='r|') as archive:
+                read_tar_members(archive, files)
+    else:
+        with tarfile.open(path) as archive:
+            read_tar_members(archive, files)
+    return files
+
+
+def read_tar_members(archive, files):
+    for member in archive:
+        if member.isfile():
+            files[member.name] = archive.extractfile(member).read()
+
+
+def get_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# BSDIFF40 deltas.
+
+def encode_offset(value):
+    # Sign and magnitude, little-endian.
+    if value < 0:
+        return struct.pack('<Q', -value | (1 << 63))
+    return struct.pack('<Q', value)
+
+
+def decode_offset(data, offset=0):
+    value = struct.unpack_from('<Q', data, offset)[0]
+    if value & (1 << 63):
+        return -(value & ~(1 << 63))
+    return value
+
+
+def get_index(old):
+    index = {}
+    for position in range(0, len(old) - INDEX_WINDOW + 1, INDEX_STRIDE):
+        index.setdefault(old[position:position + INDEX_WINDOW], position)
+    return index
+
+
+def get_match_length(old, old_position, new, new_position):
+    # Gallop then bisect on slice comparisons, done in C.
+    limit = min(len(old) - old_position, len(new) - new_position)
+    low = 0
+    high = 1
+    while (high <= limit and
+           old[old_position:old_position + high] ==
+           new[new_position:new_position + high]):
+        low = high
+        high *= 2
+    high = min(high, limit + 1)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if (old[old_position + low:old_position + middle] ==
+                new[new_position + low:new_position + middle]):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def search(index, old, new, position, last_offset):
+    # Return the length and old position of the longest match starting at
+    # position in the new file.
+    best_length = 0
+    best_position = 0
+    candidates = [position + last_offset]
+    for shift in range(INDEX_STRIDE):
+        old_position = index.get(
+            new[position + shift:position + shift + INDEX_WINDOW])
+        if old_position is not None:
+            candidates.append(old_position - shift)
+    for old_position in candidates:
+        if 0 <= old_position < len(old):
+            length = get_match_length(old, old_position, new, position)
+            if length > best_length:
+                best_length = length
+                best_position = old_position
+    return best_length, best_position
+
+
+def count_equal_bytes(old, old_position, new, new_position, length):
+    count = 0
+    end = new_position + length
+    while new_position < end:
+        size = min(CHUNK_SIZE, end - new_position)
+        new_chunk = new[new_position:new_position + size]
+        old_chunk = old[old_position:old_position + size]
+        if new_chunk == old_chunk:
+            count += size
+        else:
+            count += sum(1 for a, b in zip(new_chunk, old_chunk) if a == b)
+        new_position += size
+        old_position += size
+    return count
+
+
+def get_forward_length(old, old_position, new, new_position, length):
+    # Length of the approximate match extending forward the previous match:
+    # the one maximizing twice the equal bytes minus the length.
+    equal = 0
+    best_score = 0
+    best_length = 0
+    i = 0
+    length = min(length, len(old) - old_position)
+    while i < length:
+        size = min(CHUNK_SIZE, length - i)
+        if (old[old_position + i:old_position + i + size] ==
+                new[new_position + i:new_position + i + size]):
+            # The score increases over equal bytes.
+            equal += size
+            i += size
+            if equal * 2 - i > best_score:
+                best_score = equal * 2 - i
+                best_length = i
+            continue
+        for _ in range(size):
+            if old[old_position + i] == new[new_position + i]:
+                equal += 1
+            i += 1
+            if equal * 2 - i > best_score:
+                best_score = equal * 2 - i
+                best_length = i
+    return best_length
+
+
+def get_backward_length(old, old_position, new, new_position, length):
+    # Same as get_forward_length, backward from the next match.
+    equal = 0
+    best_score = 0
+    best_length = 0
+    length = min(length, old_position)
+    for i in range(1, length + 1):
+        if old[old_position - i] == new[new_position - i]:
+            equal += 1
+        if equal * 2 - i > best_score:
+            best_score = equal * 2 - i
+            best_length = i
+    return best_length
+
+
+def get_difference(old, old_position, new, new_position, length):
+    chunks = []
+    for start in range(0, length, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, length - start)
+        new_chunk = new[new_position + start:new_position + start + size]
+        old_chunk = old[old_position + start:old_position + start + size]
+        if new_chunk == old_chunk:
+            chunks.append(bytes(size))
+        else:
+            chunks.append(bytes((a - b) & 0xff
+                                for a, b in zip(new_chunk, old_chunk)))
+    return b''.join(chunks)
+
+
+def diff(old, new):
+    # Port of the bsdiff scanning loop.
+    index = get_index(old)
+    control = []
+    differences = []
+    extras = []
+
+    scan = 0
+    length = 0
+    position = 0
+    last_scan = 0
+    last_position = 0
+    last_offset = 0
+    while scan < len(new):
+        old_score = 0
+        scan += length
+        scsc = scan
+        while scan < len(new):
+            length, position = search(index, old, new, scan, last_offset)
+            if scsc < scan + length:
+                if scsc + last_offset < len(old):
+                    old_score += count_equal_bytes(
+                        old, scsc + last_offset, new, scsc,
+                        min(scan + length - scsc,
+                            len(old) - scsc - last_offset))
+                scsc = scan + length
+            if (length == old_score and length) or length > old_score + 8:
+                break
+            if (scan + last_offset < len(old) and
+                    old[scan + last_offset] == new[scan]):
+                old_score -= 1
+            scan += 1
+
+        if length == old_score and scan != len(new):
+            continue
+
+        forward_length = get_forward_length(old, last_position, new,
+                                            last_scan, scan - last_scan)
+        backward_length = 0
+        if scan < len(new):
+            backward_length = get_backward_length(old, position, new, scan,
+                                                  scan - last_scan)
+
+        overlap = (last_scan + forward_length) - (scan - backward_length)
+        if overlap > 0:
+            score = 0
+            best_score = 0
+            best_length = 0
+            for i in range(overlap):
+                if (new[last_scan + forward_length - overlap + i] ==
+                        old[last_position + forward_length - overlap + i]):
+                    score += 1
+                if (new[scan - backward_length + i] ==
+                        old[position - backward_length + i]):
+                    score -= 1
+                if score > best_score:
+                    best_score = score
+                    best_length = i + 1
+            forward_length += best_length - overlap
+            backward_length -= best_length
+
+        differences.append(get_difference(old, last_position, new, last_scan,
+                                          forward_length))
+        extras.append(new[last_scan + forward_length:scan - backward_length])
+        control.append((forward_length,
+                        (scan - backward_length) -
+                        (last_scan + forward_length),
+                        (position - backward_length) -
+                        (last_position + forward_length)))
+
+        last_scan = scan - backward_length
+        last_position = position - backward_length
+        last_offset = position - scan
+
+    control_block = bz2.compress(b''.join(
+        encode_offset(value) for triple in control for value in triple))
+    difference_block = bz2.compress(b''.join(differences))
+    extra_block = bz2.compress(b''.join(extras))
+    return b''.join([BSDIFF_MAGIC,
+                     encode_offset(len(control_block)),
+                     encode_offset(len(difference_block)),
+                     encode_offset(len(new)),
+                     control_block, difference_block, extra_block])
+
+
+def patch(old, delta):
+    if delta[:8] != BSDIFF_MAGIC:
+        raise RuntimeError('invalid delta.')
+    control_length = decode_offset(delta, 8)
+    difference_length = decode_offset(delta, 16)
+    new_size = decode_offset(delta, 24)
+    control_block = bz2.decompress(delta[32:32 + control_length])
+    difference_block = bz2.decompress(
+        delta[32 + control_length:32 + control_length + difference_length])
+    extra_block = bz2.decompress(
+        delta[32 + control_length + difference_length:])
+
+    new = bytearray()
+    old_position = 0
+    difference_position = 0
+    extra_position = 0
+    for offset in range(0, len(control_block), 24):
+        difference_size = decode_offset(control_block, offset)
+        extra_size = decode_offset(control_block, offset + 8)
+        seek = decode_offset(control_block, offset + 16)
+
+        differences = difference_block[difference_position:
+                                       difference_position + difference_size]
+        base = old[old_position:old_position + difference_size]
+        # Bytes past the end of the old file are taken as is.
+        new.extend((a + b) & 0xff for a, b in zip(differences, base))
+        new.extend(differences[len(base):])
+        difference_position += difference_size
+        old_position += difference_size
+
+        new.extend(extra_block[extra_position:extra_position + extra_size])
+        extra_position += extra_size
+        old_position += seek
+    if len(new) != new_size:
+        raise RuntimeError('invalid delta.')
+    return bytes(new)
+
+
+# Patches.
+
+def uses_delta(path):
+    return os.path.splitext(path)[1].lower() in DELTA_EXTENSIONS
+
+
+def get_change(path, old_data, new_data):
+    # Return the index entry of a changed file and its data in the patch.
+    entry = {'path': path, 'sha256': get_hash(new_data)}
+    if old_data is not None:
+        entry['old_sha256'] = get_hash(old_data)
+    if old_data is not None and uses_delta(path):
+        delta = diff(old_data, new_data)
+        if len(delta) < len(bz2.compress(new_data)):
+            entry['action'] = 'delta'
+            return entry, delta
+    entry['action'] = 'copy'
+    return entry, new_data
+
+
+def create(old_path, new_path, patch_path, jobs=None):
+    old_files = read_tree(old_path)
+    new_files = read_tree(new_path)
+    changed_paths = sorted(
+        path for path, data in new_files.items()
+        if old_files.get(path) != data)
+    entries = [{'path': path, 'action': 'delete',
+                'old_sha256': get_hash(old_files[path])}
+               for path in sorted(set(old_files) - set(new_files))]
+
+    with zipfile.ZipFile(patch_path, 'w') as patch_file:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            changes = executor.map(
+                get_change, changed_paths,
+                [old_files.get(path) for path in changed_paths],
+                [new_files[path] for path in changed_paths])
+            for entry, data in changes:
+                name = '/'.join([DATA_DIR, entry['path']])
+                if entry['action'] == 'delta':
+                    patch_file.writestr(name + DELTA_SUFFIX, data,
+                                        zipfile.ZIP_STORED)
+                else:
+                    patch_file.writestr(name, data, zipfile.ZIP_DEFLATED)
+                entries.append(entry)
+                print('{0}: {1} ({2} bytes).'.format(
+                    entry['path'], entry['action'], len(data)))
+        patch_file.writestr(INDEX_NAME, json.dumps(
+            {'version': PATCH_VERSION, 'files': entries}, indent=2,
+            sort_keys=True))
+    print('{0} files changed, {1} unchanged. Patch size: {2} '
+          'bytes.'.format(len(entries), len(new_files) - len(changed_paths),
+                          os.path.getsize(patch_path)))
+
+
+def check_hash(path, expected_hash):
+    if not os.path.isfile(path):
+        raise RuntimeError('{0} is missing.'.format(path))
+    with open(path, 'rb') as f:
+        if get_hash(f.read()) != expected_hash:
+            raise RuntimeError('{0} does not match the patch. Was it '
+                               'modified?'.format(path))
+
+
+def apply(patch_path, directory):
+    with zipfile.ZipFile(patch_path) as patch_file:
+        index = json.loads(patch_file.read(INDEX_NAME).decode('utf8'))
+        if index['version'] != PATCH_VERSION:
+            raise RuntimeError('unsupported patch version {0}.'.format(
+                index['version']))
+
+        # Write and check all new files before replacing any.
+        temp_paths = {}
+        try:
+            for entry in index['files']:
+                path = os.path.join(directory, *entry['path'].split('/'))
+                if 'old_sha256' in entry:
+                    check_hash(path, entry['old_sha256'])
+                if entry['action'] == 'delete':
+                    continue
+
+                name = '/'.join([DATA_DIR, entry['path']])
+                if entry['action'] == 'delta':
+                    with open(path, 'rb') as f:
+                        data = patch(f.read(), patch_file.read(
+                            name + DELTA_SUFFIX))
+                else:
+                    data = patch_file.read(name)
+                if get_hash(data) != entry['sha256']:
+                    raise RuntimeError('checksum mismatch for {0} after '
+                                       'patching.'.format(entry['path']))
+
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                temp_paths[path] = path + '.patch'
+                with open(temp_paths[path], 'wb') as f:
+                    f.write(data)
+        except Exception:
+            for temp_path in temp_paths.values():
+                os.remove(temp_path)
+            raise
+
+    for path, temp_path in temp_paths.items():
+        os.replace(temp_path, path)
+    for entry in index['files']:
+        if entry['action'] == 'delete':
+            os.remove(os.path.join(directory, *entry['path'].split('/')))
+    print('Patched {0} files.'.format(len(index['files'])))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    create_parser = subparsers.add_parser(
+        'create', help='create a patch from the old to the new release.')
+    create_parser.add_argument('old', help='old release folder or archive.')
+    create_parser.add_argument('new', help='new release folder or archive.')
+    create_parser.add_argument('patch', help='patch file.')
+    create_parser.add_argument('-j', '--jobs', type=int,
+                               help='number of files diffed in parallel '
+                               '(default: number of processors).')
+
+    apply_parser = subparsers.add_parser(
+        'apply', help='apply a patch to a release folder.')
+    apply_parser.add_argument('patch', help='patch file.')
+    apply_parser.add_argument('directory', help='release folder.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    if args.command == 'create':
+        create(args.old, args.new, args.patch, args.jobs)
+    else:
+        apply(args.patch, args.directory)
+
+
+if __name__ == '__main__':
+    main()
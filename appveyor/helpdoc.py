@@ -0,0 +1,217 @@
+# Preprocessing of the runtime documentation for the package: the help tags
+# index, as generated by :helptags, and the help files formatted as plain text
+# for the NSIS installer.
+#
+# Help files are parsed in parallel. The tags of each file and the state of
+# the NSIS text files are kept in an index keyed on the file hashes so that
+# only changed files are parsed again.
+
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_PATH = os.path.join(SCRIPT_DIR, '..', 'cache', 'doc', 'index.json')
+
+TAGS_NAME = 'tags'
+HELP_PATTERN = re.compile(r'\.txt$')
+NSIS_SUFFIX = '.nsis.txt'
+# Entry added by :helptags for the tags file of the runtime.
+HELP_TAGS_ENTRY = 'help-tags\ttags\t1\n'
+ENCODING_LINE = '!_TAG_FILE_ENCODING\tutf-8\t//\n'
+TAG_NAME_REGEX = re.compile(r'[ \t]*\*[-a-zA-Z0-9.]*\*')
+
+
+def get_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def is_help_file(filename):
+    return bool(HELP_PATTERN.search(filename)) and not filename.endswith(
+        NSIS_SUFFIX)
+
+
+def get_encoding(line):
+    # Like :helptags, a non-ASCII character in the first line tells if the
+    # file is in UTF-8. Return None when the line is in ASCII.
+    if all(byte < 0x80 for byte in line):
+        return None
+    try:
+        line.decode('utf8')
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def get_line_tags(line):
+    # Port of the tag detection of :helptags: a tag is a word between stars,
+    # without white space or bar, preceded by white space or at the start of
+    # the line, and followed by white space or the end of the line.
+    tags = []
+    start = line.find(b'*')
+    while start != -1:
+        end = line.find(b'*', start + 1)
+        if end == -1:
+            break
+        tag = line[start + 1:end]
+        if (tag and not any(character in tag for character in b' \t|') and
+                (start == 0 or line[start - 1:start] in [b' ', b'\t']) and
+                line[end + 1:end + 2] in [b'', b' ', b'\t', b'\n', b'\r']):
+            tags.append(tag)
+        start = end
+    return tags
+
+
+def is_example_start(line):
+    line = line.rstrip(b'\r\n')
+    return line == b'>' or line.endswith(b' >')
+
+
+def parse_help_file(path):
+    # Return the tags of a help file and its encoding. Like recent versions of
+    # :helptags, tags in examples are ignored. An example starts after a line
+    # ending with ">" and ends at the first line not starting with white
+    # space.
+    with open(path, 'rb') as help_file:
+        lines = help_file.readlines()
+    encoding = get_encoding(lines[0]) if lines else None
+    tags = []
+    in_example = False
+    for line in lines:
+        if in_example:
+            if line[:1] in [b' ', b'\t', b'\r', b'\n']:
+                continue
+            in_example = False
+        tags.extend(tag.decode('utf8', 'surrogateescape')
+                    for tag in get_line_tags(line))
+        in_example = is_example_start(line)
+    return tags, encoding
+
+
+def escape_tag(tag):
+    return tag.replace('\\', '\\\\').replace('/', '\\/')
+
+
+def get_tags_content(tags_by_file, add_help_tags=True):
+    entries = [(tag, filename)
+               for filename, tags in tags_by_file.items()
+               for tag in tags]
+    lines = ['{0}\t{1}\t/*{2}*\n'.format(tag, filename, escape_tag(tag))
+             for tag, filename in entries]
+    if add_help_tags:
+        lines.append(HELP_TAGS_ENTRY)
+    # Sorted by byte values, as done by Vim.
+    lines.sort(key=lambda line: line.encode('utf8', 'surrogateescape'))
+
+    for previous, line in zip(lines, lines[1:]):
+        if previous.split('\t')[0] == line.split('\t')[0]:
+            raise RuntimeError('duplicate tag "{0}" in {1} and {2}.'.format(
+                line.split('\t')[0], previous.split('\t')[1],
+                line.split('\t')[1]))
+    return lines
+
+
+def write_if_changed(path, content):
+    # Keep the file time when nothing changed.
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    with open(path, 'wb') as f:
+        f.write(content)
+    return True
+
+
+def generate_tags(doc_dir, tags_by_file, encodings):
+    known_encodings = set(encoding for encoding in encodings.values()
+                          if encoding is not None)
+    if len(known_encodings) > 1:
+        raise RuntimeError('mix of help file encodings in {0}.'.format(
+            doc_dir))
+    lines = get_tags_content(tags_by_file)
+    if known_encodings == {True}:
+        lines.insert(0, ENCODING_LINE)
+    return write_if_changed(
+        os.path.join(doc_dir, TAGS_NAME),
+        ''.join(lines).encode('utf8', 'surrogateescape'))
+
+
+def get_nsis_path(path):
+    return os.path.splitext(path)[0] + NSIS_SUFFIX
+
+
+def generate_nsis_file(path):
+    # Help files are written in Vim doc so we need to remove the tags and the
+    # modeline for the package.
+    with open(path, 'r') as help_file:
+        lines = help_file.readlines()
+    with open(get_nsis_path(path), 'w') as nsis_file:
+        for line in lines[:-1]:
+            nsis_file.write(TAG_NAME_REGEX.sub('', line))
+
+
+def load_index():
+    if not os.path.isfile(INDEX_PATH):
+        return {}
+    with open(INDEX_PATH, 'r') as index_file:
+        return json.load(index_file)
+
+
+def save_index(index):
+    index_dir = os.path.dirname(INDEX_PATH)
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    with open(INDEX_PATH, 'w') as index_file:
+        json.dump(index, index_file, indent=2, sort_keys=True)
+
+
+def process(doc_dir, nsis_files=None):
+    # A change to this module invalidates all files.
+    module_hash = get_file_hash(__file__)
+    index = load_index()
+    if index.get('module') != module_hash:
+        index = {}
+    files = index.get('files', {})
+    new_files = {}
+    parses = {}
+    nsis_generations = {}
+    nsis_files = nsis_files or []
+    with ProcessPoolExecutor() as executor:
+        for filename in sorted(os.listdir(doc_dir)):
+            if not is_help_file(filename):
+                continue
+            path = os.path.join(doc_dir, filename)
+            file_hash = get_file_hash(path)
+            entry = files.get(filename)
+            if entry is None or entry['hash'] != file_hash:
+                entry = {'hash': file_hash}
+                parses[filename] = executor.submit(parse_help_file, path)
+            if filename in nsis_files and (
+                    entry.get('nsis') != file_hash or
+                    not os.path.isfile(get_nsis_path(path))):
+                nsis_generations[filename] = executor.submit(
+                    generate_nsis_file, path)
+                entry['nsis'] = file_hash
+            new_files[filename] = entry
+
+        for filename, parse in parses.items():
+            new_files[filename]['tags'], new_files[filename]['encoding'] = (
+                parse.result())
+        for generation in nsis_generations.values():
+            generation.result()
+
+    updated = generate_tags(
+        doc_dir,
+        dict((filename, entry['tags'])
+             for filename, entry in new_files.items()),
+        dict((filename, entry['encoding'])
+             for filename, entry in new_files.items()))
+    save_index({'module': module_hash, 'files': new_files})
+    print('{0} of {1} help files parsed. Tags {2}.'.format(
+        len(parses), len(new_files), 'updated' if updated else 'unchanged'))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# Compile PO translation files to MO catalogs without the gettext tools:
+#
+#   msgfmt.py -o OUTPUT INPUT
+#
+# The output is byte-identical to GNU msgfmt run with its default options:
+# untranslated, fuzzy (except the header), and obsolete messages are dropped,
+# messages are sorted, and a hash table is included. Strings are kept in the
+# encoding of the PO file.
+
+import argparse
+import re
+import struct
+
+MO_MAGIC = 0x950412de
+MO_REVISION = 0
+MO_HEADER_SIZE = 28
+
+CONTEXT_SEPARATOR = b'\x04'
+PLURAL_SEPARATOR = b'\x00'
+
+KEYWORD_REGEX = re.compile(
+    br'^(msgctxt|msgid_plural|msgid|msgstr(?:\[(\d+)\])?)\s*(".*")$')
+ESCAPE_REGEX = re.compile(br'\\([0-7]{1,3}|x[0-9a-fA-F]+|.)')
+ESCAPES = {
+    b'a': b'\a',
+    b'b': b'\b',
+    b'f': b'\f',
+    b'n': b'\n',
+    b'r': b'\r',
+    b't': b'\t',
+    b'v': b'\v',
+}
+
+
+class PoError(Exception):
+    pass
+
+
+class Entry(object):
+
+    def __init__(self):
+        self.context = None
+        self.msgid = None
+        self.msgid_plural = None
+        self.msgstrs = {}
+        self.fuzzy = False
+        self.obsolete = False
+        self.line_number = 0
+
+    def is_header(self):
+        return self.context is None and self.msgid == b''
+
+    def get_key(self):
+        key = self.msgid
+        if self.msgid_plural is not None:
+            key += PLURAL_SEPARATOR + self.msgid_plural
+        if self.context is not None:
+            key = self.context + CONTEXT_SEPARATOR + key
+        return key
+
+    def get_value(self):
+        return PLURAL_SEPARATOR.join(self.msgstrs[index]
+                                     for index in sorted(self.msgstrs))
+
+
+def unescape_character(match):
+    escape = match.group(1)
+    if escape[:1].isdigit():
+        return bytes([int(escape, 8) & 0xff])
+    if escape[:1] == b'x':
+        return bytes([int(escape[1:], 16) & 0xff])
+    return ESCAPES.get(escape, escape)
+
+
+def parse_string(text, path, line_number):
+    text = text.strip()
+    if len(text) < 2 or not text.startswith(b'"') or not text.endswith(b'"'):
+        raise PoError('{0}:{1}: invalid string.'.format(path, line_number))
+    return ESCAPE_REGEX.sub(unescape_character, text[1:-1])
+
+
+def parse_po(data, path='<input>'):
+    entries = []
+    entry = Entry()
+    section = None
+
+    def finish(entry):
+        if entry.msgid is not None:
+            entries.append(entry)
+        return Entry()
+
+    for line_number, line in enumerate(data.splitlines(), 1):
+        line = line.strip()
+        obsolete = line.startswith(b'#~')
+        if obsolete:
+            line = line[2:].strip()
+            # Previous msgid of an obsolete message.
+            if line.startswith(b'|'):
+                continue
+        elif line.startswith(b'#'):
+            if entry.msgstrs:
+                entry = finish(entry)
+                section = None
+            if line.startswith(b'#,'):
+                flags = [flag.strip() for flag in line[2:].split(b',')]
+                entry.fuzzy = entry.fuzzy or b'fuzzy' in flags
+            continue
+        if not line:
+            continue
+
+        if line.startswith(b'"'):
+            if section is None:
+                raise PoError('{0}:{1}: string without keyword.'.format(
+                    path, line_number))
+            value = parse_string(line, path, line_number)
+            if section == 'msgstr':
+                entry.msgstrs[index] += value
+            else:
+                setattr(entry, section, getattr(entry, section) + value)
+            continue
+
+        match = KEYWORD_REGEX.match(line)
+        if not match:
+            raise PoError('{0}:{1}: syntax error.'.format(path, line_number))
+        keyword = match.group(1)
+        value = parse_string(match.group(3), path, line_number)
+        if keyword in [b'msgctxt', b'msgid'] and entry.msgstrs:
+            entry = finish(entry)
+        entry.obsolete = entry.obsolete or obsolete
+        if keyword == b'msgctxt':
+            section = 'context'
+            entry.context = value
+            entry.line_number = line_number
+        elif keyword == b'msgid':
+            section = 'msgid'
+            entry.msgid = value
+            if entry.context is None:
+                entry.line_number = line_number
+        elif keyword == b'msgid_plural':
+            section = 'msgid_plural'
+            entry.msgid_plural = value
+        else:
+            section = 'msgstr'
+            index = int(match.group(2) or 0)
+            entry.msgstrs[index] = value
+    finish(entry)
+    return entries
+
+
+def get_messages(entries, path='<input>'):
+    messages = {}
+    for entry in entries:
+        if entry.obsolete:
+            continue
+        if not entry.msgstrs or not entry.msgstrs[min(entry.msgstrs)]:
+            continue
+        if entry.fuzzy and not entry.is_header():
+            continue
+        key = entry.get_key()
+        if key in messages:
+            raise PoError('{0}:{1}: duplicate message definition.'.format(
+                path, entry.line_number))
+        messages[key] = entry.get_value()
+    return messages
+
+
+def hash_string(key):
+    # hashpjw from gettext, computed up to the first null character. For
+    # plural messages, this is the singular form.
+    value = 0
+    for character in bytearray(key.split(PLURAL_SEPARATOR, 1)[0]):
+        value = (value << 4) + character
+        high_bits = value & 0xf0000000
+        if high_bits:
+            value ^= high_bits >> 24
+            value ^= high_bits
+    return value
+
+
+def is_prime(candidate):
+    # Same test as gettext, including its results for numbers below 10.
+    divisor = 3
+    square = divisor * divisor
+    while square < candidate and candidate % divisor:
+        divisor += 1
+        square += 4 * divisor
+        divisor += 1
+    return candidate % divisor != 0
+
+
+def next_prime(seed):
+    seed |= 1
+    while not is_prime(seed):
+        seed += 2
+    return seed
+
+
+def get_hash_table(keys):
+    size = max(next_prime(len(keys) * 4 // 3), 3)
+    table = [0] * size
+    for number, key in enumerate(keys, 1):
+        value = hash_string(key)
+        index = value % size
+        if table[index]:
+            increment = 1 + value % (size - 2)
+            while table[index]:
+                if index >= size - increment:
+                    index -= size - increment
+                else:
+                    index += increment
+        table[index] = number
+    return table
+
+
+def generate_mo(messages):
+    keys = sorted(messages)
+    values = [messages[key] for key in keys]
+    hash_table = get_hash_table(keys)
+
+    count = len(keys)
+    keys_offset = MO_HEADER_SIZE
+    values_offset = keys_offset + 8 * count
+    hash_table_offset = values_offset + 8 * count
+    strings_offset = hash_table_offset + 4 * len(hash_table)
+
+    descriptors = []
+    strings = []
+    for string in keys + values:
+        descriptors.append(struct.pack('<2I', len(string), strings_offset))
+        strings.append(string + b'\x00')
+        strings_offset += len(string) + 1
+
+    header = struct.pack('<7I', MO_MAGIC, MO_REVISION, count, keys_offset,
+                         values_offset, len(hash_table), hash_table_offset)
+    return b''.join([header] + descriptors +
+                    [struct.pack('<{0}I'.format(len(hash_table)),
+                                 *hash_table)] + strings)
+
+
+def compile_file(po_path, mo_path):
+    with open(po_path, 'rb') as po_file:
+        entries = parse_po(po_file.read(), po_path)
+    with open(mo_path, 'wb') as mo_file:
+        mo_file.write(generate_mo(get_messages(entries, po_path)))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='MO file to write.')
+    parser.add_argument('input', help='PO file to compile.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    compile_file(args.input, args.output)
+
+
+if __name__ == '__main__':
+    main()
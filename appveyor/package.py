@@ -4,155 +4,211 @@ import argparse
 import os
 import re
 import shutil
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from distutils.spawn import find_executable
 
+import archive
+import buildlog
+import checksums
+import compiler_cache
+import helpdoc
+import staging
+import toolchain
+import upx
+
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.join(SCRIPT_DIR, '..', 'vim')
 SOURCES_DIR = os.path.join(ROOT_DIR, 'src')
 RUNTIME_DIR = os.path.join(ROOT_DIR, 'runtime')
 NSIS_DIR = os.path.join(ROOT_DIR, 'nsis')
 DOC_DIR = os.path.join(RUNTIME_DIR, 'doc')
+# Help files formatted as plain text for the NSIS script.
+NSIS_DOC_FILES = ['uganda.txt']
 XXD_DIR = os.path.join(SOURCES_DIR, 'xxd')
 GVIM_EXT_DIR = os.path.join(SOURCES_DIR, 'GvimExt')
-GVIM_EXT32_DIR = os.path.join(SOURCES_DIR, 'GvimExt32')
-GVIM_EXT64_DIR = os.path.join(SOURCES_DIR, 'GvimExt64')
-GVIM_EXT32_RUNTIME_DIR = os.path.join(RUNTIME_DIR, 'GvimExt32')
-GVIM_EXT64_RUNTIME_DIR = os.path.join(RUNTIME_DIR, 'GvimExt64')
+# GvimExt is built for each architecture in its own copy of the sources, next
+# to the original so that relative paths still work.
+GVIM_EXT_STAGING_DIR = os.path.join(SOURCES_DIR, 'GvimExt.build{0}')
+GVIM_EXT_STAGING_IGNORED_PATTERNS = ['*.obj', '*.res', '*.dll', '*.exp',
+                                     '*.lib', '*.pdb']
+GVIM_EXT_ARCH_DIR = os.path.join(SOURCES_DIR, 'GvimExt{0}')
+
+# Files put in place for the NSIS script, as (source, destination) paths
+# relative to the Vim folder. A source folder stages all its files.
+STAGING_MANIFEST = [
+    ('vimtutor.bat', os.path.join('runtime', 'vimtutor.bat')),
+    ('README.txt', os.path.join('runtime', 'README.txt')),
+    (os.path.join('src', 'vim.exe'), os.path.join('src', 'vimw32.exe')),
+    (os.path.join('src', 'tee', 'tee.exe'), os.path.join('src', 'teew32.exe')),
+    (os.path.join('src', 'xxd', 'xxd.exe'), os.path.join('src', 'xxdw32.exe')),
+    (os.path.join('src', 'install.exe'),
+     os.path.join('src', 'installw32.exe')),
+    (os.path.join('src', 'uninstal.exe'),
+     os.path.join('src', 'uninstalw32.exe')),
+    (os.path.join('src', 'gvim.exe'), os.path.join('src', 'gvim_ole.exe')),
+] + [
+    (os.path.join('src', 'GvimExt', filename),
+     os.path.join('src', 'GvimExt{0}'.format(arch), filename))
+    for arch in [32, 64]
+    for filename in ['README.txt', 'gvimext.inf', 'GvimExt.reg']
+] + [
+    (os.path.join('src', 'GvimExt{0}'.format(arch)),
+     os.path.join('runtime', 'GvimExt{0}'.format(arch)))
+    for arch in [32, 64]
+]
+
+# Files of the portable archives, as (source, destination) paths relative to
+# the Vim folder and to the version folder of the archive.
+ARCHIVE_MANIFEST = [
+    ('runtime', ''),
+    (os.path.join('src', 'gvim.exe'), 'gvim.exe'),
+    (os.path.join('src', 'vim.exe'), 'vim.exe'),
+    (os.path.join('src', 'vimrun.exe'), 'vimrun.exe'),
+    (os.path.join('src', 'tee', 'tee.exe'), 'tee.exe'),
+    (os.path.join('src', 'xxd', 'xxd.exe'), 'xxd.exe'),
+    (os.path.join('src', 'install.exe'), 'install.exe'),
+    (os.path.join('src', 'uninstal.exe'), 'uninstal.exe'),
+]
+ARCHIVE_IGNORED_FILES = ['uganda.nsis.txt']
+VERSION_PATH = os.path.join(SOURCES_DIR, 'version.h')
+
+# Arguments checking that an executable compressed by UPX still runs.
+UPX_LAUNCH_ARGS = {
+    'vimw32.exe': ['--version'],
+    'gvim_ole.exe': ['-u', 'NONE', '-U', 'NONE', '-c', 'qall!'],
+    'teew32.exe': [],
+    'xxdw32.exe': ['-v'],
+}
+UPX_REPORT_PATH = os.path.join(NSIS_DIR, 'upx-report.txt')
+
 GVIM_NSIS_PATH = os.path.join(NSIS_DIR, 'gvim.nsi')
 GVIM_PACKAGE_PATH = os.path.join(NSIS_DIR, 'gvim-package.exe')
 
-MSVC_BIN_DIR = os.path.join('..', '..', 'VC')
-
-
-def get_msvc_dir(args):
-    if args.msvc == 11:
-        return os.path.join(os.environ['VS110COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 12:
-        return os.path.join(os.environ['VS120COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 14:
-        return os.path.join(os.environ['VS140COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 15:
-        return get_msvc15_dir()
-    raise RuntimeError('msvc parameter should be 11, 12, 14, or 15.')
-
-
-def get_msvc15_dir():
-    vswhere = os.path.join(os.environ['ProgramFiles(x86)'],
-                           'Microsoft Visual Studio',
-                           'Installer',
-                           'vswhere.exe')
-    if not os.path.exists(vswhere):
-        raise RuntimeError('cannot find vswhere. '
-                           'VS 2017 version 15.2 or later is required.')
-
-    installation_path = subprocess.check_output(
-        [vswhere, '-latest', '-property', 'installationPath']
-    ).strip().decode('utf8')
-    return os.path.join(installation_path, 'VC', 'Auxiliary', 'Build')
-
-
-def get_vc_mod(arch):
-    if arch == 64:
-        return 'x86_amd64'
-    return 'x86'
-
-
-def get_nmake_cmd(args, arch):
-    msvc_dir = get_msvc_dir(args)
-    vc_vars_script_path = os.path.join(msvc_dir, 'vcvarsall.bat')
-    return [vc_vars_script_path, get_vc_mod(arch), '&', 'nmake.exe']
-
-
-def generate_uganda_file():
-    # Uganda manual is written in Vim doc so we need to apply some formatting
-    # to it for the package.
-    uganda_path = os.path.join(DOC_DIR, 'uganda.txt')
-    nsis_uganda_path = os.path.join(DOC_DIR, 'uganda.nsis.txt')
-    with open(uganda_path, "r") as uganda_file:
-        lines = uganda_file.readlines()
-    with open(nsis_uganda_path, "w") as nsis_uganda_file:
-        for line in lines[:-1]:
-            nsis_uganda_file.write(re.sub(r'[ \t]*\*[-a-zA-Z0-9.]*\*', '',
-                                          line))
-
 
 def rename_package(args):
     os.rename(GVIM_PACKAGE_PATH,
               os.path.join(NSIS_DIR, args.package))
 
 
-def build_gvimext(args, arch):
-    nmake_cmd = get_nmake_cmd(args, arch)
+def get_version_dir():
+    # Folder of the runtime files in an installation, like vim81.
+    with open(VERSION_PATH, 'r') as version_file:
+        match = re.search(r'^#define\s+VIM_VERSION_NODOT\s+"(\w+)"',
+                          version_file.read(), re.MULTILINE)
+    if not match:
+        raise RuntimeError('Cannot find Vim version in {0}.'.format(
+            VERSION_PATH))
+    return match.group(1)
+
+
+def get_archive_entries():
+    prefix = 'vim/' + get_version_dir()
+    for source, destination in ARCHIVE_MANIFEST:
+        for path, name in archive.get_entries(
+                os.path.join(ROOT_DIR, source),
+                '/'.join(part for part in [prefix, destination] if part)):
+            if os.path.basename(path) not in ARCHIVE_IGNORED_FILES:
+                yield path, name
+
+
+def get_archive_path(args, archive_format):
+    name = os.path.splitext(args.package)[0]
+    return os.path.join(NSIS_DIR, '{0}.{1}'.format(name, archive_format))
+
+
+def generate_archives(args):
+    for archive_format in args.archive:
+        archive_path = get_archive_path(args, archive_format)
+        print('Creating {0}.'.format(archive_path))
+        archive.create_archive(archive_path, get_archive_entries(),
+                               dict(args.archive_level), args.archive_jobs)
+
+
+def compress_executables(args, upx_path):
+    paths = [path
+             for source, destination in STAGING_MANIFEST
+             for _, path in staging.get_entries(
+                 os.path.join(ROOT_DIR, source),
+                 os.path.join(ROOT_DIR, destination))
+             if upx.is_eligible(path)]
+    report = upx.compress_files(upx_path, paths, UPX_LAUNCH_ARGS,
+                                args.upx_jobs)
+    upx.write_report(report, UPX_REPORT_PATH)
+
+
+def get_staged_paths():
+    # Files of the installer: the runtime folder and the staged files.
+    paths = [path for path, _ in staging.get_entries(RUNTIME_DIR, '')]
+    for _, destination in STAGING_MANIFEST:
+        paths.extend(path for path, _ in staging.get_entries(
+            os.path.join(ROOT_DIR, destination), ''))
+    return paths
+
+
+def generate_manifest(args):
+    artifact_paths = [get_archive_path(args, archive_format)
+                      for archive_format in args.archive]
+    if not args.skip_installer:
+        artifact_paths.insert(0, os.path.join(NSIS_DIR, args.package))
+    manifest_path = checksums.get_manifest_path(
+        os.path.join(NSIS_DIR, args.package))
+    checksums.write_manifest(manifest_path, artifact_paths,
+                             get_staged_paths(), ROOT_DIR)
+    print('Release manifest written to {0}.'.format(manifest_path))
 
-    os.chdir(GVIM_EXT_DIR)
 
-    subprocess.check_call(nmake_cmd + ['clean', 'all'])
+def build_gvimext(args, arch):
+    nmake_cmd = toolchain.get_nmake_cmd(args.msvc, arch)
+
+    staging_dir = GVIM_EXT_STAGING_DIR.format(arch)
+    if os.path.exists(staging_dir):
+        shutil.rmtree(staging_dir)
+    shutil.copytree(GVIM_EXT_DIR, staging_dir,
+                    ignore=shutil.ignore_patterns(
+                        *GVIM_EXT_STAGING_IGNORED_PATTERNS))
+
+    build_args = []
+    if args.compiler_cache:
+        build_args.extend(
+            compiler_cache.get_make_args(compiler_cache.get_cache_dir()))
+
+    buildlog.run(nmake_cmd + ['all'] + build_args,
+                 cwd=staging_dir,
+                 env=toolchain.get_environment(args.msvc, arch),
+                 prefix='gvimext{0}'.format(arch))
+
+    arch_dir = GVIM_EXT_ARCH_DIR.format(arch)
+    if not os.path.exists(arch_dir):
+        os.makedirs(arch_dir)
+    os.replace(os.path.join(staging_dir, 'gvimext.dll'),
+               os.path.join(arch_dir, 'gvimext.dll'))
+    shutil.rmtree(staging_dir)
+
+
+def build_gvimexts(args):
+    if args.compiler_cache:
+        compiler_cache.create_shim(compiler_cache.get_cache_dir())
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        builds = [executor.submit(build_gvimext, args, arch)
+                  for arch in [32, 64]]
+    for build in builds:
+        build.result()
 
 
 def generate_package(args):
-    generate_uganda_file()
-
-    shutil.copy(os.path.join(ROOT_DIR, 'vimtutor.bat'),
-                os.path.join(ROOT_DIR, 'runtime'))
-
-    shutil.copy(os.path.join(ROOT_DIR, 'README.txt'),
-                os.path.join(ROOT_DIR, 'runtime'))
-
-    shutil.copy(os.path.join(SOURCES_DIR, 'vim.exe'),
-                os.path.join(SOURCES_DIR, 'vimw32.exe'))
-
-    shutil.copy(os.path.join(SOURCES_DIR, 'tee', 'tee.exe'),
-                os.path.join(SOURCES_DIR, 'teew32.exe'))
-
-    shutil.copy(os.path.join(SOURCES_DIR, 'xxd', 'xxd.exe'),
-                os.path.join(SOURCES_DIR, 'xxdw32.exe'))
-
-    shutil.copy(os.path.join(SOURCES_DIR, 'install.exe'),
-                os.path.join(SOURCES_DIR, 'installw32.exe'))
-
-    shutil.copy(os.path.join(SOURCES_DIR, 'uninstal.exe'),
-                os.path.join(SOURCES_DIR, 'uninstalw32.exe'))
-
-    shutil.copy(os.path.join(SOURCES_DIR, 'gvim.exe'),
-                os.path.join(SOURCES_DIR, 'gvim_ole.exe'))
-
-    for directory in [GVIM_EXT32_DIR,
-                      GVIM_EXT64_DIR,
-                      GVIM_EXT32_RUNTIME_DIR,
-                      GVIM_EXT64_RUNTIME_DIR]:
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-    build_gvimext(args, 32)
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'gvimext.dll'),
-                os.path.join(GVIM_EXT32_DIR, 'gvimext.dll'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'README.txt'),
-                os.path.join(GVIM_EXT32_DIR, 'README.txt'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'gvimext.inf'),
-                os.path.join(GVIM_EXT32_DIR, 'gvimext.inf'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'GvimExt.reg'),
-                os.path.join(GVIM_EXT32_DIR, 'GvimExt.reg'))
-    for filepath in os.listdir(GVIM_EXT32_DIR):
-        shutil.copy(filepath, GVIM_EXT32_RUNTIME_DIR)
-
-    build_gvimext(args, 64)
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'gvimext.dll'),
-                os.path.join(GVIM_EXT_DIR, 'gvimext64.dll'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'gvimext.dll'),
-                os.path.join(GVIM_EXT64_DIR, 'gvimext.dll'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'README.txt'),
-                os.path.join(GVIM_EXT64_DIR, 'README.txt'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'gvimext.inf'),
-                os.path.join(GVIM_EXT64_DIR, 'gvimext.inf'))
-    shutil.copy(os.path.join(GVIM_EXT_DIR, 'GvimExt.reg'),
-                os.path.join(GVIM_EXT64_DIR, 'GvimExt.reg'))
-    for filepath in os.listdir(GVIM_EXT64_DIR):
-        shutil.copy(filepath, GVIM_EXT64_RUNTIME_DIR)
-
-    upx = find_executable('upx')
-    if upx is None:
+    helpdoc.process(DOC_DIR, NSIS_DOC_FILES)
+    build_gvimexts(args)
+    staging.print_counts(staging.stage(STAGING_MANIFEST, ROOT_DIR))
+    generate_archives(args)
+    if args.skip_installer:
+        generate_manifest(args)
+        return
+
+    upx_path = find_executable('upx')
+    if upx_path is None:
         print('WARNING: Ultimate Packer eXecutables is not available.')
+    elif not args.skip_upx:
+        compress_executables(args, upx_path)
 
     makensis = find_executable('makensis')
     if makensis is None:
@@ -162,18 +218,18 @@ def generate_package(args):
     vimrt = '/DVIMRT={0}'.format(os.path.join('..', 'runtime'))
     outfile = '/XOutFile {0}'.format('gvim-package.exe')
 
-    subprocess.check_call([makensis,
-                           vimrt,
-                           GVIM_NSIS_PATH,
-                           outfile])
+    buildlog.run([makensis,
+                  vimrt,
+                  GVIM_NSIS_PATH,
+                  outfile])
 
     rename_package(args)
+    generate_manifest(args)
 
 
 def clean_up():
     remove_if_exists(os.path.join(ROOT_DIR, 'runtime', 'vimtutor.bat'))
     remove_if_exists(os.path.join(ROOT_DIR, 'runtime', 'README.txt'))
-    remove_if_exists(os.path.join(GVIM_EXT_DIR, 'gvimext64.dll'))
 
 
 def remove_if_exists(path):
@@ -186,10 +242,36 @@ def parse_arguments():
     parser.add_argument('--msvc', type=int, choices=[11, 12, 14, 15],
                         default=15, help='choose the Microsoft Visual '
                         'Studio version (default: %(default)s).')
+    parser.add_argument('--compiler-cache', action='store_true',
+                        help='reuse object files from the compiler cache '
+                        '(folder set by COMPILER_CACHE_DIR).')
+    parser.add_argument('--skip-upx', action='store_true',
+                        help='do not compress the executables with UPX.')
+    parser.add_argument('--upx-jobs', type=int,
+                        help='number of files compressed in parallel by UPX '
+                        '(default: number of processors).')
+    parser.add_argument('--archive', type=str, action='append', default=[],
+                        choices=archive.FORMATS,
+                        help='also create a portable archive of this '
+                        'format, named after the package. Can be repeated.')
+    parser.add_argument('--archive-level', type=archive.parse_level,
+                        action='append', default=[], metavar='EXT=N',
+                        help='compression level of the archives for files '
+                        'with extension EXT, or for all other files if EXT '
+                        'is empty (default: {0}).'.format(
+                            archive.DEFAULT_LEVEL))
+    parser.add_argument('--archive-jobs', type=int,
+                        help='number of compression threads (default: '
+                        'number of processors).')
+    parser.add_argument('--skip-installer', action='store_true',
+                        help='only create the portable archives.')
     parser.add_argument('package', type=str,
                         help='Vim package name.')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.skip_installer and not args.archive:
+        parser.error('--skip-installer requires --archive.')
+    return args
 
 
 def main():
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Precompiled header for the Vim sources. Used as a wrapper around the
+# compiler:
+#
+#   pch.py --pch FILE cl [cl arguments]
+#
+# Sources including vim.h before any other directive are compiled with the
+# precompiled header FILE, the other ones as usual. The precompiled header is
+# created by build.py with the flags of the makefile, in a cache folder keyed
+# on those flags, the compiler, and the build folder. It is created again when
+# one of the headers it includes changes.
+#
+# Debug information is stored in the object files (/Z7) so that the
+# precompiled header does not depend on the PDB file of a build.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+import compiler_cache
+import unity
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(SCRIPT_DIR, '..', 'cache', 'pch')
+
+HEADER = 'vim.h'
+CREATOR_NAME = 'vimpch.c'
+PCH_NAME = 'vim.pch'
+OBJECT_NAME = 'vim.obj'
+HEADERS_NAME = 'headers.json'
+# Environment variables read by the compiler.
+COMPILER_ENVIRONMENT = ['CL', '_CL_']
+
+INCLUDE_NOTE_REGEX = re.compile(r'^Note: including file:\s*(.*)$')
+
+
+def get_pch_dir(compiler, flags, build_dir, env):
+    sha1 = hashlib.sha1()
+    sha1.update(compiler_cache.get_compiler_identity(compiler).encode('utf8'))
+    sha1.update(b'\0' + os.path.abspath(build_dir).encode('utf8'))
+    for flag in flags:
+        sha1.update(b'\0' + flag.encode('utf8'))
+    for variable in COMPILER_ENVIRONMENT:
+        sha1.update(b'\0' + env.get(variable, '').encode('utf8'))
+    return os.path.join(CACHE_DIR, sha1.hexdigest())
+
+
+def get_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def is_up_to_date(pch_dir):
+    headers_path = os.path.join(pch_dir, HEADERS_NAME)
+    if (not os.path.isfile(headers_path) or
+            not os.path.isfile(os.path.join(pch_dir, PCH_NAME))):
+        return False
+
+    with open(headers_path, 'r') as headers_file:
+        headers = json.load(headers_file)
+    for path, mtime, file_hash in headers:
+        if not os.path.isfile(path):
+            return False
+        if (os.path.getmtime(path) != mtime and
+                get_file_hash(path) != file_hash):
+            print('{0} changed. Creating the precompiled header '
+                  'again.'.format(path))
+            return False
+    return True
+
+
+def create(compiler, flags, build_dir, pch_dir, env):
+    if not os.path.isdir(pch_dir):
+        os.makedirs(pch_dir)
+    # The source creating the header is in the build folder so that vim.h is
+    # found the same way as from the other sources. It is removed once the
+    # header is created.
+    creator_path = os.path.join(build_dir, CREATOR_NAME)
+    with open(creator_path, 'w') as creator_file:
+        creator_file.write('#include "{0}"\n'.format(HEADER))
+
+    cmd = ([compiler] + compiler_cache.get_compile_flags(flags) +
+           ['/c', '/showIncludes',
+            '/Yc' + HEADER,
+            '/Fp' + os.path.join(pch_dir, PCH_NAME),
+            '/Fo' + os.path.join(pch_dir, OBJECT_NAME),
+            CREATOR_NAME])
+    try:
+        process = subprocess.Popen(cmd, cwd=build_dir, env=env,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf8', 'replace')
+    finally:
+        os.remove(creator_path)
+
+    headers = [os.path.join(build_dir, HEADER)]
+    for line in output.splitlines():
+        match = INCLUDE_NOTE_REGEX.match(line)
+        if match:
+            headers.append(os.path.join(build_dir, match.group(1).strip()))
+        else:
+            print(line)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    with open(os.path.join(pch_dir, HEADERS_NAME), 'w') as headers_file:
+        json.dump([[path, os.path.getmtime(path), get_file_hash(path)]
+                   for path in sorted(set(headers)) if os.path.isfile(path)],
+                  headers_file)
+
+
+def get_shim_path(pch_dir):
+    return os.path.join(pch_dir, 'cl.cmd')
+
+
+def create_shim(pch_dir):
+    shim_path = get_shim_path(pch_dir)
+    with open(shim_path, 'w') as shim_file:
+        shim_file.write('@"{0}" "{1}" --pch "{2}" cl %*\n'.format(
+            sys.executable, os.path.abspath(__file__),
+            os.path.join(pch_dir, PCH_NAME)))
+    return shim_path
+
+
+def setup(compiler, flags, build_dir, env):
+    # Return the make arguments compiling through the wrapper and the object
+    # file of the precompiled header, which must be linked in.
+    pch_dir = get_pch_dir(compiler, flags, build_dir, env)
+    if not is_up_to_date(pch_dir):
+        create(compiler, flags, build_dir, pch_dir, env)
+    shim_path = create_shim(pch_dir)
+    return (['CC={0}'.format(shim_path)],
+            os.path.join(pch_dir, OBJECT_NAME))
+
+
+def uses_header(source):
+    try:
+        return unity.can_be_batched(unity.read_source(source))
+    except (IOError, OSError):
+        return False
+
+
+def compile_sources(pch_path, compiler, arguments):
+    sources = [argument for argument in arguments
+               if compiler_cache.is_source(argument)]
+    flags = [argument for argument in arguments
+             if not compiler_cache.is_source(argument)]
+    pch_sources = [source for source in sources if uses_header(source)]
+    other_sources = [source for source in sources
+                     if source not in pch_sources]
+
+    if pch_sources:
+        returncode = subprocess.call(
+            [compiler] + compiler_cache.get_compile_flags(flags) +
+            ['/Yu' + HEADER, '/Fp' + pch_path] + pch_sources)
+        if returncode:
+            return returncode
+    if other_sources or not sources:
+        return subprocess.call([compiler] + flags + other_sources)
+    return 0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pch', type=str, required=True,
+                        help='precompiled header file.')
+    parser.add_argument('compiler', help='compiler to run.')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER,
+                        help='compiler arguments.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    sys.exit(compile_sources(
+        args.pch, args.compiler,
+        compiler_cache.expand_response_files(args.arguments)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+" Training workload for PGO builds (build.py --pgo). It goes through common
+" editing operations on the Vim sources given by g:pgo_sources: loading and
+" highlighting files, moving around, searching, substituting, indenting,
+" formatting, and undoing.
+
+set nocompatible
+set hidden
+set undolevels=1000
+syntax on
+filetype plugin indent on
+
+let s:sources = sort(glob(g:pgo_sources . '/*.[ch]', 0, 1))[:40]
+
+for s:engine in [1, 2]
+  let &regexpengine = s:engine
+  for s:source in s:sources
+    execute 'edit ' . fnameescape(s:source)
+
+    " Syntax highlighting of the whole buffer.
+    for s:lnum in range(1, line('$'), 7)
+      call synID(s:lnum, 1, 1)
+      call synstack(s:lnum, max([col([s:lnum, '$']) - 1, 1]))
+    endfor
+
+    " Motions and searches.
+    normal! gg
+    silent! normal! 50%}}{{])[(
+    silent! /\<\(if\|while\|for\)\s*(
+    silent! ?^\s*return\>
+    call searchpair('{', '', '}', 'W')
+    silent! %s/\<\h\w*_T\>/&/gn
+
+    " Changes, undone afterwards.
+    silent! %s/\<int\>/long/g
+    silent! %s/\s\+$//e
+    normal! gg=G
+    setlocal textwidth=60 formatoptions+=croq
+    normal! gggqG
+    silent! global/^#\s*if/normal! %dd
+    silent! undo 0
+
+    bwipeout!
+  endfor
+endfor
+
+" String and list functions.
+let s:words = []
+for s:source in s:sources[:10]
+  call extend(s:words, split(join(readfile(s:source), "\n"), '\W\+'))
+endfor
+call sort(s:words)
+call uniq(s:words)
+call map(s:words, 'toupper(v:val) . tolower(v:val)')
+call filter(s:words, 'v:val =~# ''^\u''')
+call join(s:words, ',')
+
+qall!
@@ -0,0 +1,925 @@
+#!/usr/bin/env python
+
+# Parallel make for nmake makefiles. It reads the same makefiles as nmake
+# (macros, preprocessing directives, description blocks, inference rules, and
+# inline files) and runs independent recipes on a pool of workers:
+#
+#   pmake.py [-j N] [/f makefile] [MACRO=value ...] [targets ...]
+#
+# The output of each target is printed in one piece once its recipe is done so
+# that logs of targets running at the same time are not interleaved. With
+# --timings=FILE, the start and end times of each recipe are appended to FILE
+# as JSON lines.
+
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PMAKE_PATH = os.path.abspath(__file__)
+
+DEFAULT_MAKEFILE = 'makefile'
+# Order in which nmake looks for dependents of inference rules.
+SUFFIXES = ['.exe', '.obj', '.asm', '.c', '.cpp', '.cxx', '.bas', '.cbl',
+            '.for', '.pas', '.res', '.rc', '.f', '.f90']
+PREDEFINED_MACROS = {
+    'AS': 'ml',
+    'CC': 'cl',
+    'CPP': 'cl',
+    'CXX': 'cl',
+    'RC': 'rc',
+}
+PREDEFINED_RULES = [
+    ('.c', '.obj', ['$(CC) $(CFLAGS) /c $<']),
+    ('.cpp', '.obj', ['$(CPP) $(CPPFLAGS) /c $<']),
+    ('.cxx', '.obj', ['$(CXX) $(CXXFLAGS) /c $<']),
+    ('.rc', '.res', ['$(RC) $(RFLAGS) /r $<']),
+]
+SPECIAL_TARGETS = ['.IGNORE', '.PRECIOUS', '.SILENT', '.SUFFIXES']
+SPECIAL_MACROS = ['@', '<', '*', '**', '?'] + [
+    name + modifier for name in '@<*' for modifier in 'DFBR']
+
+DIRECTIVE_REGEX = re.compile(r'^!\s*(\w+)\s*(.*)$')
+MACRO_REGEX = re.compile(r'^([A-Za-z_0-9$()]+)\s*=(.*)$')
+INFERENCE_RULE_REGEX = re.compile(
+    r'^(?:\{([^}]*)\})?(\.[\w]+)(?:\{([^}]*)\})?(\.[\w]+)$')
+INLINE_FILE_REGEX = re.compile(r'<<([^\s]*)')
+CONDITION_TOKEN_REGEX = re.compile(
+    r'\s*(?:("[^"]*")|(\[[^\]]*\])|(0x[0-9a-fA-F]+|\d+)|'
+    r'(defined|exist)\s*\(([^)]*)\)|'
+    r'(\|\||&&|==|!=|<=|>=|[<>!~+\-*/%()])|([^\s()<>=!&|+\-*/%~]+))',
+    re.IGNORECASE)
+
+
+class MakeError(Exception):
+    pass
+
+
+def normalize_path(path):
+    path = os.path.normpath(path.strip('"').replace('\\', '/'))
+    if os.name == 'nt':
+        return path.lower()
+    return path
+
+
+def split_words(text):
+    return [word.strip('"') for word in shlex.split(text, posix=False)]
+
+
+def strip_comment(line):
+    # "^#" is an escaped "#", anything after an unescaped one is a comment.
+    result = []
+    index = 0
+    while index < len(line):
+        character = line[index]
+        if character == '^' and index + 1 < len(line):
+            result.append(line[index + 1])
+            index += 2
+            continue
+        if character == '#':
+            break
+        result.append(character)
+        index += 1
+    return ''.join(result).rstrip()
+
+
+def find_separator(line):
+    # Find the colon separating targets from dependents, ignoring drive
+    # letters like in "C:\Vim".
+    for match in re.finditer(':', line):
+        index = match.start()
+        if (index > 0 and line[index - 1].isalpha() and
+                (index == 1 or line[index - 2] in ' \t"{') and
+                line[index + 1:index + 2] in ['\\', '/']):
+            continue
+        return index
+    return -1
+
+
+def get_path_part(path, modifier):
+    if modifier == 'D':
+        return os.path.dirname(path) or '.'
+    if modifier == 'F':
+        return os.path.basename(path)
+    if modifier == 'B':
+        return os.path.splitext(os.path.basename(path))[0]
+    return os.path.splitext(path)[0]
+
+
+class Rule(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.dependencies = []
+        self.commands = None
+        self.double_colon = False
+
+
+class Target(object):
+
+    def __init__(self, name, dependencies, commands, inferred=None):
+        self.name = name
+        self.dependencies = dependencies
+        self.commands = commands
+        self.inferred = inferred
+        self.rebuilt = False
+
+
+class Makefile(object):
+
+    def __init__(self, path, macros=None, cwd=None, environment=None):
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.environment = (os.environ if environment is None
+                            else environment)
+        self.macros = dict(PREDEFINED_MACROS)
+        for name, value in self.environment.items():
+            self.macros[name.upper() if os.name == 'nt' else name] = value
+        self.macros['MAKE'] = '"{0}" "{1}"'.format(sys.executable,
+                                                   PMAKE_PATH)
+        self.macros['MAKEDIR'] = self.cwd
+        self.command_line_macros = dict(macros or {})
+        self.macros.update(self.command_line_macros)
+        self.rules = {}
+        self.rule_order = []
+        self.inference_rules = []
+        self.silent = False
+        self.ignore_errors = False
+        for from_extension, to_extension, commands in PREDEFINED_RULES:
+            commands = [(command, []) for command in commands]
+            self.inference_rules.append(('', from_extension, '',
+                                         to_extension, commands, True))
+        self.parse(path)
+
+    def get_path(self, path):
+        path = path.strip('"')
+        # Makefiles written for Windows use backslashes.
+        if os.sep == '/':
+            path = path.replace('\\', '/')
+        return os.path.join(self.cwd, path)
+
+    # Macros.
+
+    def lookup(self, name, local):
+        if local is not None:
+            if name in local:
+                return local[name]
+            if len(name) == 2 and name[0] in local:
+                return get_path_part(local[name[0]], name[1])
+        return self.macros.get(name, '')
+
+    def expand(self, text, local=None, depth=0):
+        if depth > 50:
+            raise MakeError('recursive macro in "{0}"'.format(text))
+        if '$' not in text:
+            return text
+        result = []
+        index = 0
+        length = len(text)
+        while index < length:
+            character = text[index]
+            if character != '$' or index + 1 == length:
+                result.append(character)
+                index += 1
+                continue
+            next_character = text[index + 1]
+            if next_character == '$':
+                result.append('$')
+                index += 2
+                continue
+            if next_character == '(':
+                level = 1
+                end = index + 2
+                while end < length and level:
+                    if text[end] == '(':
+                        level += 1
+                    elif text[end] == ')':
+                        level -= 1
+                    end += 1
+                inner = text[index + 2:end - 1]
+                index = end
+                name, _, substitution = inner.partition(':')
+                if name in SPECIAL_MACROS:
+                    value = self.lookup(name, local)
+                else:
+                    value = self.expand(self.lookup(self.expand(name, local,
+                                                                depth + 1),
+                                                    local),
+                                        local, depth + 1)
+                if substitution:
+                    old, _, new = substitution.partition('=')
+                    value = value.replace(self.expand(old, local, depth + 1),
+                                          self.expand(new, local, depth + 1))
+                result.append(value)
+                continue
+            if text[index + 1:index + 3] == '**':
+                result.append(self.lookup('**', local))
+                index += 3
+                continue
+            value = self.lookup(next_character, local)
+            if next_character not in '@<*?':
+                value = self.expand(value, local, depth + 1)
+            result.append(value)
+            index += 2
+        return ''.join(result)
+
+    def define(self, name, value):
+        if name in self.command_line_macros:
+            return
+        # A macro referring to itself is expanded now, like nmake does, so
+        # that "OBJ = $(OBJ) file.obj" appends to the previous value.
+        value = value.replace('$({0})'.format(name),
+                              self.macros.get(name, ''))
+        self.macros[name] = value
+
+    # Preprocessing.
+
+    def evaluate(self, expression):
+        tokens = []
+        for match in CONDITION_TOKEN_REGEX.finditer(expression):
+            (string, command, number, function, argument, operator,
+             word) = match.groups()
+            if string is not None:
+                tokens.append(('value', string[1:-1]))
+            elif command is not None:
+                tokens.append(('value', self.run_shell(command[1:-1])))
+            elif number is not None:
+                tokens.append(('value', int(number, 0)))
+            elif function is not None:
+                argument = argument.strip().strip('"')
+                if function.lower() == 'defined':
+                    tokens.append(('value', int(argument in self.macros)))
+                else:
+                    tokens.append(('value',
+                                   int(os.path.exists(
+                                       self.get_path(argument)))))
+            elif operator is not None:
+                tokens.append(('operator', operator))
+            elif word is not None:
+                tokens.append(('value', word))
+        parser = ConditionParser(tokens)
+        value = parser.parse()
+        if isinstance(value, str):
+            return bool(value)
+        return value != 0
+
+    def run_shell(self, command):
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(command, shell=True, cwd=self.cwd,
+                                   env=self.environment, stdout=devnull,
+                                   stderr=devnull)
+
+    def find_include(self, name, including_path):
+        if name.startswith('<') and name.endswith('>'):
+            name = name[1:-1]
+            for directory in self.environment.get('INCLUDE',
+                                                  '').split(os.pathsep):
+                path = os.path.join(directory, name)
+                if directory and os.path.isfile(path):
+                    return path
+            raise MakeError('cannot find include file {0}'.format(name))
+        name = name.strip('"')
+        for directory in [os.path.dirname(including_path), self.cwd]:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+        raise MakeError('cannot find include file {0}'.format(name))
+
+    # Parsing.
+
+    def read_lines(self, path):
+        with open(path, 'r') as makefile:
+            return makefile.read().splitlines()
+
+    def parse(self, path):
+        lines = self.read_lines(path)
+        # Each entry is [active, taken, parent active].
+        conditions = []
+        current_commands = []
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            index += 1
+            while line.endswith('\\') and index < len(lines):
+                line = line[:-1] + ' ' + lines[index].lstrip()
+                index += 1
+
+            active = all(condition[0] for condition in conditions)
+
+            match = DIRECTIVE_REGEX.match(line)
+            if match:
+                directive = match.group(1).lower()
+                argument = strip_comment(match.group(2))
+                if directive in ['if', 'ifdef', 'ifndef']:
+                    value = active and self.test_condition(directive,
+                                                           argument)
+                    conditions.append([value, value, active])
+                    continue
+                if directive in ['else', 'elseif', 'elseifdef',
+                                 'elseifndef', 'endif']:
+                    if not conditions:
+                        raise MakeError('unexpected !{0}'.format(directive))
+                    condition = conditions[-1]
+                    if directive == 'endif':
+                        conditions.pop()
+                        continue
+                    if directive == 'else':
+                        words = argument.split(None, 1)
+                        if words and words[0].lower() in ['if', 'ifdef',
+                                                          'ifndef']:
+                            directive = words[0].lower()
+                            argument = words[1] if len(words) > 1 else ''
+                        else:
+                            directive = None
+                    else:
+                        directive = directive[4:]
+                    if condition[1] or not condition[2]:
+                        condition[0] = False
+                    elif directive is None:
+                        condition[0] = condition[1] = True
+                    else:
+                        value = self.test_condition(directive, argument)
+                        condition[0] = condition[1] = value
+                    continue
+                if not active:
+                    continue
+                if directive == 'include':
+                    self.parse(self.find_include(self.expand(argument),
+                                                 path))
+                elif directive == 'undef':
+                    self.macros.pop(argument.strip(), None)
+                elif directive == 'message':
+                    print(self.expand(argument))
+                elif directive == 'error':
+                    raise MakeError(self.expand(argument))
+                continue
+
+            if not active:
+                continue
+
+            if line[:1] in [' ', '\t'] and current_commands:
+                command = line.strip()
+                if not command:
+                    continue
+                inline_match = INLINE_FILE_REGEX.search(command)
+                inline_lines = []
+                if inline_match:
+                    while index < len(lines):
+                        inline_line = lines[index]
+                        index += 1
+                        if inline_line.startswith('<<'):
+                            break
+                        inline_lines.append(inline_line)
+                for commands in current_commands:
+                    commands.append((command, inline_lines))
+                continue
+
+            if line.startswith('#') or not line.strip():
+                continue
+
+            line = strip_comment(line)
+            if not line.strip():
+                continue
+
+            match = MACRO_REGEX.match(line)
+            if match:
+                self.define(self.expand(match.group(1)),
+                            match.group(2).strip())
+                current_commands = []
+                continue
+
+            current_commands = self.parse_description(
+                self.expand(line.strip()))
+
+    def test_condition(self, directive, argument):
+        if directive == 'if':
+            return self.evaluate(self.expand(argument))
+        name = argument.strip()
+        if directive == 'ifdef':
+            return name in self.macros
+        return name not in self.macros
+
+    def parse_description(self, line):
+        separator = find_separator(line)
+        if separator < 0:
+            raise MakeError('syntax error: {0}'.format(line))
+        targets = split_words(line[:separator])
+        rest = line[separator + 1:]
+        double_colon = rest.startswith(':')
+        if double_colon:
+            rest = rest[1:]
+        rest, _, inline_command = rest.partition(';')
+        dependencies = split_words(rest)
+
+        if len(targets) == 1:
+            match = INFERENCE_RULE_REGEX.match(targets[0])
+            if match:
+                from_dir, from_extension, to_dir, to_extension = (
+                    match.groups())
+                commands = []
+                self.inference_rules.append((from_dir or '',
+                                             from_extension.lower(),
+                                             to_dir or '',
+                                             to_extension.lower(),
+                                             commands,
+                                             False))
+                if inline_command.strip():
+                    commands.append((inline_command.strip(), []))
+                return [commands]
+
+        if any(target.upper() in SPECIAL_TARGETS for target in targets):
+            if '.SILENT' in [target.upper() for target in targets]:
+                self.silent = True
+            if '.IGNORE' in [target.upper() for target in targets]:
+                self.ignore_errors = True
+            return []
+
+        command_lists = []
+        for target in targets:
+            key = normalize_path(target)
+            rule = self.rules.get(key)
+            if rule is None:
+                rule = Rule(target)
+                self.rules[key] = rule
+                self.rule_order.append(key)
+            rule.dependencies.extend(dependencies)
+            rule.double_colon = double_colon
+            if rule.commands is None:
+                rule.commands = []
+            # Only one description block of a target can have commands,
+            # unless they are separated by "::".
+            if not rule.commands or double_colon:
+                command_lists.append(rule.commands)
+                if inline_command.strip():
+                    rule.commands.append((inline_command.strip(), []))
+        return command_lists
+
+    # Dependency graph.
+
+    def get_default_goal(self):
+        for key in self.rule_order:
+            if not INFERENCE_RULE_REGEX.match(self.rules[key].name):
+                return self.rules[key].name
+        raise MakeError('no target to build')
+
+    def find_inference_rule(self, name, explicit_dependencies):
+        name = name.strip('"').replace('\\', '/')
+        directory = os.path.dirname(name)
+        base, extension = os.path.splitext(os.path.basename(name))
+        candidates = []
+        for rule in self.inference_rules:
+            (from_dir, from_extension, to_dir, to_extension, commands,
+             predefined) = rule
+            if extension.lower() != to_extension:
+                continue
+            if to_dir and normalize_path(to_dir) != normalize_path(
+                    directory or '.'):
+                continue
+            if from_dir:
+                source = os.path.join(from_dir, base + from_extension)
+            elif to_dir:
+                source = base + from_extension
+            else:
+                source = os.path.join(directory, base + from_extension)
+            source_key = normalize_path(source)
+            if (not os.path.isfile(self.get_path(source)) and
+                    source_key not in self.rules and
+                    source_key not in explicit_dependencies):
+                continue
+            if from_extension in SUFFIXES:
+                priority = SUFFIXES.index(from_extension)
+            else:
+                priority = len(SUFFIXES)
+            # User rules take precedence over predefined ones and later
+            # definitions over earlier ones.
+            candidates.append((predefined, priority,
+                               -self.inference_rules.index(rule),
+                               source, commands))
+        if not candidates:
+            return None
+        _, _, _, source, commands = min(candidates)
+        return source, commands
+
+    def get_target(self, name):
+        key = normalize_path(name)
+        rule = self.rules.get(key)
+        dependencies = list(rule.dependencies) if rule else []
+        commands = rule.commands if rule else None
+        inferred = None
+        if not commands:
+            inference = self.find_inference_rule(
+                name, [normalize_path(dependency)
+                       for dependency in dependencies])
+            if inference:
+                inferred, commands = inference
+                if normalize_path(inferred) not in [
+                        normalize_path(dependency)
+                        for dependency in dependencies]:
+                    dependencies.insert(0, inferred)
+        if rule is None and commands is None:
+            if os.path.exists(self.get_path(name)):
+                return Target(name, [], [])
+            raise MakeError("don't know how to make '{0}'".format(name))
+        return Target(rule.name if rule else name, dependencies,
+                      commands or [], inferred)
+
+
+class ConditionParser(object):
+    # Precedence climbing parser for !if expressions.
+
+    BINARY_OPERATORS = [
+        ['||'],
+        ['&&'],
+        ['==', '!=', '<', '>', '<=', '>='],
+        ['+', '-'],
+        ['*', '/', '%'],
+    ]
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def parse(self):
+        value = self.parse_binary(0)
+        if self.position != len(self.tokens):
+            raise MakeError('invalid expression')
+        return value
+
+    def parse_binary(self, level):
+        if level == len(self.BINARY_OPERATORS):
+            return self.parse_unary()
+        left = self.parse_binary(level + 1)
+        while True:
+            kind, operator = self.peek()
+            if (kind != 'operator' or
+                    operator not in self.BINARY_OPERATORS[level]):
+                return left
+            self.position += 1
+            right = self.parse_binary(level + 1)
+            left = self.apply(operator, left, right)
+
+    def parse_unary(self):
+        kind, value = self.peek()
+        if kind == 'operator' and value in ['!', '-', '~']:
+            self.position += 1
+            operand = to_number(self.parse_unary())
+            if value == '!':
+                return int(not operand)
+            if value == '-':
+                return -operand
+            return ~operand
+        if kind == 'operator' and value == '(':
+            self.position += 1
+            result = self.parse_binary(0)
+            if self.peek() != ('operator', ')'):
+                raise MakeError('missing closing parenthesis')
+            self.position += 1
+            return result
+        if kind != 'value':
+            raise MakeError('invalid expression')
+        self.position += 1
+        if isinstance(value, str) and re.match(r'^\d+$', value):
+            return int(value)
+        return value
+
+    def apply(self, operator, left, right):
+        if operator == '||':
+            return int(bool(to_number(left)) or bool(to_number(right)))
+        if operator == '&&':
+            return int(bool(to_number(left)) and bool(to_number(right)))
+        if operator in ['==', '!=', '<', '>', '<=', '>=']:
+            if isinstance(left, str) or isinstance(right, str):
+                left = str(left)
+                right = str(right)
+            return int({'==': left == right,
+                        '!=': left != right,
+                        '<': left < right,
+                        '>': left > right,
+                        '<=': left <= right,
+                        '>=': left >= right}[operator])
+        left = to_number(left)
+        right = to_number(right)
+        if operator == '+':
+            return left + right
+        if operator == '-':
+            return left - right
+        if operator == '*':
+            return left * right
+        if operator == '/':
+            return left // right
+        return left % right
+
+
+def to_number(value):
+    if isinstance(value, str):
+        return int(bool(value))
+    return value
+
+
+class Executor(object):
+
+    def __init__(self, makefile, jobs=1, keep_going=False, dry_run=False,
+                 silent=False, ignore_errors=False, build_all=False,
+                 timings=None):
+        self.makefile = makefile
+        self.jobs = max(jobs, 1)
+        self.keep_going = keep_going
+        self.dry_run = dry_run
+        self.silent = silent or makefile.silent
+        self.ignore_errors = ignore_errors or makefile.ignore_errors
+        self.build_all = build_all
+        self.timings = timings
+        self.targets = {}
+        self.done = set()
+        self.output_lock = threading.Lock()
+
+    def get_target(self, name):
+        key = normalize_path(name)
+        if key not in self.targets:
+            self.targets[key] = self.makefile.get_target(name)
+        return self.targets[key]
+
+    def collect(self, goal):
+        # Return targets needed by the goal, dependencies first.
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(name):
+            key = normalize_path(name)
+            if key in visited:
+                return
+            if key in visiting:
+                raise MakeError('cycle involving {0}'.format(name))
+            visiting.add(key)
+            target = self.get_target(name)
+            for dependency in target.dependencies:
+                visit(dependency)
+            visiting.remove(key)
+            visited.add(key)
+            order.append(key)
+
+        visit(goal)
+        return order
+
+    def get_mtime(self, name):
+        try:
+            return os.path.getmtime(self.makefile.get_path(name))
+        except OSError:
+            return None
+
+    def get_newer_dependencies(self, target):
+        # Return None if the target is up to date, the list of dependencies
+        # newer than the target otherwise.
+        target_mtime = self.get_mtime(target.name)
+        newer = []
+        out_of_date = target_mtime is None or self.build_all
+        for dependency in target.dependencies:
+            path = self.makefile.get_path(dependency)
+            # Folders are only required to exist: their timestamp changes
+            # each time a file is added to them.
+            if os.path.isdir(path):
+                continue
+            dependency_target = self.targets[normalize_path(dependency)]
+            dependency_mtime = self.get_mtime(dependency)
+            if (dependency_mtime is None and dependency_target.rebuilt) or (
+                    dependency_mtime is not None and target_mtime is not None
+                    and dependency_mtime > target_mtime):
+                newer.append(dependency)
+                out_of_date = True
+        if not out_of_date:
+            return None
+        return newer
+
+    def build(self, goals):
+        for goal in goals or [self.makefile.get_default_goal()]:
+            self.build_goal(goal)
+
+    def build_goal(self, goal):
+        order = [key for key in self.collect(goal) if key not in self.done]
+        waiting = {}
+        dependents = {}
+        for key in order:
+            target = self.targets[key]
+            dependencies = set(normalize_path(dependency)
+                               for dependency in target.dependencies)
+            dependencies = dependencies - self.done
+            waiting[key] = len(dependencies)
+            for dependency in dependencies:
+                dependents.setdefault(dependency, []).append(key)
+
+        ready = [key for key in order if not waiting[key]]
+        running = {}
+        failed = []
+
+        def release(key):
+            self.done.add(key)
+            for dependent in dependents.get(key, []):
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    ready.append(dependent)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while ready or running:
+                while ready and (not failed or self.keep_going):
+                    key = ready.pop(0)
+                    target = self.targets[key]
+                    newer = self.get_newer_dependencies(target)
+                    if newer is None or not target.commands:
+                        if newer is not None:
+                            target.rebuilt = True
+                        release(key)
+                        continue
+                    future = executor.submit(self.run_target, target, newer)
+                    running[future] = key
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    success, output = future.result()
+                    self.print_output(output)
+                    if success:
+                        self.targets[key].rebuilt = True
+                        release(key)
+                    else:
+                        failed.append(self.targets[key].name)
+                if failed and not self.keep_going:
+                    ready = []
+
+        if failed:
+            raise MakeError('failed to build {0}'.format(', '.join(failed)))
+
+    def print_output(self, output):
+        if not output:
+            return
+        with self.output_lock:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+
+    def record_timing(self, target, start, end):
+        if not self.timings or self.dry_run:
+            return
+        with self.output_lock:
+            with open(self.timings, 'a') as timings_file:
+                timings_file.write(json.dumps({
+                    'name': target.name,
+                    'start': start,
+                    'end': end,
+                    'dependencies': target.dependencies
+                }) + '\n')
+
+    def get_local_macros(self, target, newer):
+        return {
+            '@': target.name,
+            '*': os.path.splitext(target.name)[0],
+            '**': ' '.join(target.dependencies),
+            '?': ' '.join(newer),
+            '<': target.inferred or '',
+        }
+
+    def write_inline_files(self, command, inline_lines, local, paths):
+        for match in list(INLINE_FILE_REGEX.finditer(command)):
+            path = match.group(1)
+            if not path:
+                fd, path = tempfile.mkstemp(suffix='.tmp')
+                os.close(fd)
+                paths.append(path)
+            with open(path, 'w') as inline_file:
+                for line in inline_lines:
+                    inline_file.write(self.makefile.expand(line, local) +
+                                      '\n')
+            command = command.replace(match.group(0), path, 1)
+        return command
+
+    def run_target(self, target, newer):
+        local = self.get_local_macros(target, newer)
+        output = []
+        cwd = self.makefile.cwd
+        temporary_paths = []
+        start = time.time()
+        try:
+            for command, inline_lines in target.commands:
+                command = self.makefile.expand(command, local)
+                silent = self.silent
+                ignore_errors = self.ignore_errors
+                while command[:1] in ['@', '-', '!']:
+                    if command[0] == '@':
+                        silent = True
+                    elif command[0] == '-':
+                        ignore_errors = True
+                    command = command[1:].lstrip('0123456789').lstrip()
+                if inline_lines:
+                    command = self.write_inline_files(command, inline_lines,
+                                                      local, temporary_paths)
+                if not silent or self.dry_run:
+                    output.append('\t{0}\n'.format(command))
+                if self.dry_run:
+                    continue
+                words = command.split(None, 1)
+                if words and words[0].lower() in ['cd', 'chdir']:
+                    # nmake handles directory changes itself so that they
+                    # apply to the next commands.
+                    directory = words[1] if len(words) > 1 else ''
+                    if directory.lower().startswith('/d '):
+                        directory = directory[3:]
+                    cwd = os.path.join(cwd, directory.strip().strip('"'))
+                    continue
+                process = subprocess.Popen(command,
+                                           shell=True,
+                                           cwd=cwd,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT)
+                command_output = process.communicate()[0]
+                output.append(command_output.decode('utf8', 'replace'))
+                if process.returncode and not ignore_errors:
+                    output.append(
+                        "pmake: '{0}': return code '{1}'\n".format(
+                            target.name, process.returncode))
+                    return False, ''.join(output)
+            return True, ''.join(output)
+        finally:
+            for path in temporary_paths:
+                os.remove(path)
+            self.record_timing(target, start, time.time())
+
+
+def parse_command_line(arguments):
+    options = {
+        'makefile': None,
+        'jobs': 1,
+        'keep_going': False,
+        'dry_run': False,
+        'silent': False,
+        'ignore_errors': False,
+        'build_all': False,
+        'timings': None,
+    }
+    macros = {}
+    goals = []
+    index = 0
+    while index < len(arguments):
+        argument = arguments[index]
+        index += 1
+        if '=' in argument and argument[:1] not in ['/', '-']:
+            name, _, value = argument.partition('=')
+            # Like nmake, only remove quotes around the whole value.
+            if len(value) > 1 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            macros[name] = value
+            continue
+        if argument.startswith('--timings='):
+            options['timings'] = argument[len('--timings='):]
+            continue
+        if argument[:1] not in ['/', '-'] or len(argument) < 2:
+            goals.append(argument)
+            continue
+        option = argument[1:]
+        if option.lower().startswith('f') or option.startswith('j'):
+            value = option[1:]
+            if not value:
+                if index == len(arguments):
+                    raise MakeError('missing value for {0}'.format(argument))
+                value = arguments[index]
+                index += 1
+            if option.lower().startswith('f'):
+                options['makefile'] = value
+            else:
+                options['jobs'] = int(value)
+        elif option.upper() == 'K':
+            options['keep_going'] = True
+        elif option.upper() == 'N':
+            options['dry_run'] = True
+        elif option.upper() == 'S':
+            options['silent'] = True
+        elif option.upper() == 'I':
+            options['ignore_errors'] = True
+        elif option.upper() == 'A':
+            options['build_all'] = True
+        # Other nmake options (/NOLOGO, /C, ...) have no effect here.
+    return options, macros, goals
+
+
+def main():
+    try:
+        options, macros, goals = parse_command_line(sys.argv[1:])
+        makefile = Makefile(options.pop('makefile') or DEFAULT_MAKEFILE,
+                            macros)
+        Executor(makefile, **options).build(goals)
+    except MakeError as error:
+        sys.exit('pmake: {0}'.format(error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Staging of files from a manifest of (source, destination) entries.
+#
+# Destinations already matching their source (same file, or same size and
+# hash) are left alone. Other files are staged with the cheapest method
+# available: a hardlink, a copy-on-write clone (reflink), copy_file_range, and
+# a plain copy as a last resort. A source folder stages all the files it
+# contains.
+
+import collections
+import errno
+import hashlib
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a file on Linux file systems supporting it (Btrfs, XFS).
+FICLONE = 0x40049409
+METHODS = ['unchanged', 'hardlink', 'reflink', 'copy_file_range', 'copy']
+
+
+def get_file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_same(source, destination):
+    if not os.path.isfile(destination):
+        return False
+    if os.path.samefile(source, destination):
+        return True
+    if os.path.getsize(source) != os.path.getsize(destination):
+        return False
+    return get_file_hash(source) == get_file_hash(destination)
+
+
+def hardlink(source, destination):
+    try:
+        os.link(source, destination)
+    except (OSError, NotImplementedError, AttributeError):
+        return False
+    return True
+
+
+def reflink(source, destination):
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as source_file:
+            with open(destination, 'wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE,
+                            source_file.fileno())
+    except (IOError, OSError):
+        remove_file(destination)
+        return False
+    return True
+
+
+def copy_range(source, destination):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    try:
+        with open(source, 'rb') as source_file:
+            with open(destination, 'wb') as destination_file:
+                while os.copy_file_range(source_file.fileno(),
+                                         destination_file.fileno(),
+                                         1024 * 1024 * 1024):
+                    pass
+    except OSError as error:
+        remove_file(destination)
+        if error.errno not in [errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                               errno.EOPNOTSUPP, errno.EBADF]:
+            raise
+        return False
+    shutil.copystat(source, destination)
+    return True
+
+
+def remove_file(path):
+    if os.path.isfile(path) or os.path.islink(path):
+        os.remove(path)
+
+
+def stage_file(source, destination, link=True):
+    # Return the method used to stage the file. With link set to False, the
+    # destination never shares its data with the source, which is needed for
+    # destinations modified in place afterwards.
+    if is_same(source, destination):
+        return 'unchanged'
+
+    # An existing destination may be a hardlink to another file, which must
+    # not be overwritten.
+    remove_file(destination)
+    destination_dir = os.path.dirname(destination)
+    if destination_dir and not os.path.isdir(destination_dir):
+        os.makedirs(destination_dir)
+
+    if link and hardlink(source, destination):
+        return 'hardlink'
+    if reflink(source, destination):
+        return 'reflink'
+    if copy_range(source, destination):
+        return 'copy_file_range'
+    shutil.copy2(source, destination)
+    return 'copy'
+
+
+def get_entries(source, destination):
+    if not os.path.isdir(source):
+        yield source, destination
+        return
+    for root, _, files in os.walk(source):
+        for filename in files:
+            path = os.path.join(root, filename)
+            yield path, os.path.join(destination,
+                                     os.path.relpath(path, source))
+
+
+def stage(manifest, root_dir, link=True):
+    # Manifest paths are relative to root_dir. Return the number of files
+    # staged by each method.
+    counts = collections.OrderedDict((method, 0) for method in METHODS)
+    for source, destination in manifest:
+        for source_path, destination_path in get_entries(
+                os.path.join(root_dir, source),
+                os.path.join(root_dir, destination)):
+            counts[stage_file(source_path, destination_path, link)] += 1
+    return counts
+
+
+def print_counts(counts):
+    print('Staged {0} files: {1}.'.format(
+        sum(counts.values()),
+        ', '.join('{0} {1}'.format(count, method)
+                  for method, count in counts.items() if count)))
@@ -1,55 +1,346 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import os
-import subprocess
 import platform
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import buildlog
+import pmake
+import testhistory
+import testreport
+import testselect
+import toolchain
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.join(SCRIPT_DIR, '..', 'vim')
 SOURCES_DIR = os.path.join(ROOT_DIR, 'src')
 TESTS_DIR = os.path.join(SOURCES_DIR, 'testdir')
+TESTS_MAKEFILE = 'Make_dos.mak'
+TEST_EXTENSIONS = ['.out', '.res']
+# Each shard runs its tests in its own copy of the test folder, next to the
+# original so that relative paths still work, with its own home and temporary
+# folders.
+SHARD_DIR = os.path.join(SOURCES_DIR, 'testdir.shard{0}')
+SHARD_IGNORED_PATTERNS = ['*.out', '*.res', 'messages', 'test.log', 'vimcmd']
+SHARD_HOME_NAME = 'home'
+SHARD_TEMP_NAME = 'tmp'
+SHARD_COVERAGE_NAME = 'coverage'
+# Files where the tests write their results.
+RESULT_FILES = ['messages', 'test.log']
+RESULTS_PATH = os.path.join(SCRIPT_DIR, '..', 'cache', 'tests',
+                            'results.json')
+RERUN_STATUSES = ['failed', 'hung']
+DEFAULT_TIMEOUT = 900
+
+
+def get_test_targets(gvim_path):
+    # Legacy (.out) and new style (.res) tests run by the default target of
+    # the makefile, in order.
+    makefile = pmake.Makefile(os.path.join(TESTS_DIR, TESTS_MAKEFILE),
+                              {'VIMPROG': gvim_path}, cwd=TESTS_DIR)
+    targets = []
+    visited = set()
+
+    def visit(name):
+        key = pmake.normalize_path(name)
+        if key in visited:
+            return
+        visited.add(key)
+        if os.path.splitext(name)[1].lower() in TEST_EXTENSIONS:
+            targets.append(name)
+            return
+        rule = makefile.rules.get(key)
+        if rule:
+            for dependency in rule.dependencies:
+                visit(dependency)
+
+    visit(makefile.get_default_goal())
+    return targets
+
+
+def select_targets(targets, tests):
+    roots = [os.path.splitext(test)[0] for test in tests]
+    return [target for target in targets
+            if os.path.splitext(target)[0] in roots]
+
+
+def get_shards(targets, jobs, expected_durations):
+    # Legacy tests depend on each other and all go to the first shard, in
+    # order. New style tests are scheduled longest first, each on the shard
+    # with the least work.
+    shards = [[] for _ in range(jobs)]
+    loads = [0.0] * jobs
+    for target in targets:
+        if target.endswith('.out'):
+            shards[0].append(target)
+            loads[0] += expected_durations[target]
+    new_targets = sorted(
+        [target for target in targets if target.endswith('.res')],
+        key=lambda target: -expected_durations[target])
+    for target in new_targets:
+        shard = loads.index(min(loads))
+        shards[shard].append(target)
+        loads[shard] += expected_durations[target]
+    return shards
+
+
+def create_shard(number):
+    shard_dir = SHARD_DIR.format(number)
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    shutil.copytree(TESTS_DIR, shard_dir,
+                    ignore=shutil.ignore_patterns(*SHARD_IGNORED_PATTERNS))
+    for name in [SHARD_HOME_NAME, SHARD_TEMP_NAME, SHARD_COVERAGE_NAME]:
+        os.makedirs(os.path.join(shard_dir, name))
+    return shard_dir
+
+
+def get_file_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def run_target(args, nmake_cmd, target, vim_program, shard_dir, env,
+               prefix):
+    # Return the status of the target: passed, failed, or hung. Tests write
+    # their failures to test.log.
+    log_path = os.path.join(shard_dir, 'test.log')
+    log_size = get_file_size(log_path)
+    try:
+        buildlog.run(nmake_cmd + ['-f', TESTS_MAKEFILE,
+                                  'VIMPROG={0}'.format(vim_program),
+                                  target],
+                     cwd=shard_dir, env=env, prefix=prefix,
+                     timeout=args.timeout or None)
+    except buildlog.BuildTimeout:
+        buildlog.write_line('{0} timed out after {1} seconds.'.format(
+            target, args.timeout), prefix)
+        with open(log_path, 'a') as log_file:
+            log_file.write('{0} HUNG: timed out after {1} seconds\n'.format(
+                target, args.timeout))
+        return 'hung'
+    except buildlog.BuildError:
+        return 'failed'
+    if get_file_size(log_path) != log_size:
+        return 'failed'
+    return 'passed'
 
-MSVC_BIN_DIR = os.path.join('..', '..', 'VC')
 
+def run_shard(args, number, targets, gvim_path, test_env,
+              coverage_tool=None, collector=None):
+    # Return the status and duration of each target and, with a coverage
+    # tool, the sources covered by each target. Results are added to the
+    # collector as the targets finish.
+    shard_dir = create_shard(number)
+    env = dict(test_env)
+    env['HOME'] = os.path.join(shard_dir, SHARD_HOME_NAME)
+    env['TEMP'] = env['TMP'] = os.path.join(shard_dir, SHARD_TEMP_NAME)
+    vim_program = gvim_path
+    if coverage_tool:
+        vim_program = testselect.create_coverage_shim(
+            shard_dir, coverage_tool, gvim_path, SOURCES_DIR)
 
-def get_msvc_dir(args):
-    if args.msvc == 11:
-        return os.path.join(os.environ['VS110COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 12:
-        return os.path.join(os.environ['VS120COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 14:
-        return os.path.join(os.environ['VS140COMNTOOLS'], MSVC_BIN_DIR)
-    if args.msvc == 15:
-        return get_msvc15_dir()
-    raise RuntimeError('msvc parameter should be 11, 12, 14, or 15.')
+    nmake_cmd = toolchain.get_nmake_cmd(args.msvc, args.arch)
+    results = {}
+    coverage = {}
+    for target in targets:
+        report_path = os.path.join(shard_dir, SHARD_COVERAGE_NAME,
+                                   target + '.xml')
+        if coverage_tool:
+            env[testselect.COVERAGE_OUTPUT_VARIABLE] = report_path
+        offsets = testreport.get_offsets(shard_dir)
+        start_time = time.time()
+        status = run_target(args, nmake_cmd, target, vim_program, shard_dir,
+                            env, 'shard{0}'.format(number))
+        results[target] = {'status': status,
+                           'duration': time.time() - start_time}
+        if collector:
+            collector.add(testreport.parse_target(
+                shard_dir, target, offsets, status,
+                results[target]['duration']))
+        if coverage_tool:
+            coverage[target] = testselect.parse_coverage_report(report_path,
+                                                                ROOT_DIR)
+    return results, coverage
 
 
-def get_msvc15_dir():
-    vswhere = os.path.join(os.environ['ProgramFiles(x86)'],
-                           'Microsoft Visual Studio',
-                           'Installer',
-                           'vswhere.exe')
-    if not os.path.exists(vswhere):
-        raise RuntimeError('cannot find vswhere. '
-                           'VS 2017 version 15.2 or later is required.')
+def load_results(results_path):
+    if not os.path.isfile(results_path):
+        return {}
+    with open(results_path, 'r') as results_file:
+        return json.load(results_file)
 
-    installation_path = subprocess.check_output(
-        [vswhere, '-latest', '-property', 'installationPath']
-    ).strip().decode('utf8')
-    return os.path.join(installation_path, 'VC', 'Auxiliary', 'Build')
 
+def save_results(results_path, results):
+    results_dir = os.path.dirname(results_path)
+    if results_dir and not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+    with open(results_path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
 
-def get_vc_mod(arch):
-    if arch == 64:
-        return 'x86_amd64'
-    return 'x86'
 
+def select_rerun_targets(args, targets):
+    previous_results = load_results(args.results)
+    if not previous_results:
+        raise RuntimeError('no previous results in {0}.'.format(
+            args.results))
+    rerun_targets = [target for target in targets
+                     if previous_results.get(target, {}).get('status') in
+                     RERUN_STATUSES]
+    print('Running again {0} failed or hung tests.'.format(
+        len(rerun_targets)))
+    return rerun_targets, previous_results
 
-def get_nmake_cmd(args):
-    msvc_dir = get_msvc_dir(args)
-    vc_vars_script_path = os.path.join(msvc_dir, 'vcvarsall.bat')
-    return [vc_vars_script_path, get_vc_mod(args.arch), '&', 'nmake.exe']
+
+def select_changed_targets(args, targets, build_flags_hash):
+    # Return the targets affected by the changes and whether all targets
+    # are run.
+    selected_targets, reason = testselect.select_targets(
+        targets, testselect.get_changed_files(ROOT_DIR, args.changes),
+        testselect.load_coverage_map(), build_flags_hash,
+        testselect.load_last_full_run())
+    if reason:
+        print('Running all tests: {0}.'.format(reason))
+        return targets, True
+    print('{0} of {1} tests affected by {2}.'.format(
+        len(selected_targets), len(targets), args.changes))
+    return selected_targets, False
+
+
+def get_coverage_tool(args, full_run, gvim_path, build_flags_hash):
+    # Return the coverage tool when the coverage map is refreshed, on full
+    # runs when it is outdated or with --coverage, and the hash of the build
+    # flags. The hash runs Vim so it is only computed when needed.
+    if not full_run:
+        return None, build_flags_hash
+    coverage_tool = testselect.get_coverage_tool()
+    if coverage_tool is None:
+        if args.coverage:
+            print('WARNING: {0} is not available. Cannot refresh the '
+                  'coverage map.'.format(testselect.COVERAGE_TOOL))
+        return None, build_flags_hash
+    if build_flags_hash is None:
+        build_flags_hash = testselect.get_build_flags_hash(gvim_path)
+    if not args.coverage and not testselect.needs_coverage(
+            testselect.load_coverage_map(), build_flags_hash):
+        return None, build_flags_hash
+    return coverage_tool, build_flags_hash
+
+
+def merge_results(jobs):
+    for filename in RESULT_FILES:
+        contents = []
+        for number in range(jobs):
+            path = os.path.join(SHARD_DIR.format(number), filename)
+            if os.path.isfile(path):
+                with open(path, 'rb') as result_file:
+                    contents.append(result_file.read())
+        path = os.path.join(TESTS_DIR, filename)
+        if os.path.isfile(path):
+            os.remove(path)
+        if contents:
+            with open(path, 'wb') as result_file:
+                result_file.write(b''.join(contents))
+
+
+def print_messages():
+    # Like the newtests target, show the messages when a test was skipped or
+    # failed.
+    path = os.path.join(TESTS_DIR, 'messages')
+    if not os.path.isfile(path):
+        return
+    with open(path, 'r', errors='replace') as messages_file:
+        messages = messages_file.read()
+    if 'SKIPPED' in messages or 'FAILED' in messages:
+        print(messages)
+
+
+def run_shards(args, gvim_path, test_env):
+    targets = get_test_targets(gvim_path)
+    full_run = not args.tests and not args.rerun_failed
+    if args.tests:
+        targets = select_targets(targets, args.tests)
+    # Results of a rerun update those of the previous run.
+    results = {}
+    if args.rerun_failed:
+        targets, results = select_rerun_targets(args, targets)
+        if not targets:
+            return
+    # Flags of gvim, which runs the tests.
+    build_flags_hash = None
+    if args.changes:
+        build_flags_hash = testselect.get_build_flags_hash(gvim_path)
+        targets, full_run = select_changed_targets(args, targets,
+                                                   build_flags_hash)
+        if not targets:
+            return
+    if not targets:
+        raise RuntimeError('no test to run.')
+    coverage_tool, build_flags_hash = get_coverage_tool(
+        args, full_run, gvim_path, build_flags_hash)
+
+    history = testhistory.open_history()
+    shards = [shard for shard in get_shards(
+        targets, args.jobs,
+        testhistory.get_expected_durations(history, targets)) if shard]
+    print('Running {0} tests in {1} shards.'.format(len(targets),
+                                                    len(shards)))
+
+    nmake_cmd = toolchain.get_nmake_cmd(args.msvc, args.arch)
+    collector = None
+    if args.junit or args.json_lines:
+        collector = testreport.Collector(args.junit, args.json_lines)
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            runs = [executor.submit(run_shard, args, number, shard,
+                                    gvim_path, test_env, coverage_tool,
+                                    collector)
+                    for number, shard in enumerate(shards)]
+        coverage = {}
+        for run in runs:
+            shard_results, shard_coverage = run.result()
+            results.update(shard_results)
+            coverage.update(shard_coverage)
+        save_results(args.results, results)
+
+        # Hung tests ran for the duration of the timeout.
+        durations = dict((target, results[target]['duration'])
+                         for target in targets
+                         if results[target]['status'] != 'hung')
+        testhistory.print_slowest(durations, args.slowest)
+        # Durations under the coverage tool are not representative.
+        if not coverage_tool:
+            testhistory.print_regressions(
+                testhistory.get_regressions(history, durations))
+            testhistory.record(history, durations)
+        if full_run:
+            testselect.save_last_full_run()
+        if coverage_tool:
+            testselect.save_coverage_map(coverage, build_flags_hash)
+
+        merge_results(len(shards))
+        print_messages()
+        buildlog.run(nmake_cmd + ['-f', TESTS_MAKEFILE, 'report'],
+                     cwd=TESTS_DIR, env=test_env)
+        failed_targets = [target for target in targets
+                          if results[target]['status'] != 'passed']
+        if failed_targets:
+            raise RuntimeError('tests failed: {0}'.format(
+                ', '.join(failed_targets)))
+    finally:
+        # Results of the tests that finished are written even if the run
+        # stopped.
+        if collector:
+            collector.close()
+        for number in range(len(shards)):
+            shutil.rmtree(SHARD_DIR.format(number), ignore_errors=True)
+        history.close()
 
 
 def test_vim(args):
@@ -61,19 +352,16 @@ def test_vim(args):
     # tests. Otherwise, this will stuck runs on CI services.
     subprocess.check_call([gvim_path, '-silent', '-register'])
 
-    nmake_cmd = get_nmake_cmd(args)
+    nmake_cmd = toolchain.get_nmake_cmd(args.msvc, args.arch)
+    test_env = toolchain.get_environment(args.msvc, args.arch)
 
-    test_cmd = nmake_cmd + ['-f', 'Make_dos.mak',
-                            'VIMPROG={0}'.format(gvim_path)]
-    if args.tests:
-        for test in args.tests:
-            root, _ = os.path.splitext(test)
-            test_cmd.append(root + '.res')
-        test_cmd.append('report')
+    # Tests are run one by one, even without shards, to record their
+    # duration and run the longest ones first.
     try:
-        subprocess.check_call(test_cmd)
+        run_shards(args, gvim_path, test_env)
     finally:
-        subprocess.check_call(nmake_cmd + ['-f', 'Make_dos.mak', 'clean'])
+        buildlog.run(nmake_cmd + ['-f', TESTS_MAKEFILE, 'clean'],
+                     env=test_env)
 
 
 def get_arch_from_python_interpreter():
@@ -90,11 +378,52 @@ def parse_arguments():
     parser.add_argument('--arch', type=int, choices=[32, 64],
                         help='force architecture to 32 or 64 bits on '
                         'Windows (default: python interpreter architecture).')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of test shards run in parallel, each '
+                        'in its own copy of the test folder (default: '
+                        '%(default)s).')
+    parser.add_argument('--slowest', type=int,
+                        default=testhistory.DEFAULT_SLOWEST,
+                        help='number of slowest tests to show '
+                        '(default: %(default)s).')
+    parser.add_argument('--changes', type=str, metavar='RANGE',
+                        help='only run the tests affected by this git '
+                        'commit range of the Vim sources, unless a full run '
+                        'is needed.')
+    parser.add_argument('--coverage', action='store_true',
+                        help='refresh the coverage map used by --changes '
+                        'on a full run, even if it is up to date.')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT,
+                        help='seconds after which a test is killed with the '
+                        'processes it started and recorded as hung, 0 to '
+                        'disable (default: %(default)s).')
+    parser.add_argument('--results', type=str, default=RESULTS_PATH,
+                        help='file where the status of each test is saved '
+                        '(default: %(default)s).')
+    parser.add_argument('--rerun-failed', action='store_true',
+                        help='only run the tests that failed or hung in the '
+                        'previous run, as saved in the results file.')
+    parser.add_argument('--junit', type=str, metavar='PATH',
+                        help='write the result of each test as JUnit XML to '
+                        'this file.')
+    parser.add_argument('--json-lines', type=str, metavar='PATH',
+                        help='write the result of each test as a JSON line '
+                        'to this file, as the tests finish.')
     parser.add_argument('tests', nargs='*', help='list of tests')
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1.')
+    if args.changes and args.tests:
+        parser.error('--changes cannot be used with a list of tests.')
+    if args.rerun_failed and args.changes:
+        parser.error('--rerun-failed cannot be used with --changes.')
     if not args.arch:
         args.arch = get_arch_from_python_interpreter()
+    # Tests are run from their folder.
+    for name in ['results', 'junit', 'json_lines']:
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
 
     return args
 
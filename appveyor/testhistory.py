@@ -0,0 +1,103 @@
+# History of the test durations, stored in a SQLite database in the cache
+# folder. It is used to run the longest tests first and to report tests that
+# got slower than the median of their last runs.
+
+import os
+import sqlite3
+import statistics
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_PATH = os.path.join(SCRIPT_DIR, '..', 'cache', 'tests', 'history.db')
+
+# Number of previous runs of a test used for its median duration.
+WINDOW = 10
+# Number of previous runs needed to detect a regression.
+MIN_RUNS = 3
+# A test regressed if it took more than REGRESSION_RATIO times its median
+# duration and at least REGRESSION_MIN_DELTA seconds more.
+REGRESSION_RATIO = 1.5
+REGRESSION_MIN_DELTA = 2.0
+# Expected duration in seconds of tests without history.
+DEFAULT_DURATION = 10.0
+DEFAULT_SLOWEST = 10
+
+
+def open_history(path=HISTORY_PATH):
+    history_dir = os.path.dirname(path)
+    if not os.path.isdir(history_dir):
+        os.makedirs(history_dir)
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE IF NOT EXISTS durations ('
+                       'test TEXT NOT NULL, '
+                       'time REAL NOT NULL, '
+                       'duration REAL NOT NULL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS durations_test '
+                       'ON durations (test, time)')
+    return connection
+
+
+def get_recent_durations(connection, test):
+    # Durations of the last runs of a test, most recent first.
+    return [row[0] for row in connection.execute(
+        'SELECT duration FROM durations WHERE test = ? '
+        'ORDER BY time DESC LIMIT ?', (test, WINDOW))]
+
+
+def get_medians(connection, tests):
+    medians = {}
+    for test in tests:
+        durations = get_recent_durations(connection, test)
+        if durations:
+            medians[test] = statistics.median(durations)
+    return medians
+
+
+def get_expected_durations(connection, tests):
+    # Tests without history are expected to take as long as the median test.
+    medians = get_medians(connection, tests)
+    default = (statistics.median(medians.values()) if medians
+               else DEFAULT_DURATION)
+    return dict((test, medians.get(test, default)) for test in tests)
+
+
+def get_regressions(connection, durations):
+    # Return (test, duration, median) for the tests that got slower. Must be
+    # called before recording the durations.
+    regressions = []
+    for test, duration in sorted(durations.items()):
+        previous = get_recent_durations(connection, test)
+        if len(previous) < MIN_RUNS:
+            continue
+        median = statistics.median(previous)
+        if (duration > median * REGRESSION_RATIO and
+                duration - median >= REGRESSION_MIN_DELTA):
+            regressions.append((test, duration, median))
+    return regressions
+
+
+def record(connection, durations):
+    now = time.time()
+    with connection:
+        connection.executemany(
+            'INSERT INTO durations (test, time, duration) VALUES (?, ?, ?)',
+            [(test, now, duration) for test, duration in durations.items()])
+
+
+def print_slowest(durations, top=DEFAULT_SLOWEST):
+    if not durations or not top:
+        return
+    print('Slowest tests:')
+    for test, duration in sorted(durations.items(),
+                                 key=lambda item: -item[1])[:top]:
+        print('  {0:>8.2f}s  {1}'.format(duration, test))
+
+
+def print_regressions(regressions):
+    if not regressions:
+        return
+    print('WARNING: {0} tests got slower than the median of their last '
+          'runs:'.format(len(regressions)))
+    for test, duration, median in regressions:
+        print('  {0:>8.2f}s (median {1:.2f}s)  {2}'.format(duration, median,
+                                                          test))
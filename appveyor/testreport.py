@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+# Export of the test results as JUnit XML and JSON lines, written as the tests
+# finish. Results are parsed from what the tests leave in their folder: the
+# "messages" file, the failures appended to test.log, and the .res file of new
+# style tests.
+#
+# Memory is bounded: only an excerpt of the failures and skipped messages is
+# kept for each test, JSON lines are written and flushed one test at a time,
+# and JUnit test cases are streamed to a temporary file since the totals of
+# the test suite are only known at the end.
+#
+# The results left in a test folder by nmake can also be exported from the
+# command line.
+
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+MESSAGES_NAME = 'messages'
+LOG_NAME = 'test.log'
+RESULT_FILES = [MESSAGES_NAME, LOG_NAME]
+CASES_SUFFIX = '.cases'
+DEFAULT_SUITE_NAME = 'vim'
+# Maximum number of lines and characters per line kept for the failure
+# excerpt and the skipped messages of a test.
+MAX_EXCERPT_LINES = 50
+MAX_LINE_LENGTH = 500
+
+# Messages of runtest.vim, which writes a section for each test script in the
+# messages file and in test.log.
+SECTION_REGEX = re.compile(r'^From (?P<name>\S+):$')
+EXECUTED_REGEX = re.compile(r'^Executed (?P<count>\d+) tests?\b')
+SKIPPED_REGEX = re.compile(r'^(SKIPPED|Skipped) ')
+FAILED_REGEX = re.compile(r'^(?P<count>\d+) FAILED')
+FAILED_FUNCTION_REGEX = re.compile(
+    r'^(Found errors in|Caught exception in) (?P<name>\w+)\(\)')
+# Counts written to the .res file by recent versions of runtest.vim.
+RES_COUNT_REGEX = re.compile(
+    r'^(?P<name>executed|skipped|failed)\s+(?P<count>\d+)\s*$')
+# Lines appended to test.log by the makefile for legacy tests and by test.py
+# for hung tests.
+LEGACY_FAILED_REGEX = re.compile(r'^(?P<name>test\w*) FAILED')
+HUNG_REGEX = re.compile(r'^(?P<target>\S+) HUNG:')
+# Characters not allowed in XML 1.0.
+INVALID_XML_REGEX = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def get_file_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def get_offsets(test_dir):
+    # Sizes of the result files before running a test. What a test writes
+    # is read from there.
+    return dict((filename, get_file_size(os.path.join(test_dir, filename)))
+                for filename in RESULT_FILES)
+
+
+def read_lines(path, offset=0):
+    # Yield the non-empty lines of a file from an offset. Tests may write in
+    # any encoding.
+    if not os.path.isfile(path):
+        return
+    with open(path, 'rb') as result_file:
+        result_file.seek(offset)
+        for line in result_file:
+            line = line.decode('utf8', 'replace').rstrip()
+            if line:
+                yield line
+
+
+def read_sections(path):
+    # Yield the target of the current section and each line of a file.
+    target = None
+    for line in read_lines(path):
+        match = SECTION_REGEX.match(line)
+        if match:
+            target = os.path.splitext(match.group('name'))[0] + '.res'
+            continue
+        yield target, line
+
+
+def new_result(target):
+    return {'test': target,
+            'status': None,
+            'duration': None,
+            'executed': None,
+            'skipped': [],
+            'skipped_omitted': 0,
+            'failure': [],
+            'failure_omitted': 0,
+            'failed_functions': [],
+            'finished': False}
+
+
+def add_excerpt_line(result, key, line):
+    if len(result[key]) < MAX_EXCERPT_LINES:
+        result[key].append(line[:MAX_LINE_LENGTH])
+    else:
+        result[key + '_omitted'] += 1
+
+
+def feed_message(result, line):
+    if SECTION_REGEX.match(line):
+        return
+    match = EXECUTED_REGEX.match(line)
+    if match:
+        result['executed'] = int(match.group('count'))
+        return
+    if SKIPPED_REGEX.match(line):
+        add_excerpt_line(result, 'skipped', line)
+        return
+    match = FAILED_REGEX.match(line)
+    if match and int(match.group('count')):
+        result['status'] = result['status'] or 'failed'
+
+
+def feed_log(result, line):
+    if SECTION_REGEX.match(line):
+        return
+    if HUNG_REGEX.match(line):
+        result['status'] = 'hung'
+    match = FAILED_FUNCTION_REGEX.match(line)
+    if (match and match.group('name') not in result['failed_functions'] and
+            len(result['failed_functions']) < MAX_EXCERPT_LINES):
+        result['failed_functions'].append(match.group('name'))
+    add_excerpt_line(result, 'failure', line)
+
+
+def read_res_file(result, path):
+    # New style tests only write their .res file when they finish.
+    if not os.path.isfile(path):
+        return
+    result['finished'] = True
+    for line in read_lines(path):
+        match = RES_COUNT_REGEX.match(line)
+        if not match:
+            continue
+        count = int(match.group('count'))
+        if match.group('name') == 'executed':
+            result['executed'] = count
+        elif match.group('name') == 'failed' and count:
+            result['status'] = result['status'] or 'failed'
+
+
+def finish_result(result):
+    # Return the record of a result. Without a status given by the test run,
+    # a test failed if it wrote to test.log or did not finish.
+    status = result['status']
+    if status is None:
+        status = ('passed' if result['finished'] and not result['failure']
+                  else 'failed')
+    failure = result['failure']
+    if result['failure_omitted']:
+        failure = failure + ['... {0} more lines'.format(
+            result['failure_omitted'])]
+    skipped = result['skipped']
+    if result['skipped_omitted']:
+        skipped = skipped + ['... {0} more'.format(result['skipped_omitted'])]
+    return {'test': result['test'],
+            'status': status,
+            'duration': result['duration'],
+            'executed': result['executed'],
+            'skipped': skipped,
+            'failed_functions': result['failed_functions'],
+            'failure': '\n'.join(failure) if status != 'passed' else None}
+
+
+def parse_target(test_dir, target, offsets, status=None, duration=None):
+    # Result of a target that just ran in test_dir. Only one test runs at a
+    # time in a folder so what was written since the offsets is its own.
+    result = new_result(target)
+    for line in read_lines(os.path.join(test_dir, MESSAGES_NAME),
+                           offsets[MESSAGES_NAME]):
+        feed_message(result, line)
+    for line in read_lines(os.path.join(test_dir, LOG_NAME),
+                           offsets[LOG_NAME]):
+        feed_log(result, line)
+    if target.endswith('.res'):
+        read_res_file(result, os.path.join(test_dir, target))
+    else:
+        result['finished'] = os.path.isfile(os.path.join(test_dir, target))
+    if status is not None:
+        result['status'] = status
+    result['duration'] = duration
+    return finish_result(result)
+
+
+def parse_test_dir(test_dir):
+    # Yield the results left in a test folder by nmake, without durations.
+    # Sections of the messages file and test.log are matched by target so
+    # the excerpts of all tests are kept until the end.
+    results = {}
+
+    def get_result(target):
+        if target not in results:
+            results[target] = new_result(target)
+        return results[target]
+
+    for target, line in read_sections(os.path.join(test_dir, MESSAGES_NAME)):
+        if target:
+            feed_message(get_result(target), line)
+    for target, line in read_sections(os.path.join(test_dir, LOG_NAME)):
+        match = HUNG_REGEX.match(line)
+        if match:
+            target = match.group('target')
+        match = LEGACY_FAILED_REGEX.match(line)
+        if match:
+            target = match.group('name') + '.out'
+        if target:
+            feed_log(get_result(target), line)
+    for filename in os.listdir(test_dir):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == '.res':
+            read_res_file(get_result(filename), os.path.join(test_dir,
+                                                             filename))
+        elif extension == '.out':
+            get_result(filename)['finished'] = True
+    for target in sorted(results):
+        yield finish_result(results.pop(target))
+
+
+def clean_xml(text):
+    return INVALID_XML_REGEX.sub('?', text)
+
+
+def format_test_case(record, suite_name):
+    lines = ['  <testcase classname={0} name={1} time="{2:.3f}">'.format(
+        quoteattr(suite_name), quoteattr(clean_xml(record['test'])),
+        record['duration'] or 0.0)]
+    if record['status'] in ['failed', 'hung']:
+        failure = clean_xml(record['failure'] or '')
+        tag = 'failure' if record['status'] == 'failed' else 'error'
+        lines.append('    <{0} type="{1}" message={2}>{3}</{0}>'.format(
+            tag, record['status'],
+            quoteattr(failure.split('\n', 1)[0] or record['status']),
+            escape(failure)))
+    elif record['executed'] == 0 and record['skipped']:
+        lines.append('    <skipped message={0}/>'.format(
+            quoteattr(clean_xml(record['skipped'][0]))))
+    if record['skipped']:
+        lines.append('    <system-out>{0}</system-out>'.format(
+            escape(clean_xml('\n'.join(record['skipped'])))))
+    lines.append('  </testcase>\n')
+    return '\n'.join(lines)
+
+
+def open_output(path):
+    output_dir = os.path.dirname(path)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    return open(path, 'w', encoding='utf8')
+
+
+class Collector(object):
+    # Write each result as it is added. Results may be added from several
+    # threads.
+
+    def __init__(self, junit_path=None, json_path=None,
+                 suite_name=DEFAULT_SUITE_NAME):
+        self.junit_path = junit_path
+        self.suite_name = suite_name
+        self.lock = threading.Lock()
+        self.counts = {'tests': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+        self.time = 0.0
+        self.json_file = open_output(json_path) if json_path else None
+        self.cases_file = (open_output(junit_path + CASES_SUFFIX)
+                           if junit_path else None)
+
+    def add(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        case = format_test_case(record, self.suite_name)
+        with self.lock:
+            self.counts['tests'] += 1
+            if record['status'] == 'failed':
+                self.counts['failures'] += 1
+            elif record['status'] == 'hung':
+                self.counts['errors'] += 1
+            elif '<skipped' in case:
+                self.counts['skipped'] += 1
+            self.time += record['duration'] or 0.0
+            if self.json_file:
+                # Flushed so that the results can be followed during the run.
+                self.json_file.write(line)
+                self.json_file.flush()
+            if self.cases_file:
+                self.cases_file.write(case)
+
+    def close(self):
+        if self.json_file:
+            self.json_file.close()
+        if not self.cases_file:
+            return
+        self.cases_file.close()
+        cases_path = self.junit_path + CASES_SUFFIX
+        temp_path = self.junit_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf8') as junit_file:
+            junit_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                             '<testsuites>\n')
+            junit_file.write(
+                '<testsuite name={0} tests="{1}" failures="{2}" '
+                'errors="{3}" skipped="{4}" time="{5:.3f}">\n'.format(
+                    quoteattr(self.suite_name), self.counts['tests'],
+                    self.counts['failures'], self.counts['errors'],
+                    self.counts['skipped'], self.time))
+            with open(cases_path, 'r', encoding='utf8') as cases_file:
+                shutil.copyfileobj(cases_file, junit_file)
+            junit_file.write('</testsuite>\n</testsuites>\n')
+        os.replace(temp_path, self.junit_path)
+        os.remove(cases_path)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Export the results left in a Vim test folder.')
+    parser.add_argument('test_dir', help='folder where the tests ran.')
+    parser.add_argument('--junit', type=str, metavar='PATH',
+                        help='write the results as JUnit XML to this file.')
+    parser.add_argument('--json-lines', type=str, metavar='PATH',
+                        help='write the results as JSON lines to this file.')
+    parser.add_argument('--suite-name', type=str, default=DEFAULT_SUITE_NAME,
+                        help='name of the JUnit test suite '
+                        '(default: %(default)s).')
+    args = parser.parse_args()
+    if not args.junit and not args.json_lines:
+        parser.error('--junit or --json-lines is required.')
+    return args
+
+
+def main():
+    args = parse_arguments()
+    collector = Collector(args.junit, args.json_lines, args.suite_name)
+    try:
+        for record in parse_test_dir(args.test_dir):
+            collector.add(record)
+    finally:
+        collector.close()
+    print('{0} tests: {1} failed, {2} hung, {3} skipped.'.format(
+        collector.counts['tests'], collector.counts['failures'],
+        collector.counts['errors'], collector.counts['skipped']))
+
+
+if __name__ == '__main__':
+    main()
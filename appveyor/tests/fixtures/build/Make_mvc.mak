@@ -0,0 +1,11 @@
+# Toy makefile for the PGO tests of build.py, with the targets of Make_mvc.mak
+# used by build_vim. The linker is a stub run with the Python interpreter given
+# in the PYTHON environment variable.
+
+all: vim.exe
+
+vim.exe: main.c
+	"$(PYTHON)" stublink.py link $@
+
+clean:
+	"$(PYTHON)" stublink.py clean vim.exe
@@ -0,0 +1 @@
+int main(void) { return 0; }
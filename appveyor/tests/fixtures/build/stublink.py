@@ -0,0 +1,40 @@
+# Stub linker for the toy makefile. The executable records the kind of build
+# selected by the options in the LINK environment variable, and its size
+# depends on it.
+
+import glob
+import json
+import os
+import sys
+
+SIZES = {'normal': 1000, 'instrumented': 1500, 'optimized': 900}
+
+
+def get_mode(options):
+    if '/GENPROFILE' in options:
+        return 'instrumented'
+    if '/USEPROFILE' in options:
+        return 'optimized'
+    return 'normal'
+
+
+def main():
+    command, output = sys.argv[1:3]
+    if command == 'clean':
+        if os.path.isfile(output):
+            os.remove(output)
+        return
+    options = os.environ.get('LINK', '').split()
+    mode = get_mode(options)
+    if (mode == 'optimized' and
+            not glob.glob(os.path.splitext(output)[0] + '!*.pgc')):
+        sys.exit('no profile counts for {0}.'.format(output))
+    with open(os.environ['STUB_LOG'], 'a') as log_file:
+        log_file.write(json.dumps({'command': 'link',
+                                   'options': options}) + '\n')
+    with open(output, 'w') as output_file:
+        output_file.write(mode.ljust(SIZES[mode]))
+
+
+if __name__ == '__main__':
+    main()
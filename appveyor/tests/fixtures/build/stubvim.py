@@ -0,0 +1,25 @@
+# Stub Vim run on the executable written by the stub linker. Instrumented
+# executables write their profile counts next to them, like with /GENPROFILE.
+
+import json
+import os
+import sys
+
+
+def main():
+    vim_path = sys.argv[1]
+    with open(vim_path, 'r') as vim_file:
+        mode = vim_file.read().strip()
+    if mode == 'instrumented':
+        with open(os.path.splitext(vim_path)[0] + '!1.pgc', 'w'):
+            pass
+    with open(os.environ['STUB_LOG'], 'a') as log_file:
+        log_file.write(json.dumps({'command': 'vim',
+                                   'mode': mode,
+                                   'arguments': sys.argv[2:],
+                                   'runtime': os.environ['VIMRUNTIME']}) +
+                       '\n')
+
+
+if __name__ == '__main__':
+    main()
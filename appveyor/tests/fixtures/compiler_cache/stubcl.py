@@ -0,0 +1,26 @@
+# Stub of cl for the tests of the compiler cache. /E prints the source as its
+# preprocessed output, otherwise the object is the source with a header and
+# each compilation is logged to the file given by STUBCL_LOG.
+
+import os
+import sys
+
+
+def main():
+    arguments = sys.argv[1:]
+    source = arguments[-1]
+    with open(source, 'r') as source_file:
+        content = source_file.read()
+    if '/E' in arguments:
+        sys.stdout.write(content)
+        return
+    output = [argument[3:] for argument in arguments
+              if argument.startswith('/Fo')][0]
+    with open(os.environ['STUBCL_LOG'], 'a') as log_file:
+        log_file.write(source + '\n')
+    with open(output, 'w') as object_file:
+        object_file.write('object of ' + content)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# Stub compiler and linker for the toy makefile. Compiling takes some time so
+# that compilations running in parallel overlap.
+
+import os
+import sys
+import time
+
+COMPILE_TIME = 0.5
+
+
+def get_path(path):
+    return path.replace('\\', os.sep)
+
+
+def main():
+    command = sys.argv[1]
+    if command == 'mkdir':
+        os.makedirs(get_path(sys.argv[2]))
+        return
+    if command == 'compile':
+        time.sleep(COMPILE_TIME)
+    output = get_path(sys.argv[2])
+    for path in sys.argv[3:]:
+        if not os.path.isfile(get_path(path)):
+            sys.exit('{0} not found.'.format(path))
+    with open(output, 'w') as output_file:
+        output_file.write(' '.join(sys.argv[3:]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3 @@
+executed 5
+skipped 0
+failed 0
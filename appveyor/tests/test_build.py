@@ -0,0 +1,96 @@
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import build  # noqa: E402
+import toolchain  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'build')
+STUB_VIM_PATH = os.path.join(FIXTURE_DIR, 'stubvim.py')
+
+
+class PgoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.build_dir = os.path.join(self.temp_dir, 'build')
+        shutil.copytree(FIXTURE_DIR, self.build_dir,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        self.log_path = os.path.join(self.temp_dir, 'stub.log')
+        # Counts of a previous training.
+        open(os.path.join(self.build_dir, 'vim!9.pgc'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def get_environment(self, msvc, arch):
+        env = dict(os.environ, PYTHON=sys.executable,
+                   STUB_LOG=self.log_path)
+        env.pop('LINK', None)
+        return env
+
+    def build_vim(self):
+        # The parallel make driver runs the toy makefile, and the stub Vim
+        # is run with the Python interpreter.
+        get_training_cmd = build.get_training_cmd
+        args = build.parse_arguments(['--arch', '64', '-j', '2', '--pgo'])
+        output = io.StringIO()
+        with mock.patch.object(toolchain, 'get_environment',
+                               self.get_environment), \
+                mock.patch.object(build, 'get_training_cmd',
+                                  lambda *arguments: [
+                                      sys.executable, STUB_VIM_PATH] +
+                                  get_training_cmd(*arguments)), \
+                mock.patch.object(build, 'UNITY_TIMES_DIR',
+                                  os.path.join(self.temp_dir, 'unity')), \
+                contextlib.redirect_stdout(output):
+            build.build_vim(args, gui=False, build_dir=self.build_dir)
+        with open(self.log_path, 'r') as log_file:
+            return [json.loads(line) for line in log_file], output.getvalue()
+
+    def test_pgo_build(self):
+        log, output = self.build_vim()
+
+        steps = [(entry['command'], entry.get('mode'),
+                  entry.get('options')) for entry in log]
+        self.assertEqual(
+            steps,
+            [('link', None, [])] +
+            [('vim', 'normal', None)] * build.PGO_TIMING_RUNS +
+            [('link', None, ['/GENPROFILE']),
+             ('vim', 'instrumented', None),
+             ('link', None, ['/USEPROFILE'])] +
+            [('vim', 'optimized', None)] * build.PGO_TIMING_RUNS)
+
+        for entry in log:
+            if entry['command'] != 'vim':
+                continue
+            self.assertEqual(entry['arguments'][-2:],
+                             ['-S', build.PGO_TRAINING_SCRIPT])
+            self.assertIn('-es', entry['arguments'])
+            self.assertEqual(entry['runtime'],
+                             os.path.abspath(build.RUNTIME_DIR))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_dir, 'vim!9.pgc')))
+
+        self.assertIn('Training instrumented vim.exe.\n', output)
+        self.assertIn('PGO build of vim.exe:\n'
+                      '  size: 1000 -> 900 bytes (-10.0%)\n', output)
+        self.assertRegex(output, re.compile(
+            r'^  training time: \d+\.\d\ds -> \d+\.\d\ds \([+-]\d+\.\d%\)$',
+            re.MULTILINE))
+
+
+if __name__ == '__main__':
+    unittest.main()
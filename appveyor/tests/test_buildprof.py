@@ -0,0 +1,56 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import buildprof  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'buildprof')
+LOG_PATH = os.path.join(FIXTURE_DIR, 'build.log')
+TIMINGS_PATH = os.path.join(FIXTURE_DIR, 'timings.json')
+
+
+class BuildprofTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = buildprof.parse_logs([LOG_PATH], TIMINGS_PATH)
+
+    def get_durations(self, kind):
+        return dict((unit['name'], unit['duration'])
+                    for unit in self.profile['units']
+                    if unit['kind'] == kind)
+
+    def test_compile_times(self):
+        # Front end and back end passes are added up.
+        durations = self.get_durations('compile')
+        self.assertEqual(sorted(durations), ['buffer.c', 'window.c'])
+        self.assertAlmostEqual(durations['buffer.c'], 2.0)
+        self.assertAlmostEqual(durations['window.c'], 0.75)
+
+    def test_link_times(self):
+        # The output is given by the time line in recent versions of link,
+        # and by the link command in older ones.
+        durations = self.get_durations('link')
+        self.assertEqual(sorted(durations), ['gvim.exe', 'xxd.exe'])
+        self.assertAlmostEqual(durations['gvim.exe'], 3.20312)
+        self.assertAlmostEqual(durations['xxd.exe'], 0.125)
+
+    def test_target_times(self):
+        durations = self.get_durations('target')
+        self.assertAlmostEqual(durations['gvim.exe'], 3.5)
+        self.assertAlmostEqual(durations['ObjGXOLYHRZAMi386\\buffer.obj'],
+                               3.0)
+
+    def test_critical_path(self):
+        self.assertEqual(
+            [unit['name'] for unit in
+             buildprof.get_critical_path(self.profile)],
+            ['ObjGXOLYHRZAMi386', 'ObjGXOLYHRZAMi386\\buffer.obj',
+             'gvim.exe'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import compiler_cache  # noqa: E402
+
+STUB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'fixtures', 'compiler_cache', 'stubcl.py')
+SERVER_TIMEOUT = 10
+
+
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+def create_compiler(directory):
+    # The cache runs the compiler as a program.
+    if os.name == 'nt':
+        compiler_path = os.path.join(directory, 'cl.cmd')
+        with open(compiler_path, 'w') as compiler_file:
+            compiler_file.write('@"{0}" "{1}" %*\n'.format(sys.executable,
+                                                          STUB_PATH))
+        return compiler_path
+    compiler_path = os.path.join(directory, 'cl')
+    with open(compiler_path, 'w') as compiler_file:
+        compiler_file.write('#!/bin/sh\nexec "{0}" "{1}" "$@"\n'.format(
+            sys.executable, STUB_PATH))
+    os.chmod(compiler_path, 0o755)
+    return compiler_path
+
+
+class FlagsTest(unittest.TestCase):
+
+    def test_cacheable_flags(self):
+        for flags in [['/c'], ['/c', '/EHsc'], ['-c', '-EHsc'],
+                      ['/c', '/Ox', '/FS']]:
+            self.assertEqual(
+                compiler_cache.parse_arguments(flags + ['/Foobj/', 'a.cpp']),
+                (['a.cpp'], flags, 'obj/'))
+
+    def test_uncacheable_flags(self):
+        for flag in ['/E', '-EP', '/P', '/Zs', '/Yuvim.h', '/Fafoo.asm',
+                     '/FAcs', '/Fefoo.exe', '/Tcfoo.c']:
+            self.assertIsNone(
+                compiler_cache.parse_arguments(['/c', flag, 'a.cpp']))
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.previous_dir = os.getcwd()
+        os.chdir(self.work_dir)
+        self.compiler = create_compiler(self.work_dir)
+        self.log_path = os.path.join(self.work_dir, 'compilations.log')
+        with open('buffer.c', 'w') as source_file:
+            source_file.write('int buffer;\n')
+        self.server_dir = os.path.join(self.work_dir, 'server')
+        self.port = get_free_port()
+        self.server = subprocess.Popen(
+            [sys.executable, compiler_cache.__file__, 'serve',
+             '--port', str(self.port), '--directory', self.server_dir],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait_for_server()
+
+    def tearDown(self):
+        self.server.kill()
+        self.server.wait()
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir)
+
+    def wait_for_server(self):
+        deadline = time.time() + SERVER_TIMEOUT
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                return
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def compile(self, cache_name, url):
+        # Compile with a clean local cache.
+        cache_dir = os.path.join(self.work_dir, cache_name)
+        with mock.patch.dict(os.environ, {'COMPILER_CACHE_DIR': cache_dir,
+                                          'COMPILER_CACHE_URL': url,
+                                          'STUBCL_LOG': self.log_path}):
+            returncode = compiler_cache.compile_cached(
+                self.compiler, ['/c', '/Fobuffer.obj', 'buffer.c'])
+        self.assertEqual(returncode, 0)
+        with open('buffer.obj', 'r') as object_file:
+            self.assertEqual(object_file.read(), 'object of int buffer;\n')
+        os.remove('buffer.obj')
+        return compiler_cache.get_stats(cache_dir)
+
+    def get_compilations(self):
+        if not os.path.isfile(self.log_path):
+            return 0
+        with open(self.log_path, 'r') as log_file:
+            return len(log_file.readlines())
+
+    def test_shared_cache(self):
+        url = 'http://127.0.0.1:{0}'.format(self.port)
+        # A miss compiles the source and uploads the object.
+        stats = self.compile('first', url)
+        self.assertEqual(stats['miss'], 1)
+        self.assertEqual(self.get_compilations(), 1)
+        uploads = [filename for _, _, filenames in os.walk(self.server_dir)
+                   for filename in filenames]
+        self.assertEqual(len(uploads), 1)
+
+        # Another worker gets the object from the server.
+        stats = self.compile('second', url)
+        self.assertEqual(stats['remote_hit'], 1)
+        self.assertEqual(stats['miss'], 0)
+        self.assertEqual(self.get_compilations(), 1)
+
+    def test_unreachable_server(self):
+        # The build goes on without the shared cache.
+        url = 'http://127.0.0.1:{0}'.format(get_free_port())
+        stats = self.compile('local', url)
+        self.assertEqual(stats['miss'], 1)
+        self.assertEqual(self.get_compilations(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
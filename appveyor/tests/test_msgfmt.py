@@ -0,0 +1,55 @@
+import gettext
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import msgfmt  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'msgfmt')
+# Catalog built by GNU msgfmt and the PO file it was compiled from, with
+# fuzzy, untranslated and obsolete messages that msgfmt drops.
+PO_PATH = os.path.join(FIXTURE_DIR, 'ie.po')
+MO_PATH = os.path.join(FIXTURE_DIR, 'ie.mo')
+
+
+class MsgfmtTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.mo_path = os.path.join(self.temp_dir, 'ie.mo')
+        msgfmt.compile_file(PO_PATH, self.mo_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_same_as_gnu_msgfmt(self):
+        # The hash table of the catalog has collisions, and its messages
+        # have contexts and plural forms.
+        with open(self.mo_path, 'rb') as mo_file:
+            output = mo_file.read()
+        with open(MO_PATH, 'rb') as mo_file:
+            expected = mo_file.read()
+        self.assertEqual(output, expected)
+
+    def test_messages(self):
+        with open(self.mo_path, 'rb') as mo_file:
+            translations = gettext.GNUTranslations(mo_file)
+        self.assertEqual(translations.gettext('%.1f GB'), '%.1f Go')
+        self.assertEqual(translations.pgettext('GDateTime', '%m/%d/%y'),
+                         '%d.%m.%y')
+        self.assertEqual(translations.ngettext('%s byte', '%s bytes', 2),
+                         '%s octetes')
+        self.assertEqual(translations.gettext('%s kilobyte'), '%s kilobyte')
+        self.assertEqual(translations.pgettext('file size', '%u bits'),
+                         '%u bits')
+        self.assertEqual(translations.gettext('Not a file'), 'Not a file')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import pmake  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'pmake')
+OBJECTS = ['obj\\a.obj', 'obj\\b.obj', 'obj\\c.obj']
+
+
+class PmakeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.build_dir = os.path.join(tempfile.mkdtemp(), 'build')
+        shutil.copytree(FIXTURE_DIR, self.build_dir,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        self.makefile = pmake.Makefile(
+            os.path.join(self.build_dir, 'Makefile'),
+            {'PYTHON': sys.executable}, cwd=self.build_dir)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.build_dir))
+
+    def test_inference_rule(self):
+        # Targets in the output folder are written with backslashes, like in
+        # Make_mvc.mak, and the rule with a forward slash.
+        target = self.makefile.get_target('obj\\a.obj')
+        self.assertEqual(target.inferred, 'a.c')
+        self.assertEqual(target.dependencies, ['a.c', 'obj'])
+        self.assertEqual(target.commands, [('$(CC) $@ $<', [])])
+        self.assertIsNone(self.makefile.find_inference_rule('lib\\a.obj', []))
+
+    def test_command_line_macros(self):
+        # Only quotes around the whole value are removed.
+        _, macros, goals = pmake.parse_command_line(
+            ['/f', 'Makefile', 'CC="cl /nologo"',
+             'LINKARGS1=/LTCG "C:\\pch dir\\vim.obj"', 'all'])
+        self.assertEqual(macros, {'CC': 'cl /nologo',
+                                  'LINKARGS1': '/LTCG "C:\\pch dir\\vim.obj"'})
+        self.assertEqual(goals, ['all'])
+
+    def test_parallel_build(self):
+        timings_path = os.path.join(self.build_dir, 'timings.json')
+        pmake.Executor(self.makefile, jobs=3,
+                       timings=timings_path).build(None)
+
+        with open(timings_path, 'r') as timings_file:
+            timings = dict((timing['name'], timing) for timing in
+                           (json.loads(line) for line in timings_file))
+        self.assertEqual(sorted(timings), sorted(['app.exe', 'obj'] +
+                                                 OBJECTS))
+        # Objects are compiled at the same time, after their folder is
+        # created, and linked once they are all compiled.
+        self.assertLess(max(timings[obj]['start'] for obj in OBJECTS),
+                        min(timings[obj]['end'] for obj in OBJECTS))
+        for obj in OBJECTS:
+            self.assertGreaterEqual(timings[obj]['start'],
+                                    timings['obj']['end'])
+            self.assertGreaterEqual(timings['app.exe']['start'],
+                                    timings[obj]['end'])
+        self.assertTrue(os.path.isfile(os.path.join(self.build_dir,
+                                                    'app.exe')))
+
+
+if __name__ == '__main__':
+    unittest.main()
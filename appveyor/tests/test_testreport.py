@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import testreport  # noqa: E402
+
+# Results left by nmake in a test folder: test_alot passed with a skipped
+# test, test_bad failed, test_skip skipped all its tests, test_hang was killed
+# by test.py, test_new passed with the counts of recent versions in its .res
+# file, and the legacy test42 failed.
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures', 'testreport')
+STATUSES = {
+    'test1.out': 'passed',
+    'test42.out': 'failed',
+    'test_alot.res': 'passed',
+    'test_bad.res': 'failed',
+    'test_hang.res': 'hung',
+    'test_new.res': 'passed',
+    'test_skip.res': 'passed',
+}
+
+
+class TestReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.junit_path = os.path.join(self.output_dir, 'results.xml')
+        self.json_path = os.path.join(self.output_dir, 'results.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def export(self):
+        collector = testreport.Collector(self.junit_path, self.json_path)
+        try:
+            for record in testreport.parse_test_dir(FIXTURE_DIR):
+                collector.add(record)
+        finally:
+            collector.close()
+
+    def test_json_lines(self):
+        self.export()
+        with open(self.json_path, 'r') as json_file:
+            records = dict((record['test'], record) for record in
+                           (json.loads(line) for line in json_file))
+        self.assertEqual(dict((test, record['status'])
+                              for test, record in records.items()),
+                         STATUSES)
+        self.assertEqual(records['test_alot.res']['executed'], 120)
+        self.assertEqual(records['test_alot.res']['skipped'],
+                         ['SKIPPED Test_foo: only works on Unix'])
+        self.assertIsNone(records['test_alot.res']['failure'])
+        self.assertEqual(records['test_bad.res']['failed_functions'],
+                         ['Test_x'])
+        self.assertEqual(
+            records['test_bad.res']['failure'],
+            "Found errors in Test_x():\n"
+            "function RunTheTest[40]..Test_x line 2: Expected 'a' but got "
+            "'b' <&>")
+        self.assertEqual(records['test_hang.res']['failure'],
+                         'test_hang.res HUNG: timed out after 900 seconds')
+        self.assertEqual(records['test_new.res']['executed'], 5)
+        self.assertEqual(records['test42.out']['failure'], 'test42 FAILED')
+
+    def test_junit(self):
+        self.export()
+        root = ElementTree.parse(self.junit_path).getroot()
+        suite = root.find('testsuite')
+        self.assertEqual(dict((name, suite.get(name)) for name in
+                              ['tests', 'failures', 'errors', 'skipped']),
+                         {'tests': '7', 'failures': '2', 'errors': '1',
+                          'skipped': '1'})
+        cases = dict((case.get('name'), case)
+                     for case in suite.findall('testcase'))
+        self.assertEqual(sorted(cases), sorted(STATUSES))
+        self.assertEqual(list(cases['test_new.res']), [])
+        failure = cases['test_bad.res'].find('failure')
+        self.assertEqual(failure.get('message'), 'Found errors in Test_x():')
+        self.assertTrue(failure.text.endswith("got 'b' <&>"))
+        self.assertEqual(cases['test_hang.res'].find('error').get('type'),
+                         'hung')
+        self.assertEqual(cases['test_skip.res'].find('skipped').get('message'),
+                         'SKIPPED Test_y: missing +channel')
+        self.assertIsNone(cases['test_alot.res'].find('skipped'))
+        self.assertFalse(os.path.exists(self.junit_path +
+                                        testreport.CASES_SUFFIX))
+
+    def test_parse_target(self):
+        # Only what was written after the offsets belongs to the target.
+        test_dir = os.path.join(self.output_dir, 'testdir')
+        shutil.copytree(FIXTURE_DIR, test_dir)
+        offsets = testreport.get_offsets(test_dir)
+        with open(os.path.join(test_dir, 'messages'), 'a') as messages_file:
+            messages_file.write('\nFrom test_z.vim:\nExecuted 2 tests\n')
+        with open(os.path.join(test_dir, 'test.log'), 'a') as log_file:
+            log_file.write('\nFrom test_z.vim:\n' + ''.join(
+                'error {0}\n'.format(number) for number in range(60)))
+        record = testreport.parse_target(test_dir, 'test_z.res', offsets,
+                                         'failed', 1.5)
+        self.assertEqual(record['status'], 'failed')
+        self.assertEqual(record['duration'], 1.5)
+        self.assertEqual(record['executed'], 2)
+        failure = record['failure'].split('\n')
+        self.assertEqual(len(failure), testreport.MAX_EXCERPT_LINES + 1)
+        self.assertEqual(failure[0], 'error 0')
+        self.assertEqual(failure[-1], '... 10 more lines')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+# Selection of the tests affected by a range of commits of the Vim sources.
+#
+# Sources are mapped to tests with a coverage map, collected on a full run of
+# the tests under OpenCppCoverage and stored in the cache folder. The map
+# records the build flags of Vim, as shown by :version, since they change what
+# the tests run. A full run is needed when the map is missing, too old,
+# or made with other build flags, on scheduled builds, and when a change
+# cannot be mapped to tests (headers, makefiles, test scripts shared by all
+# tests, new sources).
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+from distutils.spawn import find_executable
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+COVERAGE_MAP_PATH = os.path.join(SCRIPT_DIR, '..', 'cache', 'tests',
+                                 'coverage.json')
+STATE_PATH = os.path.join(SCRIPT_DIR, '..', 'cache', 'tests',
+                          'selection.json')
+COVERAGE_TOOL = 'OpenCppCoverage'
+COVERAGE_SHIM_NAME = 'vimcov.cmd'
+COVERAGE_OUTPUT_VARIABLE = 'VIMCOV_OUTPUT'
+# Maximum age of the coverage map and of the last full run, in seconds.
+MAX_COVERAGE_AGE = 7 * 24 * 3600
+FULL_RUN_INTERVAL = 24 * 3600
+
+# Changes that do not affect the tests.
+IGNORED_CHANGES = [
+    re.compile(r'^runtime/doc/'),
+    re.compile(r'^src/version\.c$'),
+    re.compile(r'^(README|CONTRIBUTING|Filelist|\.)'),
+]
+SOURCE_REGEX = re.compile(r'^src/[^/]+\.(c|cpp)$')
+TEST_REGEX = re.compile(r'^src/testdir/(test\w*)\.(vim|in|ok)$')
+VERSION_FLAGS_REGEX = re.compile(r'^(Compilation|Linking):')
+VERSION_FEATURES_REGEX = re.compile(r'^\s*([+-]\S+\s*)+$')
+
+
+def get_coverage_tool():
+    return find_executable(COVERAGE_TOOL)
+
+
+def get_version_lines(vim_path):
+    # gvim shows the output of --version in a dialog so Vim writes it to a
+    # file.
+    fd, version_path = tempfile.mkstemp(suffix='.txt')
+    os.close(fd)
+    try:
+        subprocess.check_call(
+            [vim_path, '-i', 'NONE', '-u', 'NONE', '-U', 'NONE', '-N',
+             '--not-a-term',
+             '-c', "call writefile(split(execute('version'), \"\\n\"), "
+                   "'{0}')".format(version_path.replace("'", "''")),
+             '-c', 'qall!'])
+        with open(version_path, 'r', errors='replace') as version_file:
+            return version_file.read().splitlines()
+    finally:
+        os.remove(version_path)
+
+
+def get_build_flags_hash(vim_path):
+    # Hash of the features and the compilation and link commands of Vim.
+    sha1 = hashlib.sha1()
+    for line in get_version_lines(vim_path):
+        if (VERSION_FLAGS_REGEX.match(line) or
+                VERSION_FEATURES_REGEX.match(line)):
+            sha1.update(line.strip().encode('utf8') + b'\n')
+    return sha1.hexdigest()
+
+
+def get_changed_files(vim_dir, revision_range):
+    output = subprocess.check_output(
+        ['git', 'diff', '--name-only', revision_range], cwd=vim_dir)
+    return [path for path in output.decode('utf8').splitlines() if path]
+
+
+def make_cache_dir():
+    cache_dir = os.path.dirname(COVERAGE_MAP_PATH)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+
+def load_last_full_run():
+    if not os.path.isfile(STATE_PATH):
+        return None
+    with open(STATE_PATH, 'r') as state_file:
+        return json.load(state_file)['last_full_run']
+
+
+def save_last_full_run():
+    make_cache_dir()
+    with open(STATE_PATH, 'w') as state_file:
+        json.dump({'last_full_run': time.time()}, state_file)
+
+
+def load_coverage_map():
+    if not os.path.isfile(COVERAGE_MAP_PATH):
+        return None
+    with open(COVERAGE_MAP_PATH, 'r') as coverage_file:
+        return json.load(coverage_file)
+
+
+def save_coverage_map(coverage, build_flags_hash):
+    make_cache_dir()
+    with open(COVERAGE_MAP_PATH, 'w') as coverage_file:
+        json.dump({'time': time.time(),
+                   'build_flags': build_flags_hash,
+                   'tests': dict((target, sorted(sources))
+                                 for target, sources in coverage.items())},
+                  coverage_file, indent=2, sort_keys=True)
+
+
+def needs_coverage(coverage_map, build_flags_hash):
+    return (coverage_map is None or
+            coverage_map['build_flags'] != build_flags_hash or
+            time.time() - coverage_map['time'] > MAX_COVERAGE_AGE)
+
+
+def select_targets(targets, changed_files, coverage_map, build_flags_hash,
+                   last_full_run):
+    # Return the targets to run and the reason for a full run, if any.
+    if os.environ.get('APPVEYOR_SCHEDULED_BUILD', '').lower() == 'true':
+        return targets, 'scheduled build'
+    if coverage_map is None:
+        return targets, 'no coverage map'
+    if coverage_map['build_flags'] != build_flags_hash:
+        return targets, 'build flags changed'
+    if time.time() - coverage_map['time'] > MAX_COVERAGE_AGE:
+        return targets, 'coverage map is too old'
+    if (last_full_run is None or
+            time.time() - last_full_run > FULL_RUN_INTERVAL):
+        return targets, 'last full run is too old'
+
+    roots = dict((os.path.splitext(target)[0], target) for target in targets)
+    selected = set()
+    for path in changed_files:
+        if any(regex.search(path) for regex in IGNORED_CHANGES):
+            continue
+        match = TEST_REGEX.match(path)
+        if match and match.group(1) in roots:
+            selected.add(roots[match.group(1)])
+            continue
+        if not SOURCE_REGEX.match(path):
+            return targets, '{0} changed'.format(path)
+        if not any(path in sources
+                   for sources in coverage_map['tests'].values()):
+            return targets, '{0} is not in the coverage map'.format(path)
+        selected.update(target for target in targets
+                        if path in coverage_map['tests'].get(target, []))
+    return [target for target in targets if target in selected], None
+
+
+def create_coverage_shim(shim_dir, coverage_tool, vim_path, sources_dir):
+    # Used as VIMPROG by the makefile. The coverage report of each run is
+    # written to the file given by the VIMCOV_OUTPUT environment variable.
+    shim_path = os.path.join(shim_dir, COVERAGE_SHIM_NAME)
+    with open(shim_path, 'w') as shim_file:
+        shim_file.write(
+            '@"{0}" --quiet --sources "{1}" '
+            '--export_type cobertura:"%{2}%" -- "{3}" %*\n'.format(
+                coverage_tool, os.path.abspath(sources_dir),
+                COVERAGE_OUTPUT_VARIABLE, os.path.abspath(vim_path)))
+    return shim_path
+
+
+def parse_coverage_report(report_path, root_dir):
+    # Return the sources, relative to the Vim folder, with at least one line
+    # run in a Cobertura report.
+    sources = set()
+    if not os.path.isfile(report_path):
+        return sources
+    root_path = os.path.abspath(root_dir)
+    normalized_root = os.path.normcase(root_path)
+    base_dirs = []
+    for _, element in ElementTree.iterparse(report_path):
+        if element.tag == 'source' and element.text:
+            base_dirs.append(element.text.strip())
+        elif element.tag == 'class':
+            if any(int(line.get('hits', '0')) for line in
+                   element.iter('line')):
+                filename = element.get('filename')
+                for base_dir in base_dirs or ['']:
+                    # Sources may be drive letters.
+                    if base_dir.endswith(':'):
+                        base_dir += os.sep
+                    path = os.path.abspath(os.path.join(base_dir, filename))
+                    if os.path.normcase(path).startswith(
+                            normalized_root + os.sep):
+                        sources.add(os.path.relpath(path, root_path).replace(
+                            os.sep, '/'))
+                        break
+            element.clear()
+    return sources
@@ -0,0 +1,175 @@
+# Microsoft Visual C++ toolchain setup shared by the build, package, and test
+# scripts.
+#
+# Running vcvarsall.bat is slow so the environment it sets up is resolved once
+# per MSVC version and architecture and stored on disk. Commands are then run
+# directly with that environment. The cache is invalidated when vcvarsall.bat
+# or the tools it puts in PATH change.
+
+import json
+import locale
+import os
+import shutil
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(SCRIPT_DIR, '..', 'cache', 'toolchain')
+
+MSVC_BIN_DIR = os.path.join('..', '..', 'VC')
+# Tools whose timestamps are part of the cache signature.
+SIGNATURE_TOOLS = ['cl.exe', 'link.exe', 'nmake.exe']
+# Variables to which vcvarsall.bat prepends folders.
+PATH_VARIABLES = ['PATH', 'INCLUDE', 'LIB', 'LIBPATH']
+
+# Changes made by vcvarsall.bat to the environment, by (msvc, arch).
+ENVIRONMENT_CHANGES = {}
+
+
+def get_msvc_dir(msvc):
+    if msvc == 11:
+        return os.path.join(os.environ['VS110COMNTOOLS'], MSVC_BIN_DIR)
+    if msvc == 12:
+        return os.path.join(os.environ['VS120COMNTOOLS'], MSVC_BIN_DIR)
+    if msvc == 14:
+        return os.path.join(os.environ['VS140COMNTOOLS'], MSVC_BIN_DIR)
+    if msvc == 15:
+        return get_msvc15_dir()
+    raise RuntimeError('msvc parameter should be 11, 12, 14, or 15.')
+
+
+def get_msvc15_dir():
+    vswhere = os.path.join(os.environ['ProgramFiles(x86)'],
+                           'Microsoft Visual Studio',
+                           'Installer',
+                           'vswhere.exe')
+    if not os.path.exists(vswhere):
+        raise RuntimeError('cannot find vswhere. '
+                           'VS 2017 version 15.2 or later is required.')
+
+    installation_path = subprocess.check_output(
+        [vswhere, '-latest', '-property', 'installationPath']
+    ).strip().decode('utf8')
+    return os.path.join(installation_path, 'VC', 'Auxiliary', 'Build')
+
+
+def get_vc_mod(arch):
+    if arch == 64:
+        return 'x86_amd64'
+    return 'x86'
+
+
+def normalize_variable(name):
+    if os.name == 'nt':
+        return name.upper()
+    return name
+
+
+def get_cache_path(msvc, arch):
+    return os.path.join(CACHE_DIR, 'msvc{0}-{1}.json'.format(msvc, arch))
+
+
+def find_program(name, environment):
+    return shutil.which(name, path=environment.get('PATH', ''))
+
+
+def get_signature(vc_vars_script_path, environment):
+    signature = []
+    paths = [vc_vars_script_path] + [find_program(tool, environment)
+                                     for tool in SIGNATURE_TOOLS]
+    for path in paths:
+        if path is None or not os.path.isfile(path):
+            signature.append(None)
+            continue
+        stat = os.stat(path)
+        signature.append([os.path.normcase(path), stat.st_size,
+                          int(stat.st_mtime)])
+    return signature
+
+
+def run_vc_vars_script(vc_vars_script_path, arch):
+    output = subprocess.check_output(
+        '"{0}" {1} > nul && set'.format(vc_vars_script_path,
+                                        get_vc_mod(arch)),
+        shell=True).decode(locale.getpreferredencoding(False))
+
+    changes = {}
+    for line in output.splitlines():
+        name, separator, value = line.partition('=')
+        if not separator or not name:
+            continue
+        name = normalize_variable(name)
+        previous_value = os.environ.get(name)
+        if previous_value == value:
+            continue
+        if (name in PATH_VARIABLES and previous_value and
+                value.endswith(previous_value)):
+            changes[name] = ['prepend', value[:-len(previous_value)]]
+        else:
+            changes[name] = ['set', value]
+    return changes
+
+
+def apply_changes(changes, base_environment):
+    environment = dict(base_environment)
+    for name, (action, value) in changes.items():
+        if action == 'prepend':
+            environment[name] = value + base_environment.get(name, '')
+        else:
+            environment[name] = value
+    return environment
+
+
+def load_changes(msvc, arch):
+    cache_path = get_cache_path(msvc, arch)
+    if not os.path.isfile(cache_path):
+        return None
+
+    with open(cache_path, 'r') as cache_file:
+        cache = json.load(cache_file)
+
+    environment = apply_changes(cache['changes'], os.environ)
+    if get_signature(cache['vcvarsall'], environment) != cache['signature']:
+        print('MSVC {0} toolchain changed. Resolving its environment '
+              'again.'.format(msvc))
+        return None
+    return cache['changes']
+
+
+def save_changes(msvc, arch, vc_vars_script_path, changes):
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+
+    # Written to a temporary file first as several builds may resolve the same
+    # toolchain at the same time.
+    environment = apply_changes(changes, os.environ)
+    cache_path = get_cache_path(msvc, arch)
+    temporary_path = '{0}.{1}'.format(cache_path, os.getpid())
+    with open(temporary_path, 'w') as cache_file:
+        json.dump({'vcvarsall': vc_vars_script_path,
+                   'signature': get_signature(vc_vars_script_path,
+                                              environment),
+                   'changes': changes}, cache_file)
+    os.replace(temporary_path, cache_path)
+
+
+def get_environment(msvc, arch):
+    # Return a copy of the current environment set up for the toolchain.
+    key = (msvc, arch)
+    if key not in ENVIRONMENT_CHANGES:
+        changes = load_changes(msvc, arch)
+        if changes is None:
+            msvc_dir = get_msvc_dir(msvc)
+            vc_vars_script_path = os.path.abspath(
+                os.path.join(msvc_dir, 'vcvarsall.bat'))
+            changes = run_vc_vars_script(vc_vars_script_path, arch)
+            save_changes(msvc, arch, vc_vars_script_path, changes)
+        ENVIRONMENT_CHANGES[key] = changes
+    return apply_changes(ENVIRONMENT_CHANGES[key], os.environ)
+
+
+def get_nmake_cmd(msvc, arch):
+    nmake = find_program('nmake.exe', get_environment(msvc, arch))
+    if nmake is None:
+        raise RuntimeError('cannot find nmake in MSVC {0} '
+                           'environment.'.format(msvc))
+    return [nmake]
@@ -0,0 +1,112 @@
+# Unity builds: sources are compiled in batches, each batch being a generated
+# file that includes several sources, so that vim.h and the headers it
+# includes are parsed once per batch instead of once per source.
+#
+# Sources sharing file scope names (static functions and variables, types,
+# and macros) are put in different batches. Sources with preprocessor
+# directives before including vim.h change how the headers are read and are
+# compiled on their own.
+
+import os
+import re
+
+DEFAULT_BATCH_SIZE = 16
+UNITY_NAME = 'unity_{0}_{1}.c'
+UNITY_PATTERN = 'unity_*.c'
+
+COMMENT_REGEX = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+# Names declared at file scope. In the Vim sources, the return type of a
+# function is indented on the line before its name, which starts at column 0.
+SYMBOL_REGEXES = [
+    re.compile(r'^static\s+[^;{}()=\[#]*?(\w+)\s*[(\[=;,]', re.MULTILINE),
+    re.compile(r'^[ \t]+static\s+[^;{}()=\[#\n]*\n(\w+)\s*\(', re.MULTILINE),
+    re.compile(r'^typedef\s+(?:[^;{}]|\{[^}]*\})*?(\w+)\s*;', re.MULTILINE),
+    re.compile(r'^(?:typedef\s+)?(?:struct|union|enum)\s+(\w+)\s*\{',
+               re.MULTILINE),
+    re.compile(r'^\s*#\s*define\s+(\w+)', re.MULTILINE),
+]
+PREAMBLE_REGEX = re.compile(r'^\s*#', re.MULTILINE)
+VIM_HEADER_REGEX = re.compile(r'^\s*#\s*include\s+"vim\.h"', re.MULTILINE)
+
+
+def read_source(path):
+    with open(path, 'r', errors='replace') as source_file:
+        return COMMENT_REGEX.sub(' ', source_file.read())
+
+
+def get_symbols(text):
+    symbols = set()
+    for regex in SYMBOL_REGEXES:
+        symbols.update(regex.findall(text))
+    return symbols
+
+
+def can_be_batched(text):
+    # Only sources including vim.h before any other directive.
+    match = VIM_HEADER_REGEX.search(text)
+    if not match:
+        return False
+    return not PREAMBLE_REGEX.search(text, 0, match.start())
+
+
+def make_batches(sources, batch_size=DEFAULT_BATCH_SIZE):
+    # Put each source in the first batch with room left and no name in common
+    # with it. Return the batches and the sources to compile on their own.
+    batches = []
+    separate_sources = []
+    for source in sources:
+        text = read_source(source)
+        if not can_be_batched(text):
+            separate_sources.append(source)
+            continue
+        symbols = get_symbols(text)
+        for batch in batches:
+            if (len(batch['sources']) < batch_size and
+                    not batch['symbols'] & symbols):
+                batch['sources'].append(source)
+                batch['symbols'] |= symbols
+                break
+        else:
+            batches.append({'sources': [source], 'symbols': set(symbols)})
+    # A batch of one source is the source itself.
+    for batch in list(batches):
+        if len(batch['sources']) == 1:
+            separate_sources.extend(batch['sources'])
+            batches.remove(batch)
+    return [batch['sources'] for batch in batches], separate_sources
+
+
+def write_batch(path, sources, dependencies):
+    # The file is only written if its content changed, and gets the time of
+    # its newest source or dependency, so that make rebuilds the batch when
+    # one of them changes.
+    content = ''.join(['/* Generated for unity builds. Do not edit. */\n'] +
+                      ['#include "{0}"\n'.format(os.path.basename(source))
+                       for source in sources])
+    if os.path.isfile(path):
+        with open(path, 'r') as batch_file:
+            if batch_file.read() != content:
+                os.remove(path)
+    if not os.path.isfile(path):
+        with open(path, 'w') as batch_file:
+            batch_file.write(content)
+
+    mtime = max(os.path.getmtime(source)
+                for source in sources + dependencies + [path])
+    os.utime(path, (mtime, mtime))
+
+
+def write_batches(build_dir, name, batches, dependencies=None):
+    paths = []
+    for number, sources in enumerate(batches, 1):
+        path = os.path.join(build_dir, UNITY_NAME.format(name, number))
+        write_batch(path, sources, dependencies or [])
+        paths.append(path)
+
+    # Remove batches left from a previous build with a larger batch count.
+    number = len(batches) + 1
+    while os.path.isfile(os.path.join(build_dir,
+                                      UNITY_NAME.format(name, number))):
+        os.remove(os.path.join(build_dir, UNITY_NAME.format(name, number)))
+        number += 1
+    return paths
@@ -0,0 +1,132 @@
+# Compression of the package executables with UPX.
+#
+# Files are compressed in parallel to a cache folder keyed on their content,
+# the UPX version, and its options, so that unchanged files are not compressed
+# again. Each result is tested by UPX and, when a launch command is known for
+# it, run once. Files that fail any of these steps are left uncompressed.
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import staging
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(SCRIPT_DIR, '..', 'cache', 'upx')
+OPTIONS = ['--best', '-q']
+EXTENSIONS = ['.exe', '.dll']
+LAUNCH_TIMEOUT = 60
+
+
+def get_upx_version(upx):
+    output = subprocess.check_output([upx, '--version'])
+    return output.decode('utf8', 'replace').splitlines()[0].strip()
+
+
+def get_cache_key(path, upx_version):
+    sha256 = hashlib.sha256()
+    sha256.update(upx_version.encode('utf8'))
+    for option in OPTIONS:
+        sha256.update(b'\0' + option.encode('utf8'))
+    sha256.update(b'\0' + staging.get_file_hash(path).encode('utf8'))
+    return sha256.hexdigest()
+
+
+def is_eligible(path):
+    return os.path.splitext(path)[1].lower() in EXTENSIONS
+
+
+def check_launch(path, launch_args):
+    try:
+        return subprocess.call([path] + launch_args,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               timeout=LAUNCH_TIMEOUT) == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def compress(upx, upx_version, path, launch_args=None):
+    # Compress the file into the cache. Return the cached path, or None if the
+    # file cannot be compressed, the compression time, and whether the result
+    # was already cached.
+    cache_key = get_cache_key(path, upx_version)
+    extension = os.path.splitext(path)[1]
+    cached_path = os.path.join(CACHE_DIR, cache_key + extension)
+    info_path = os.path.join(CACHE_DIR, cache_key + '.json')
+    if os.path.isfile(cached_path) and os.path.isfile(info_path):
+        with open(info_path, 'r') as info_file:
+            return cached_path, json.load(info_file)['time'], True
+
+    start_time = time.time()
+    temp_path = os.path.join(CACHE_DIR, '{0}.{1}.tmp{2}'.format(
+        cache_key, threading.get_ident(), extension))
+    staging.remove_file(temp_path)
+    if (subprocess.call([upx] + OPTIONS + ['-o', temp_path, path],
+                        stdout=subprocess.DEVNULL) or
+            subprocess.call([upx, '-t', '-q', temp_path],
+                            stdout=subprocess.DEVNULL) or
+            (launch_args is not None and
+             not check_launch(temp_path, launch_args))):
+        staging.remove_file(temp_path)
+        return None, time.time() - start_time, False
+
+    elapsed_time = time.time() - start_time
+    os.replace(temp_path, cached_path)
+    with open(info_path, 'w') as info_file:
+        json.dump({'time': elapsed_time}, info_file)
+    return cached_path, elapsed_time, False
+
+
+def compress_file(upx, upx_version, path, launch_args=None):
+    # Replace the file by its compressed version. The file is not modified in
+    # place since it may be a hardlink to a build output.
+    size = os.path.getsize(path)
+    cached_path, elapsed_time, cached = compress(upx, upx_version, path,
+                                                 launch_args)
+    if cached_path is None:
+        return {'path': path, 'status': 'failed', 'size': size,
+                'compressed_size': size, 'time': elapsed_time}
+    staging.stage_file(cached_path, path)
+    return {'path': path, 'status': 'cached' if cached else 'compressed',
+            'size': size, 'compressed_size': os.path.getsize(cached_path),
+            'time': elapsed_time}
+
+
+def compress_files(upx, paths, launch_args=None, jobs=None):
+    # Launch arguments are given by file name. Return a report entry per file.
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    upx_version = get_upx_version(upx)
+    launch_args = launch_args or {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(
+            lambda path: compress_file(
+                upx, upx_version, path,
+                launch_args.get(os.path.basename(path))),
+            paths))
+
+
+def write_report(report, report_path):
+    lines = ['{0:<40} {1:>10} {2:>10} {3:>7} {4:>8}  {5}'.format(
+        'File', 'Size', 'Packed', 'Saved', 'Time', 'Status')]
+    for entry in sorted(report,
+                        key=lambda entry: entry['compressed_size'] -
+                        entry['size']):
+        saved = entry['size'] - entry['compressed_size']
+        lines.append('{0:<40} {1:>10} {2:>10} {3:>6.1f}% {4:>7.2f}s  '
+                     '{5}'.format(os.path.basename(entry['path']),
+                                  entry['size'], entry['compressed_size'],
+                                  100.0 * saved / max(entry['size'], 1),
+                                  entry['time'], entry['status']))
+    lines.append('Saved {0} bytes in {1:.2f}s.'.format(
+        sum(entry['size'] - entry['compressed_size'] for entry in report),
+        sum(entry['time'] for entry in report)))
+    with open(report_path, 'w') as report_file:
+        report_file.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines))